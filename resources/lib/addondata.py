@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v2.0 (see COPYING or https://www.gnu.org/licenses/gpl-2.0.txt)
+"""Implements a registry of data received from add-ons"""
+
+from __future__ import absolute_import, division, unicode_literals
+import json
+from collections import OrderedDict
+from threading import Lock
+from time import time
+from utils import log as ulog
+
+# Only the fields the service uses are kept from add-on payloads
+PAYLOAD_FIELDS = ('id', 'notification_offset', 'notification_time', 'play_info', 'play_url', 'prefetch')
+CURRENT_EPISODE_FIELDS = ('episode', 'episodeid', 'season', 'showtitle', 'title', 'tvshowid')
+NEXT_EPISODE_FIELDS = ('episode', 'episodeid', 'firstaired', 'playcount', 'plot', 'rating', 'runtime',
+                       'season', 'showtitle', 'title', 'tvshowid')
+ART_FIELDS = ('thumb', 'tvshow.clearart', 'tvshow.clearlogo', 'tvshow.fanart', 'tvshow.landscape', 'tvshow.poster')
+# Upcoming episodes in next_episodes bring their own play information
+ITEM_FIELDS = ('notification_offset', 'notification_time', 'play_info', 'play_url')
+# Maximum number of upcoming episodes kept from a payload
+MAX_NEXT_EPISODES = 25
+
+
+def trim_episode(episode, fields, art_fields=()):
+    """Return a copy of an episode with only the given fields and artwork"""
+    if not isinstance(episode, dict):
+        return {}
+    trimmed = {key: episode.get(key) for key in fields if key in episode}
+    if art_fields:
+        art = episode.get('art') if isinstance(episode.get('art'), dict) else {}
+        trimmed['art'] = {key: art.get(key) for key in art_fields if art.get(key)}
+    return trimmed
+
+
+def trim_payload(data):
+    """Return a normalized copy of an add-on payload with only the fields the service uses"""
+    trimmed = {key: data.get(key) for key in PAYLOAD_FIELDS if data.get(key) is not None}
+    trimmed['current_episode'] = trim_episode(data.get('current_episode'), CURRENT_EPISODE_FIELDS)
+    upcoming = [episode for episode in data.get('next_episodes') or [] if isinstance(episode, dict)][:MAX_NEXT_EPISODES]
+    if not upcoming:
+        trimmed['next_episode'] = trim_episode(data.get('next_episode'), NEXT_EPISODE_FIELDS, ART_FIELDS)
+        return trimmed
+    trimmed['next_episodes'] = [
+        dict(trim_episode(episode, NEXT_EPISODE_FIELDS, ART_FIELDS), **trim_episode(episode, ITEM_FIELDS))
+        for episode in upcoming
+    ]
+    # The first upcoming episode is the next episode
+    trimmed['next_episode'] = trim_episode(upcoming[0], NEXT_EPISODE_FIELDS, ART_FIELDS)
+    trimmed.update(trim_episode(upcoming[0], ITEM_FIELDS))
+    return trimmed
+
+
+def advance_payload(data):
+    """Return the payload for the next episode, built from the upcoming episodes, or None when they run out"""
+    upcoming = data.get('next_episodes') or []
+    if len(upcoming) < 2:
+        return None
+    advanced = {key: data.get(key) for key in ('id', 'prefetch') if key in data}
+    advanced['current_episode'] = trim_episode(upcoming[0], CURRENT_EPISODE_FIELDS)
+    advanced['next_episodes'] = upcoming[1:]
+    return advanced
+
+
+def item_key(episode):
+    """Return a key identifying the item an add-on payload was sent for"""
+    return (episode.get('showtitle'), str(episode.get('season')), str(episode.get('episode')))
+
+
+class AddonDataRegistry:
+    """Add-on payloads keyed by sender and current item, bounded in size with LRU eviction"""
+    _shared_state = {}
+
+    # Total size of the normalized payloads kept, in bytes
+    MAX_SIZE = 256 * 1024
+    # Payloads received this recently survive the end of the previous playback
+    GRACE_TIME = 5
+
+    def __init__(self):
+        self.__dict__ = self._shared_state
+        if 'entries' in self.__dict__:
+            return
+        self.lock = Lock()
+        self.entries = OrderedDict()
+        self.active = None
+        self.size = 0
+
+    def log(self, msg, level=2):
+        ulog(msg, name=self.__class__.__name__, level=level)
+
+    def put(self, sender, data, encoding='base64', digest=None):
+        """Store the payload of a sender and make it the active payload"""
+        data = trim_payload(data)
+        key = (sender, item_key(data.get('current_episode')))
+        size = len(json.dumps(data))
+        with self.lock:
+            self._remove(key)
+            self.entries[key] = {'data': data, 'digest': digest, 'encoding': encoding, 'received': time(), 'size': size}
+            self.size += size
+            self.active = key
+            # Evict least recently used payloads, but never the active payload
+            for old_key in list(self.entries):
+                if self.size <= self.MAX_SIZE:
+                    break
+                if old_key != key:
+                    self.log('Evicting data from %s for %s' % old_key, 2)
+                    self._remove(old_key)
+        return key
+
+    def _remove(self, key):
+        """Remove a payload, must be called with the lock held"""
+        entry = self.entries.pop(key, None)
+        if entry:
+            self.size -= entry.get('size')
+        if self.active == key:
+            self.active = None
+
+    def get_entry(self):
+        """Return the active entry, or an empty dict"""
+        with self.lock:
+            if self.active is None:
+                return {}
+            self.entries[self.active] = self.entries.pop(self.active)
+            return self.entries.get(self.active)
+
+    def get_data(self):
+        """Return the active payload, or an empty dict"""
+        return self.get_entry().get('data', {})
+
+    def get_encoding(self):
+        """Return the encoding of the active payload"""
+        return self.get_entry().get('encoding', 'base64')
+
+    def has_digest(self, sender, digest):
+        """Check whether a payload with this content hash from sender is still kept"""
+        with self.lock:
+            return any(key[0] == sender and entry.get('digest') == digest for key, entry in self.entries.items())
+
+    def activate(self, sender, digest):
+        """Make the kept payload of sender with this content hash active, returns False when it is gone"""
+        with self.lock:
+            for key, entry in reversed(self.entries.items()):
+                if key[0] == sender and entry.get('digest') == digest:
+                    self.entries[key] = self.entries.pop(key)
+                    self.active = key
+                    return True
+        return False
+
+    def get_sender(self):
+        """Return the sender of the active payload, or None"""
+        with self.lock:
+            return self.active[0] if self.active else None
+
+    def request_prepare(self):
+        """Mark the active payload as prepared ahead, returns False when it was already requested"""
+        with self.lock:
+            entry = self.entries.get(self.active)
+            if not entry or entry.get('prepare_requested'):
+                return False
+            entry['prepare_requested'] = True
+            return True
+
+    def set_prepared(self, sender, play_url, expires):
+        """Store a resolved play_url for the active payload of sender, valid until expires"""
+        with self.lock:
+            entry = self.entries.get(self.active)
+            if not entry or self.active[0] != sender or not entry.get('prepare_requested'):
+                return False
+            entry['prepared'] = {'play_url': play_url, 'expires': expires}
+            return True
+
+    def get_prepared(self):
+        """Return the resolved play_url of the active payload while it is fresh, or None"""
+        with self.lock:
+            prepared = self.entries.get(self.active, {}).get('prepared')
+        if not prepared or prepared.get('expires') <= time():
+            return None
+        return prepared.get('play_url')
+
+    def advance(self):
+        """Make the payload for the next episode of the active payload active, returns False when there is none"""
+        with self.lock:
+            entry = self.entries.get(self.active)
+            if not entry:
+                return False
+            sender = self.active[0]
+            encoding = entry.get('encoding')
+            data = advance_payload(entry.get('data'))
+        if data is None:
+            return False
+        key = self.put(sender, data, encoding=encoding)
+        self.log('Advanced data from %s to %s' % key, 2)
+        return True
+
+    def select(self, showtitle, season, episode):
+        """Make the most recent payload for the playing item active, when there is one"""
+        key = (showtitle, str(season), str(episode))
+        with self.lock:
+            if self.active and self.active[1] == key:
+                return
+            for sender_key in reversed(self.entries):
+                if sender_key[1] == key:
+                    self.log('Selecting data from %s for %s' % sender_key, 2)
+                    self.active = sender_key
+                    return
+
+    def expire(self):
+        """Drop payloads of playback that moved on, only keeping payloads received during the grace time"""
+        now = time()
+        with self.lock:
+            for key, entry in list(self.entries.items()):
+                if now - entry.get('received') > self.GRACE_TIME:
+                    self._remove(key)
+            # A kept payload is only used again once select() matches it with the item that starts playing
+            self.active = None
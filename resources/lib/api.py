@@ -2,8 +2,16 @@
 # GNU General Public License v2.0 (see COPYING or https://www.gnu.org/licenses/gpl-2.0.txt)
 
 from __future__ import absolute_import, division, unicode_literals
+from time import time
 from xbmc import sleep, PLAYLIST_VIDEO, PLAYLIST_MUSIC
-from utils import event, get_int, get_setting_bool, get_setting_int, jsonrpc, log as ulog
+from addondata import AddonDataRegistry
+from capabilities import get_capabilities
+from dispatcher import EventDispatcher
+from health import ProviderHealth
+from metrics import Metrics
+from playlistmirror import PlaylistMirror
+from titleindex import TitleIndex
+from utils import get_int, get_setting_bool, get_setting_int, jsonrpc, jsonrpc_batch, jsonrpc_paged, log as ulog
 
 
 class Api:
@@ -15,26 +23,53 @@ class Api:
         'audio': PLAYLIST_MUSIC   # 0
     }
 
+    # Seconds before the notification that add-ons are asked to prepare the next episode
+    PREFETCH_LEAD = 20
+    # Seconds a prepared play_url is used for when the add-on does not tell
+    PREPARED_TTL = 60
+
     def __init__(self):
         """Constructor for Api class"""
         self.__dict__ = self._shared_state
-        self.data = {}
-        self.encoding = 'base64'
+        self.registry = AddonDataRegistry()
 
     def log(self, msg, level=2):
         """Log wrapper"""
         ulog(msg, name=self.__class__.__name__, level=level)
 
+    @property
+    def data(self):
+        """The add-on data for the playing item"""
+        return self.registry.get_data()
+
+    @property
+    def encoding(self):
+        """The encoding used by the add-on that sent the data"""
+        return self.registry.get_encoding()
+
     def has_addon_data(self):
         return self.data
 
     def reset_addon_data(self):
-        self.data = {}
+        self.registry.expire()
+
+    def select_addon_data(self, showtitle, season, episode):
+        self.registry.select(showtitle, season, episode)
 
-    def addon_data_received(self, data, encoding='base64'):
+    def addon_data_received(self, data, encoding='base64', sender=None, digest=None):
         self.log('addon_data_received called with data %s' % data, 2)
-        self.data = data
-        self.encoding = encoding
+        self.registry.put(sender or data.get('id'), data, encoding=encoding, digest=digest)
+
+    def advance_addon_data(self):
+        """Continue with the upcoming episodes sent by the add-on, without waiting for new data"""
+        return self.registry.advance()
+
+    def is_duplicate_addon_data(self, sender, digest):
+        return self.registry.has_digest(sender, digest)
+
+    def reuse_addon_data(self, sender, digest):
+        """Use the kept data again when an add-on resends it, returns False when it is no longer kept"""
+        return self.registry.activate(sender, digest)
 
     @staticmethod
     def play_kodi_item(episode):
@@ -72,6 +107,11 @@ class Api:
         if playlistid_cache[0] is not None:
             return playlistid_cache[0]
 
+        # The playlist mirror keeps the playlistid until the next playback starts
+        mirror = PlaylistMirror()
+        if mirror.playlistid is not None:
+            return mirror.playlistid
+
         result = jsonrpc(
             method='Player.GetProperties',
             params={
@@ -83,6 +123,7 @@ class Api:
             result.get('result', {}), 'playlistid', Api.PLAYER_PLAYLIST['video']
         )
 
+        mirror.playlistid = result
         return result
 
     def queue_next_item(self, episode):
@@ -105,16 +146,43 @@ class Api:
         return bool(next_item)
 
     @staticmethod
-    def dequeue_next_item():
-        """Remove unplayed next item from video playlist"""
+    def queue_next_items(episodes):
+        """Add library episodes to the video playlist with a single batched request"""
+        if not get_capabilities().playlist_add_array:
+            # Older Kodi versions add a single item per Playlist.Add call
+            playlistid = Api.get_playlistid()
+            jsonrpc_batch([
+                {'method': 'Playlist.Add', 'params': {'playlistid': playlistid, 'item': {'episodeid': episode.get('episodeid')}}}
+                for episode in episodes
+            ])
+            return
         jsonrpc(
-            method='Playlist.Remove',
+            method='Playlist.Add',
             id=0,
             params={
                 'playlistid': Api.get_playlistid(),
-                'position': 1
+                'item': [{'episodeid': episode.get('episodeid')} for episode in episodes]
             }
         )
+
+    @staticmethod
+    def dequeue_next_item():
+        """Remove unplayed next item from video playlist"""
+        return Api.dequeue_items(1)
+
+    @staticmethod
+    def dequeue_items(count):
+        """Remove unplayed queued items from video playlist, last item first"""
+        playlistid = Api.get_playlistid()
+        for position in range(count, 0, -1):
+            jsonrpc(
+                method='Playlist.Remove',
+                id=0,
+                params={
+                    'playlistid': playlistid,
+                    'position': position
+                }
+            )
         return False
 
     @staticmethod
@@ -130,22 +198,15 @@ class Api:
         )
 
     def get_next_in_playlist(self, position):
-        result = jsonrpc(method='Playlist.GetItems', params={
-            'playlistid': Api.get_playlistid(),
-            # limits are zero indexed, position is one indexed
-            'limits': {'start': position, 'end': position + 1},
-            'properties': ['art', 'dateadded', 'episode', 'file', 'firstaired', 'lastplayed',
-                           'playcount', 'plot', 'rating', 'resume', 'runtime', 'season',
-                           'showtitle', 'streamdetails', 'title', 'tvshowid', 'writer'],
-        })
-
-        item = result.get('result', {}).get('items')
+        # Items are served from the playlist mirror, which reads ahead a few items at a time
+        # Mirror positions are zero indexed, position is one indexed
+        item = PlaylistMirror().get_item(Api.get_playlistid(), position)
 
         # Don't check if next item is an episode, just use it if it is there
         if not item:  # item.get('type') != 'episode':
             self.log('Error: no next item found in playlist', 1)
             return None
-        item = item[0]
+        item = dict(item)
 
         # Playlist item may not have had video info details set
         # Try and populate required details if missing
@@ -163,13 +224,46 @@ class Api:
         self.log('Next item in playlist: %s' % item, 2)
         return item
 
+    def prepare_addon_item(self):
+        """Ask the add-on to resolve the next episode ahead of time, when it opted in"""
+        if not self.data.get('prefetch') or not self.registry.request_prepare():
+            return False
+        sender = self.registry.get_sender()
+        self.log('Asking %s to prepare the next episode: %s' % (sender, self.data.get('play_info')), 2)
+        EventDispatcher().send(message='%s_prepare_action' % sender, data=self.data.get('play_info'), sender='upnextprovider', encoding=self.encoding)
+        return True
+
+    def addon_item_prepared(self, sender, data):
+        """Handle upnext_prepared from add-ons, with a resolved play_url and its lifetime in seconds"""
+        play_url = data.get('play_url') if isinstance(data, dict) else None
+        if not play_url:
+            self.log('Received no play_url from %s to prepare the next episode' % sender, 1)
+            return False
+        expires = time() + get_int(data, 'expires_in', self.PREPARED_TTL)
+        if not self.registry.set_prepared(sender, play_url, expires):
+            self.log('Ignoring prepared next episode from %s, it is not for the playing item' % sender, 2)
+            return False
+        self.log('Next episode prepared by %s: %s' % (sender, play_url), 2)
+        return True
+
     def play_addon_item(self):
+        play_url = self.registry.get_prepared()
+        if play_url:
+            self.log('Playing the prepared next episode directly: %s' % play_url, 2)
+            Metrics().count('prefetch.hits')
+            jsonrpc(method='Player.Open', params={'item': {'file': play_url}})
+            return
+        if self.data.get('prefetch'):
+            Metrics().count('prefetch.misses')
         if self.data.get('play_url'):
             self.log('Playing the next episode directly: %(play_url)s' % self.data, 2)
             jsonrpc(method='Player.Open', params={'item': {'file': self.data.get('play_url')}})
         else:
             self.log('Sending %(encoding)s data to add-on to play: %(play_info)s' % dict(encoding=self.encoding, **self.data), 2)  # pylint: disable=use-dict-literal
-            event(message=self.data.get('id'), data=self.data.get('play_info'), sender='upnextprovider', encoding=self.encoding)
+            # The play command goes out before any other pending event
+            EventDispatcher().send(message=self.data.get('id'), data=self.data.get('play_info'), sender='upnextprovider',
+                                   encoding=self.encoding, urgent=True)
+            ProviderHealth().play_sent(self.registry.get_sender())
 
     def handle_addon_lookup_of_next_episode(self):
         if not self.data:
@@ -228,8 +322,14 @@ class Api:
         self.log('Got details of now playing media %s' % result, 2)
         return result
 
-    def handle_kodi_lookup_of_episode(self, tvshowid, current_file, include_watched, current_episode_id):
-        result = jsonrpc(method='VideoLibrary.GetEpisodes', params={
+    def handle_kodi_lookup_of_episode(self, tvshowid, current_file, include_watched, current_episode_id, abort=None):
+        episodes = self.handle_kodi_lookup_of_episodes(tvshowid, current_file, include_watched, current_episode_id, count=1, abort=abort)
+        return episodes[0] if episodes else None
+
+    def handle_kodi_lookup_of_episodes(self, tvshowid, current_file, include_watched, current_episode_id, count=1, abort=None):
+        """Return up to count next episodes, resolved in a single pass over the TV show"""
+        # Episodes are fetched in pages and decoded lazily, the lookup stops at the last next episode
+        episodes = jsonrpc_paged('episodes', abort=abort, method='VideoLibrary.GetEpisodes', params={
             'tvshowid': tvshowid,
             'properties': ['art', 'dateadded', 'episode', 'file', 'firstaired', 'lastplayed',
                            'playcount', 'plot', 'rating', 'resume', 'runtime', 'season',
@@ -237,17 +337,24 @@ class Api:
             'sort': {'method': 'episode'},
         })
 
-        if not result.get('result'):
-            return None
-
-        self.log('Got details of next up episode %s' % result, 2)
+        self.log('Got details of next up episodes', 2)
         sleep(100)
+        if abort and abort():
+            return []
 
         # Find the next unwatched and the newest added episodes
-        return self.find_next_episode(result, current_file, include_watched, current_episode_id)
-
-    def handle_kodi_lookup_of_current_episode(self, tvshowid, current_episode_id):
-        result = jsonrpc(method='VideoLibrary.GetEpisodes', params={
+        next_episodes = []
+        for episode in self.iter_next_episodes(episodes, current_file, include_watched, current_episode_id):
+            next_episodes.append(episode)
+            if len(next_episodes) >= count:
+                break
+
+        if not next_episodes:
+            self.log('No next episode found', 1)
+        return next_episodes
+
+    def handle_kodi_lookup_of_current_episode(self, tvshowid, current_episode_id, abort=None):
+        episodes = jsonrpc_paged('episodes', abort=abort, method='VideoLibrary.GetEpisodes', params={
             'tvshowid': tvshowid,
             'properties': ['art', 'dateadded', 'episode', 'file', 'firstaired', 'lastplayed',
                            'playcount', 'plot', 'rating', 'resume', 'runtime', 'season',
@@ -255,14 +362,12 @@ class Api:
             'sort': {'method': 'episode'},
         })
 
-        if not result.get('result'):
-            return None
-
         self.log('Find current episode called', 2)
         sleep(100)
+        if abort and abort():
+            return None
 
         # Find the next unwatched and the newest added episodes
-        episodes = result.get('result', {}).get('episodes', [])
         for idx, episode in enumerate(episodes):
             # Find position of current episode
             if current_episode_id == episode.get('episodeid'):
@@ -274,34 +379,44 @@ class Api:
         return None
 
     @staticmethod
-    def showtitle_to_id(title):
-        result = jsonrpc(method='VideoLibrary.GetTVShows', id='libTvShows', params={'properties': ['title']})
-
-        for tvshow in result.get('result', {}).get('tvshows', []):
-            if tvshow.get('label') == title:
-                return tvshow.get('tvshowid')
-        return '-1'
+    def showtitle_to_id(title, abort=None):
+        tvshowid = TitleIndex().get_tvshowid(title, abort=abort)
+        if tvshowid is None:
+            return '-1'
+        return tvshowid
 
     @staticmethod
-    def get_episode_id(showid, show_season, show_episode):
+    def get_episode_id(showid, show_season, show_episode, abort=None):
         show_season = int(show_season)
         show_episode = int(show_episode)
-        result = jsonrpc(method='VideoLibrary.GetEpisodes', params={
+        params = {
             'properties': ['episode', 'season'],
             'tvshowid': int(showid),
-        })
+        }
+        if get_capabilities().episode_filter:
+            # Let Kodi find the episode, instead of listing all episodes of the TV show
+            params.update(season=show_season, filter={'field': 'episode', 'operator': 'is', 'value': str(show_episode)})
+        episodes = jsonrpc_paged('episodes', abort=abort, method='VideoLibrary.GetEpisodes', params=params)
 
-        episodeid = 0
-        for episode in result.get('result', {}).get('episodes', []):
+        for episode in episodes:
             if episode.get('episodeid') and episode.get('season') == show_season and episode.get('episode') == show_episode:
-                episodeid = episode.get('episodeid')
+                return episode.get('episodeid')
+
+        return 0
 
-        return episodeid
+    def find_next_episode(self, episodes, current_file, include_watched, current_episode_id):
+        for episode in self.iter_next_episodes(episodes, current_file, include_watched, current_episode_id):
+            return episode
 
-    def find_next_episode(self, result, current_file, include_watched, current_episode_id):
+        # No next episode found
+        self.log('No next episode found', 1)
+        return None
+
+    @staticmethod
+    def iter_next_episodes(episodes, current_file, include_watched, current_episode_id):
+        """Yield the episodes following the current episode, in order"""
         found_match = False
         current_library_file = current_file
-        episodes = result.get('result', {}).get('episodes', [])
         for episode in episodes:
             # Find position of current episode
             episode_library_file = episode.get('file')
@@ -316,8 +431,6 @@ class Api:
             if not include_watched and episode.get('playcount') > 0:
                 continue
             if found_match:
-                return episode
-
-        # No next episode found
-        self.log('No next episode found', 1)
-        return None
+                # Later parts of a multi-part episode are skipped as well
+                current_library_file = episode_library_file
+                yield episode
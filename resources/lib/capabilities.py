@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v2.0 (see COPYING or https://www.gnu.org/licenses/gpl-2.0.txt)
+"""Implements a probe of the features of the running Kodi, done once at service start"""
+
+from __future__ import absolute_import, division, unicode_literals
+from collections import namedtuple
+from xbmc import Player
+from utils import get_kodi_version, jsonrpc, log as ulog
+
+# The probed features, a namedtuple cannot be changed once created
+Capabilities = namedtuple('Capabilities', [
+    'kodi_version',  # Kodi version number as float
+    'jsonrpc_version',  # JSON-RPC API version as (major, minor, patch)
+    'av_started',  # Player has the onAVStarted() callback
+    'external_player',  # Player has the isExternalPlayer() method
+    'episode_filter',  # VideoLibrary.GetEpisodes accepts season and filter parameters
+    'playlist_add_array',  # Playlist.Add accepts an array of items
+])
+
+CAPABILITIES = []
+
+
+def log(msg, level=2):
+    ulog(msg, name='Capabilities', level=level)
+
+
+def introspect(method):
+    """Return the parameters of a JSON-RPC method by name, or None when the method is not available"""
+    result = jsonrpc(method='JSONRPC.Introspect', params={
+        'getdescriptions': False,
+        'getmetadata': False,
+        'filter': {'id': method, 'type': 'method', 'getreferences': False},
+    })
+    schema = result.get('result', {}).get('methods', {}).get(method)
+    if not isinstance(schema, dict):
+        return None
+    return {param.get('name'): param for param in schema.get('params', []) if isinstance(param, dict)}
+
+
+def accepts_array(param):
+    """Check whether a JSON-RPC parameter schema accepts an array"""
+    types = param.get('type') if isinstance(param, dict) else None
+    if not isinstance(types, list):
+        types = [types]
+    return any(item == 'array' or (isinstance(item, dict) and item.get('type') == 'array') for item in types)
+
+
+def probe():
+    """Detect the features of the running Kodi, and keep them for all later calls"""
+    version = jsonrpc(method='JSONRPC.Version').get('result', {}).get('version', {})
+    episodes = introspect('VideoLibrary.GetEpisodes') or {}
+    playlist_add = introspect('Playlist.Add') or {}
+    capabilities = Capabilities(
+        kodi_version=get_kodi_version(),
+        jsonrpc_version=(version.get('major', 0), version.get('minor', 0), version.get('patch', 0)),
+        av_started=callable(getattr(Player, 'onAVStarted', None)),
+        external_player=callable(getattr(Player, 'isExternalPlayer', None)),
+        episode_filter='season' in episodes and 'filter' in episodes,
+        playlist_add_array=accepts_array(playlist_add.get('item')),
+    )
+    log('Kodi capabilities: %s' % (capabilities,), 2)
+    CAPABILITIES[:] = [capabilities]
+    return capabilities
+
+
+def get_capabilities():
+    """Return the features of the running Kodi, probing them when that was not done yet"""
+    if CAPABILITIES:
+        return CAPABILITIES[0]
+    return probe()
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v2.0 (see COPYING or https://www.gnu.org/licenses/gpl-2.0.txt)
+"""Implements the codecs for data exchanged with add-ons"""
+
+from __future__ import absolute_import, division, unicode_literals
+import json
+from base64 import b64decode, b64encode
+from binascii import hexlify, unhexlify
+from re import compile as re_compile
+from zlib import compressobj, decompressobj, error as ZlibError
+from statichelper import to_unicode
+
+# Version of the self-describing header, e.g. upnext/1/zlib:eJyrVkrLz1eyUg...
+VERSION = 1
+HEADER = re_compile(r'upnext/(\d+)/([a-z0-9]+):')
+HEX = re_compile(r'(?:[0-9a-fA-F]{2})*$')
+BASE64 = re_compile(r'[A-Za-z0-9+/]*={0,2}$')
+
+# Hard limit on the size of encoded and decoded payloads, in bytes
+MAX_SIZE = 1024 * 1024
+
+
+class PayloadError(ValueError):
+    """Raised when data from an add-on cannot be decoded"""
+
+
+def _encode_base64(json_data):
+    return b64encode(json_data)
+
+
+def _decode_base64(encoded):
+    return b64decode(encoded)
+
+
+def _encode_hex(json_data):
+    return hexlify(json_data)
+
+
+def _decode_hex(encoded):
+    return unhexlify(encoded)
+
+
+def _encode_zlib(json_data):
+    compressor = compressobj(9)
+    return b64encode(compressor.compress(json_data) + compressor.flush())
+
+
+def _decode_zlib(encoded):
+    decompressor = decompressobj()
+    try:
+        json_data = decompressor.decompress(b64decode(encoded), MAX_SIZE + 1)
+    except ZlibError as exc:
+        raise PayloadError('Invalid zlib data: %s' % exc)  # pylint: disable=raise-missing-from
+    # Refuse payloads that inflate beyond the limit, without inflating them completely
+    if len(json_data) > MAX_SIZE or decompressor.unconsumed_tail:
+        raise PayloadError('Decompressed payload exceeds %d bytes' % MAX_SIZE)
+    return json_data
+
+
+# Encoding name -> (encoder, decoder, uses header)
+# Legacy encodings are sent without header, so older add-ons and AddonSignals can still read them
+CODECS = {
+    'base64': (_encode_base64, _decode_base64, False),
+    'hex': (_encode_hex, _decode_hex, False),
+    'zlib': (_encode_zlib, _decode_zlib, True),
+}
+
+
+def detect(encoded):
+    """Return the encoding and the offset of the encoded data, or (None, 0)"""
+    match = HEADER.match(encoded)
+    if match:
+        if int(match.group(1)) > VERSION or match.group(2) not in CODECS:
+            return None, 0
+        return match.group(2), match.end()
+    # Base64 may start with hex digits, e.g. '{"' encodes as 'eyJ', so HEX must match the whole string. Base64 encoded JSON
+    # objects never do: they start with 'eyJ', or are padded with '=' like '{}' as 'e30='
+    if HEX.match(encoded):
+        return 'hex', 0
+    if len(encoded) % 4 == 0 and BASE64.match(encoded):
+        return 'base64', 0
+    return None, 0
+
+
+def encode(data, encoding='base64'):
+    """Encode data for a notification event, returns None for an unknown encoding"""
+    codec = CODECS.get(encoding)
+    if codec is None:
+        return None
+    encoder, _, header = codec
+    json_data = json.dumps(data).encode()
+    if len(json_data) > MAX_SIZE:
+        raise PayloadError('Payload exceeds %d bytes' % MAX_SIZE)
+    encoded = to_unicode(encoder(json_data))
+    if header:
+        encoded = 'upnext/%d/%s:%s' % (VERSION, encoding, encoded)
+    return encoded
+
+
+def decode(encoded):
+    """Decode data from a notification event, returns the data and its encoding"""
+    encoded = to_unicode(encoded or '').strip()
+    if len(encoded) > MAX_SIZE:
+        raise PayloadError('Encoded payload exceeds %d bytes' % MAX_SIZE)
+    encoding, offset = detect(encoded)
+    if encoding is None:
+        raise PayloadError('Unknown payload encoding')
+    json_data = CODECS.get(encoding)[1](encoded[offset:].encode('ascii'))
+    # NOTE: With Python 3.5 and older json.loads() does not support bytes or bytearray, so we convert to unicode
+    return json.loads(to_unicode(json_data)), encoding
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v2.0 (see COPYING or https://www.gnu.org/licenses/gpl-2.0.txt)
+"""Implements an in-memory ring buffer of service events for post-mortem diagnostics"""
+
+from __future__ import absolute_import, division, unicode_literals
+import io
+import json
+import os
+from collections import deque
+from threading import current_thread
+from time import time
+from statichelper import to_unicode
+
+
+class Diagnostics:
+    """Keeps the latest service events in memory, written to a file when something went wrong or on request"""
+    _shared_state = {}
+
+    FILENAME = 'upnext_diagnostics.json'
+    # Number of events kept, older events are dropped
+    MAX_EVENTS = 500
+    # Seconds between automatic dumps, errors in between are only kept in the buffer
+    DUMP_INTERVAL = 60
+
+    def __init__(self):
+        self.__dict__ = self._shared_state
+        if 'events' in self.__dict__:
+            return
+        self.events = deque(maxlen=self.MAX_EVENTS)
+        self.dump_reason = None
+        self.dumped = 0
+
+    def record(self, kind, **fields):
+        """Add an event, appending to a bounded deque is thread-safe and needs no lock"""
+        self.events.append((time(), current_thread().name, kind, fields))
+
+    def error(self, kind, **fields):
+        """Add an event for an error, the events are then dumped by the service"""
+        self.record(kind, **fields)
+        if self.dump_reason is None:
+            self.dump_reason = kind
+
+    def pending_dump(self):
+        """Return the reason for an automatic dump that is due, or None"""
+        if self.dump_reason is None or time() - self.dumped < self.DUMP_INTERVAL:
+            return None
+        return self.dump_reason
+
+    def snapshot(self):
+        """Return the buffered events, oldest first"""
+        return [
+            {'time': round(timestamp, 3), 'thread': thread, 'event': kind, 'data': fields}
+            for timestamp, thread, kind, fields in list(self.events)
+        ]
+
+    def save(self, path, reason, **sections):
+        """Write the buffered events and additional sections to a JSON file, returns False when that failed"""
+        self.dump_reason = None
+        self.dumped = time()
+        dump = dict(sections, reason=reason, saved=self.dumped, events=self.snapshot())
+        try:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with io.open(path, 'w', encoding='utf-8') as fdesc:
+                fdesc.write(to_unicode(json.dumps(dump, indent=2, sort_keys=True, default=repr)))
+        except (IOError, OSError):
+            return False
+        return True
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v2.0 (see COPYING or https://www.gnu.org/licenses/gpl-2.0.txt)
+"""Implements asynchronous delivery of outbound notification events"""
+
+from __future__ import absolute_import, division, unicode_literals
+from threading import Condition, Thread
+from xbmc import Monitor
+from metrics import Metrics
+from utils import jsonrpc_batch, log as ulog, notify_request
+
+
+class EventDispatcher:
+    """Sends notification events in order from a worker thread, batching the events of a transition"""
+    _shared_state = {}
+
+    # Attempts to deliver an event while Kodi's JSON-RPC is busy, and seconds between attempts
+    RETRIES = 3
+    RETRY_DELAY = 0.2
+    # JSON-RPC error codes of a busy Kodi, other errors such as invalid params fail again on every attempt
+    TRANSIENT_ERRORS = (-32100,)
+
+    def __init__(self):
+        self.__dict__ = self._shared_state
+        if 'queue' in self.__dict__:
+            return
+        self.condition = Condition()
+        # Pending (urgent, request) tuples, in the order they were sent
+        self.queue = []
+        self.held = 0
+        self.stopped = True
+        self.thread = None
+
+    def log(self, msg, level=2):
+        ulog(msg, name=self.__class__.__name__, level=level)
+
+    def start(self):
+        """Start the worker thread"""
+        with self.condition:
+            self.stopped = False
+        self.thread = Thread(target=self.run, name='UpNextDispatcher')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self, timeout=1):
+        """Stop the worker thread, delivering pending events first"""
+        with self.condition:
+            self.stopped = True
+            self.held = 0
+            self.condition.notify_all()
+        if self.thread:
+            self.thread.join(timeout)
+            self.thread = None
+        self.flush()
+
+    def send(self, message, data=None, sender=None, encoding='base64', urgent=False):
+        """Queue a notification event, urgent events are not held back and go before other pending events"""
+        request = notify_request(message, data=data, sender=sender, encoding=encoding)
+        if not request:
+            return
+        with self.condition:
+            self.queue.append((urgent, request))
+            running = not self.stopped
+            held = bool(self.held)
+            self.condition.notify()
+        if not running and (urgent or not held):
+            # Without worker thread events are delivered directly
+            self.flush(urgent_only=held)
+
+    def hold(self):
+        """Hold back events until release(), so the events of a transition are sent as one batch"""
+        with self.condition:
+            self.held += 1
+
+    def release(self):
+        """Send the events held back since hold()"""
+        with self.condition:
+            self.held = max(self.held - 1, 0)
+            running = not self.stopped
+            self.condition.notify()
+        if not running and not self.held:
+            self.flush()
+
+    def _take(self, urgent_only=False):
+        """Remove and return pending requests, urgent ones first, must be called with the lock held"""
+        if urgent_only:
+            batch = [item for item in self.queue if item[0]]
+            self.queue = [item for item in self.queue if not item[0]]
+        else:
+            # Sorting is stable, so events keep their order per message type
+            batch = sorted(self.queue, key=lambda item: not item[0])
+            self.queue = []
+        return [request for _, request in batch]
+
+    def _ready(self):
+        """Check for requests to deliver, must be called with the lock held"""
+        if self.held:
+            return any(urgent for urgent, _ in self.queue)
+        return bool(self.queue)
+
+    def flush(self, urgent_only=False):
+        """Deliver pending events on the calling thread"""
+        with self.condition:
+            batch = self._take(urgent_only=urgent_only)
+        if batch:
+            self.deliver(batch)
+
+    def run(self):
+        """Worker thread loop"""
+        while True:
+            with self.condition:
+                while not self.stopped and not self._ready():
+                    self.condition.wait()
+                if self.stopped:
+                    return
+                batch = self._take(urgent_only=bool(self.held))
+            self.deliver(batch)
+
+    def is_transient(self, response):
+        """Check whether a failed request may succeed when it is sent again"""
+        error = response.get('error')
+        # A missing response is retried as well
+        return not error or error.get('code') in self.TRANSIENT_ERRORS
+
+    def deliver(self, batch):
+        """Send requests in one JSON-RPC batch, retrying the ones that failed while Kodi was busy"""
+        metrics = Metrics()
+        for attempt in range(self.RETRIES):
+            if attempt:
+                if Monitor().waitForAbort(self.RETRY_DELAY):
+                    break
+                metrics.count('dispatcher.retries')
+            responses = jsonrpc_batch(batch)
+            metrics.count('dispatcher.batches')
+            failed = [(request, response) for request, response in zip(batch, responses) if response.get('result') != 'OK']
+            batch = [request for request, response in failed if self.is_transient(response)]
+            for request, response in failed:
+                if not self.is_transient(response):
+                    self.log('Dropped event %s: %s' % (request.get('params').get('message'), response.get('error')), 0)
+                    metrics.count('dispatcher.dropped')
+            if not batch:
+                return
+        for request in batch:
+            self.log('Failed to send event %s' % request.get('params').get('message'), 0)
+        metrics.count('dispatcher.failed', len(batch))
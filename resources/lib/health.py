@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v2.0 (see COPYING or https://www.gnu.org/licenses/gpl-2.0.txt)
+"""Implements health tracking and a circuit breaker per provider add-on"""
+
+from __future__ import absolute_import, division, unicode_literals
+import io
+import json
+import os
+from threading import Lock
+from time import time
+from diagnostics import Diagnostics
+from metrics import Metrics
+from statichelper import to_unicode
+from utils import addon_profile, log as ulog
+
+
+def new_record():
+    """Return the health record of a sender without history"""
+    return {
+        'decode_errors': 0,
+        'failures': 0,
+        'opened': None,
+        'playbacks': 0,
+        'time_to_playback': None,
+        'timeouts': 0,
+    }
+
+
+class ProviderHealth:
+    """Tracks failures per sender, and stops using add-ons that keep failing"""
+    _shared_state = {}
+
+    FILENAME = 'provider_health.json'
+    # Consecutive failures that open the circuit breaker of a sender
+    FAILURE_THRESHOLD = 3
+    # Seconds the circuit breaker stays open, before the add-on gets another chance
+    OPEN_TIME = 30 * 60
+    # Seconds an add-on has to start playback after the play event
+    PLAY_TIMEOUT = 30
+
+    def __init__(self):
+        self.__dict__ = self._shared_state
+        if 'senders' in self.__dict__:
+            return
+        self.lock = Lock()
+        self.path = os.path.join(addon_profile(), self.FILENAME)
+        self.pending = None
+        # Playback statistics changed since the last save
+        self.dirty = False
+        self.senders = self.load()
+
+    def log(self, msg, level=2):
+        ulog(msg, name=self.__class__.__name__, level=level)
+
+    def load(self):
+        """Return the persisted health of all senders, or an empty dict"""
+        try:
+            with io.open(self.path, 'r', encoding='utf-8') as fdesc:
+                senders = json.load(fdesc)
+        except (IOError, OSError, ValueError):
+            return {}
+        if not isinstance(senders, dict):
+            return {}
+        # Records saved by older versions lack newer fields
+        return {sender: dict(new_record(), **record) for sender, record in senders.items() if isinstance(record, dict)}
+
+    def save(self):
+        """Persist the health of all senders, must be called with the lock held"""
+        self.dirty = False
+        try:
+            if not os.path.isdir(os.path.dirname(self.path)):
+                os.makedirs(os.path.dirname(self.path))
+            with io.open(self.path, 'w', encoding='utf-8') as fdesc:
+                fdesc.write(to_unicode(json.dumps(self.senders, indent=2, sort_keys=True)))
+        except (IOError, OSError) as exc:
+            self.log('Failed to write %s: %s' % (self.path, exc), 1)
+
+    def _record(self, sender):
+        """Return the health record of a sender, must be called with the lock held"""
+        record = self.senders.get(sender)
+        if record is None:
+            record = self.senders[sender] = new_record()
+        return record
+
+    def is_open(self, sender):
+        """Check whether the circuit breaker of a sender is open, its data is then not used"""
+        with self.lock:
+            opened = self.senders.get(sender, {}).get('opened')
+        # Once the open time passed, the next attempt decides whether the breaker closes or opens again
+        return bool(opened) and time() - opened < self.OPEN_TIME
+
+    def failed(self, sender, reason):
+        """Record a failure of a sender, opening its circuit breaker after repeated failures"""
+        with self.lock:
+            record = self._record(sender)
+            record[reason] = record.get(reason, 0) + 1
+            record['failures'] += 1
+            if record.get('failures') >= self.FAILURE_THRESHOLD:
+                record['opened'] = time()
+                self.log('Circuit breaker opened for %s after %d failures, falling back to library and playlist'
+                         % (sender, record.get('failures')), 0)
+                Metrics().count('health.opened')
+            self.save()
+            failures = record.get('failures')
+        Diagnostics().error('provider failed', sender=sender, reason=reason, failures=failures)
+
+    def decode_failed(self, sender):
+        """Record malformed data from a sender"""
+        self.failed(sender, 'decode_errors')
+
+    def play_sent(self, sender):
+        """Start waiting for playback after sending the play event to a sender"""
+        with self.lock:
+            self.pending = (sender, time())
+
+    def playback_started(self):
+        """Record the time to playback of the pending play event"""
+        with self.lock:
+            pending, self.pending = self.pending, None
+            if not pending:
+                return
+            sender, sent = pending
+            elapsed = time() - sent
+            record = self._record(sender)
+            record['playbacks'] += 1
+            record['time_to_playback'] = round(elapsed, 3)
+            if record.get('opened'):
+                self.log('Circuit breaker closed for %s' % sender, 0)
+            # Only a reset of the circuit breaker is saved right away, the statistics are saved with the next change
+            changed = bool(record.get('failures') or record.get('opened'))
+            record['failures'] = 0
+            record['opened'] = None
+            if changed:
+                self.save()
+            else:
+                self.dirty = True
+        Metrics().timing('health.time_to_playback', elapsed)
+
+    def flush(self):
+        """Persist the playback statistics that were not saved yet, called when the service stops"""
+        with self.lock:
+            if self.dirty:
+                self.save()
+
+    def check_timeout(self):
+        """Record a timeout when playback did not start in time after the play event"""
+        with self.lock:
+            if not self.pending or time() - self.pending[1] < self.PLAY_TIMEOUT:
+                return
+            sender, self.pending = self.pending[0], None
+        self.log('%s did not start playback within %ds' % (sender, self.PLAY_TIMEOUT), 1)
+        self.failed(sender, 'timeouts')
+
+    def snapshot(self):
+        """Return a copy of the health of all senders"""
+        with self.lock:
+            return {sender: dict(record) for sender, record in self.senders.items()}
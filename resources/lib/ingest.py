@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v2.0 (see COPYING or https://www.gnu.org/licenses/gpl-2.0.txt)
+"""Implements off-thread ingestion of notifications from add-ons"""
+
+from __future__ import absolute_import, division, unicode_literals
+from collections import OrderedDict
+from hashlib import sha1
+from threading import Condition, Thread
+from time import time
+from metrics import Metrics
+from utils import log as ulog
+
+
+def content_hash(data):
+    """Return a hash of the raw notification data"""
+    if not isinstance(data, bytes):
+        data = data.encode('utf-8')
+    return sha1(data).hexdigest()
+
+
+class NotificationQueue:
+    """Hands notifications to a worker thread, keeping only the latest distinct payload per sender"""
+
+    def __init__(self, handler, is_duplicate=None):
+        """The handler is called as handler(sender, data, digest, duplicate) on the worker thread.
+           The optional is_duplicate(sender, digest) callable flags payloads that are still kept, so decoding can be skipped."""
+        self.handler = handler
+        self.is_duplicate = is_duplicate
+        self.condition = Condition()
+        self.pending = OrderedDict()
+        self.metrics = Metrics()
+        self.stopped = False
+        self.thread = None
+
+    def log(self, msg, level=2):
+        ulog(msg, name=self.__class__.__name__, level=level)
+
+    def start(self):
+        """Start the worker thread"""
+        self.stopped = False
+        self.thread = Thread(target=self.run, name='UpNextIngest')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self, timeout=1):
+        """Stop the worker thread, dropping pending notifications"""
+        with self.condition:
+            self.stopped = True
+            self.pending.clear()
+            self.condition.notify_all()
+        if self.thread:
+            self.thread.join(timeout)
+            self.thread = None
+
+    def put(self, sender, data):
+        """Queue a notification, called from the notification callback so it must return quickly"""
+        digest = content_hash(data)
+        with self.condition:
+            previous = self.pending.pop(sender, None)
+            if previous:
+                # Coalesce bursts to the latest payload of the sender, duplicates are counted when they are handled
+                self.metrics.count('ingest.coalesced')
+            self.pending[sender] = (data, digest, time())
+            self.metrics.count('ingest.received')
+            self.condition.notify()
+
+    def _get(self):
+        """Wait for and return the oldest pending notification, or None when stopped"""
+        with self.condition:
+            while not self.pending and not self.stopped:
+                self.condition.wait()
+            if self.stopped:
+                return None
+            return self.pending.popitem(last=False)
+
+    def run(self):
+        """Worker thread loop"""
+        while True:
+            item = self._get()
+            if item is None:
+                break
+            sender, (data, digest, received) = item
+            duplicate = bool(self.is_duplicate and self.is_duplicate(sender, digest))
+            if duplicate:
+                self.log('Received unchanged data from %s' % sender, 2)
+                self.metrics.count('ingest.duplicates')
+            try:
+                self.handler(sender, data, digest, duplicate)
+            except Exception as exc:  # pylint: disable=broad-except
+                self.log('Failed to process data from %s: %s' % (sender, exc), 0)
+                self.metrics.count('ingest.errors')
+            latency = time() - received
+            self.metrics.timing('ingest.latency', latency)
+            self.log('Processed data from %s in %.3fs' % (sender, latency), 2)
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v2.0 (see COPYING or https://www.gnu.org/licenses/gpl-2.0.txt)
+"""Implements lightweight in-process service metrics"""
+
+from __future__ import absolute_import, division, unicode_literals
+import io
+import json
+import os
+from threading import Lock
+from time import time
+from statichelper import to_unicode
+
+# Upper bounds in seconds of the latency histogram buckets, the last bucket counts all slower durations
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def new_metrics():
+    """Return empty metrics"""
+    return {'counters': {}, 'timings': {}, 'sizes': {}}
+
+
+def copy_metrics(metrics):
+    """Return a copy of metrics"""
+    return {
+        'counters': dict(metrics.get('counters')),
+        'timings': {name: dict(timing, buckets=list(timing.get('buckets'))) for name, timing in metrics.get('timings').items()},
+        'sizes': {name: dict(size) for name, size in metrics.get('sizes').items()},
+    }
+
+
+def percentile(timing, fraction):
+    """Return the upper bound of the histogram bucket holding a percentile of the durations"""
+    threshold = timing.get('count') * fraction
+    seen = 0
+    for bound, count in zip(LATENCY_BUCKETS, timing.get('buckets')):
+        seen += count
+        if seen >= threshold:
+            return bound
+    return timing.get('max')
+
+
+class Metrics:
+    """Counters, latency histograms and byte sizes shared by all service components, in total and per playback session"""
+    _shared_state = {}
+
+    def __init__(self):
+        self.__dict__ = self._shared_state
+        if 'total' in self.__dict__:
+            return
+        self.lock = Lock()
+        self.reset()
+
+    def count(self, name, value=1):
+        """Increment a counter"""
+        with self.lock:
+            for metrics in (self.total, self.session):
+                counters = metrics.get('counters')
+                counters[name] = counters.get(name, 0) + value
+
+    def timing(self, name, seconds):
+        """Record a duration in seconds"""
+        bucket = len(LATENCY_BUCKETS)
+        for idx, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                bucket = idx
+                break
+        with self.lock:
+            for metrics in (self.total, self.session):
+                timing = metrics.get('timings').get(name)
+                if timing is None:
+                    timing = metrics.get('timings')[name] = {'count': 0, 'total': 0.0, 'max': 0.0, 'buckets': [0] * (len(LATENCY_BUCKETS) + 1)}
+                timing['count'] += 1
+                timing['total'] += seconds
+                timing['max'] = max(timing.get('max'), seconds)
+                timing['buckets'][bucket] += 1
+
+    def size(self, name, nbytes):
+        """Record a size in bytes"""
+        with self.lock:
+            for metrics in (self.total, self.session):
+                size = metrics.get('sizes').get(name)
+                if size is None:
+                    size = metrics.get('sizes')[name] = {'count': 0, 'total': 0, 'max': 0}
+                size['count'] += 1
+                size['total'] += nbytes
+                size['max'] = max(size.get('max'), nbytes)
+
+    def start_session(self):
+        """Start aggregating the metrics of a new playback session, keeping those of the previous one"""
+        with self.lock:
+            if self.session.get('counters') or self.session.get('timings'):
+                self.last_session = self.session
+            self.session = new_metrics()
+            self.session_started = time()
+
+    def snapshot(self):
+        """Return a copy of all metrics, the totals at the top level"""
+        with self.lock:
+            snapshot = copy_metrics(self.total)
+            snapshot['session'] = dict(copy_metrics(self.session), started=self.session_started)
+            snapshot['last_session'] = copy_metrics(self.last_session)
+            snapshot['started'] = self.started
+            return snapshot
+
+    def reset(self):
+        """Clear all metrics"""
+        with self.lock:
+            self.total = new_metrics()
+            self.session = new_metrics()
+            self.last_session = new_metrics()
+            self.started = self.session_started = time()
+
+    def save(self, path):
+        """Write all metrics to a JSON file, returns False when that failed"""
+        snapshot = self.snapshot()
+        try:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with io.open(path, 'w', encoding='utf-8') as fdesc:
+                fdesc.write(to_unicode(json.dumps(dict(snapshot, buckets=LATENCY_BUCKETS, saved=time()), indent=2, sort_keys=True)))
+        except (IOError, OSError):
+            return False
+        return True
+
+    def summary(self, limit=20):
+        """Return summary lines of the slowest timings and all counters"""
+        snapshot = self.snapshot()
+        lines = []
+        sizes = snapshot.get('sizes')
+        timings = sorted(snapshot.get('timings').items(), key=lambda item: item[1].get('total'), reverse=True)
+        for name, timing in timings[:limit]:
+            line = '%s: %d calls, %.3fs total, %.1fms avg, p95 <= %.0fms, max %.1fms' % (
+                name, timing.get('count'), timing.get('total'), 1000 * timing.get('total') / timing.get('count'),
+                1000 * percentile(timing, 0.95), 1000 * timing.get('max'))
+            if name + '.response' in sizes:
+                line += ', %d bytes received' % sizes.get(name + '.response').get('total')
+            lines.append(line)
+        counters = snapshot.get('counters')
+        if counters:
+            lines.append(', '.join('%s=%s' % item for item in sorted(counters.items())))
+        return lines
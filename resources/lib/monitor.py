@@ -2,31 +2,86 @@
 # GNU General Public License v2.0 (see COPYING or https://www.gnu.org/licenses/gpl-2.0.txt)
 
 from __future__ import absolute_import, division, unicode_literals
+import os
+from time import time
 from xbmc import Monitor
 from api import Api
-from playbackmanager import PlaybackManager
+from capabilities import get_capabilities, probe
+from diagnostics import Diagnostics
+from dispatcher import EventDispatcher
+from health import ProviderHealth
+from ingest import NotificationQueue
+from metrics import Metrics
 from player import UpNextPlayer
+from playlistmirror import PlaylistMirror
+from profiler import SamplingProfiler
 from statichelper import to_unicode
-from utils import decode_json, get_property, get_setting_bool, kodi_version_major, log as ulog
+from titleindex import TitleIndex
+from tracing import Tracer
+from utils import addon_id, addon_profile, decode_json, get_property, get_setting_bool, log as ulog
 
 
 class UpNextMonitor(Monitor):
     """Service monitor for Kodi"""
 
+    # Seconds between writes of the service metrics to the add-on profile folder
+    METRICS_INTERVAL = 5 * 60
+
     def __init__(self):
         """Constructor for Monitor"""
         self.player = UpNextPlayer()
         self.api = Api()
-        self.playback_manager = PlaybackManager()
+        self._playback_manager = None
+        self.ingest = NotificationQueue(self.handle_addon_data, is_duplicate=self.api.is_duplicate_addon_data)
         Monitor.__init__(self)
 
     def log(self, msg, level=1):
         """Log wrapper"""
         ulog(msg, name=self.__class__.__name__, level=level)
 
+    @property
+    def playback_manager(self):
+        """The playback manager, the popup modules are only imported when an episode nears its end"""
+        if self._playback_manager is None:
+            from playbackmanager import PlaybackManager
+            self._playback_manager = PlaybackManager()
+        return self._playback_manager
+
+    def hide_demo(self):
+        """Hide the demo overlay, when it was shown"""
+        if self._playback_manager is not None:
+            self._playback_manager.demo.hide()
+
+    def save_metrics(self):
+        """Write the service metrics to a JSON file in the add-on profile folder"""
+        path = os.path.join(addon_profile(), 'metrics.json')
+        if not Metrics().save(path):
+            self.log('Failed to write metrics to %s' % path, 1)
+
+    def dump_diagnostics(self, reason):
+        """Write the latest service events, provider health and metrics to a JSON file in the add-on profile folder"""
+        path = os.path.join(addon_profile(), Diagnostics.FILENAME)
+        if Diagnostics().save(path, reason, health=ProviderHealth().snapshot(), metrics=Metrics().snapshot()):
+            self.log('Wrote diagnostics (%s) to %s' % (reason, path), 0)
+        else:
+            self.log('Failed to write diagnostics to %s' % path, 1)
+
+    def stop_tracking(self, reason):
+        """Stop tracking the playing file"""
+        Diagnostics().record('monitor', decision='stop tracking', reason=reason)
+        self.player.disable_tracking()
+        self.hide_demo()
+
     def run(self):  # pylint: disable=too-many-branches
         """Main service loop"""
         self.log('Service started', 0)
+        probe()
+        SamplingProfiler().configure()
+        self.ingest.start()
+        EventDispatcher().start()
+        metrics_saved = time()
+        diagnostics = Diagnostics()
+        tracer = Tracer()
 
         while not self.abortRequested():
             # check every 1 sec
@@ -34,25 +89,32 @@ class UpNextMonitor(Monitor):
                 # Abort was requested while waiting. We should exit
                 break
 
+            ProviderHealth().check_timeout()
+            reason = diagnostics.pending_dump()
+            if reason:
+                self.dump_diagnostics(reason)
+            if tracer.pending_export():
+                tracer.export()
+            if time() - metrics_saved > self.METRICS_INTERVAL:
+                self.save_metrics()
+                metrics_saved = time()
+
             if not self.player.is_tracking():
                 continue
 
             if bool(get_property('PseudoTVRunning') == 'True'):
-                self.player.disable_tracking()
-                self.playback_manager.demo.hide()
+                self.stop_tracking('PseudoTV running')
                 continue
 
             if get_setting_bool('disableNextUp'):
                 # Next Up is disabled
-                self.player.disable_tracking()
-                self.playback_manager.demo.hide()
+                self.stop_tracking('disabled')
                 continue
 
             # Method isExternalPlayer() was added in Kodi v18 onward
-            if kodi_version_major() >= 18 and self.player.isExternalPlayer():
+            if get_capabilities().external_player and self.player.isExternalPlayer():
                 self.log('Up Next tracking stopped, external player detected', 2)
-                self.player.disable_tracking()
-                self.playback_manager.demo.hide()
+                self.stop_tracking('external player')
                 continue
 
             last_file = self.player.get_last_file()
@@ -60,8 +122,7 @@ class UpNextMonitor(Monitor):
                 current_file = to_unicode(self.player.getPlayingFile())
             except RuntimeError:
                 self.log('Up Next tracking stopped, failed player.getPlayingFile()', 2)
-                self.player.disable_tracking()
-                self.playback_manager.demo.hide()
+                self.stop_tracking('getPlayingFile failed')
                 continue
 
             if (current_file.startswith((
@@ -69,8 +130,7 @@ class UpNextMonitor(Monitor):
                     or current_file.endswith((
                         '.bdmv', '.iso', '.ifo'))):
                 self.log('Up Next tracking stopped, Blu-ray/DVD/CD playing', 2)
-                self.player.disable_tracking()
-                self.playback_manager.demo.hide()
+                self.stop_tracking('disc playing')
                 continue
 
             if last_file and last_file == current_file:
@@ -81,49 +141,105 @@ class UpNextMonitor(Monitor):
                 total_time = self.player.getTotalTime()
             except RuntimeError:
                 self.log('Up Next tracking stopped, failed player.getTotalTime()', 2)
-                self.player.disable_tracking()
-                self.playback_manager.demo.hide()
+                self.stop_tracking('getTotalTime failed')
                 continue
 
             if total_time == 0:
                 self.log('Up Next tracking stopped, no file is playing', 2)
-                self.player.disable_tracking()
-                self.playback_manager.demo.hide()
+                self.stop_tracking('nothing playing')
                 continue
 
             try:
                 play_time = self.player.getTime()
             except RuntimeError:
                 self.log('Up Next tracking stopped, failed player.getTime()', 2)
-                self.player.disable_tracking()
-                self.playback_manager.demo.hide()
+                self.stop_tracking('getTime failed')
                 continue
 
             notification_time = self.api.notification_time(total_time=total_time)
             if total_time - play_time > notification_time:
                 # Media hasn't reach notification time yet, waiting a bit longer...
+                if total_time - play_time <= notification_time + self.api.PREFETCH_LEAD:
+                    self.playback_manager.prefetch(current_file)
                 continue
 
             self.player.set_last_file(current_file)
+            # Also prefetch when playback skipped past the lead time, e.g. after seeking
+            self.playback_manager.prefetch(current_file)
             self.log('Show notification as episode (of length %d secs) ends in %d secs' % (total_time, notification_time), 2)
+            tracer.instant('notification', total_time=total_time, play_time=play_time, notification_time=notification_time)
+            diagnostics.record('monitor', decision='notification', total_time=total_time, play_time=play_time,
+                               notification_time=notification_time)
             self.playback_manager.launch_up_next()
             self.log('Up Next style autoplay succeeded', 2)
             self.player.disable_tracking()
 
+        self.ingest.stop()
+        EventDispatcher().stop()
+        SamplingProfiler().stop()
+        self.save_metrics()
+        ProviderHealth().flush()
+        tracer.export()
+        for line in Metrics().summary():
+            self.log('Metrics: %s' % line, 0)
         self.log('Service stopped', 0)
 
+    def onSettingsChanged(self):  # pylint: disable=invalid-name
+        """Apply settings that take effect without restarting the service"""
+        SamplingProfiler().configure()
+
     def onNotification(self, sender, method, data):  # pylint: disable=invalid-name
         """Notification event handler for accepting data from add-ons"""
+        if method.startswith('VideoLibrary.'):
+            TitleIndex().handle_notification(method, data)
+            PlaylistMirror().handle_notification(method, data)
+            return
+
+        if method.startswith(('Player.', 'Playlist.')):
+            PlaylistMirror().handle_notification(method, data)
+            return
+
+        if method.endswith('upnext_dump_diagnostics'):  # Method looks like Other.upnext_dump_diagnostics
+            # Sent by our own script, on request of the user
+            if sender == '%s.SIGNAL' % addon_id():
+                self.dump_diagnostics('requested')
+            return
+
+        if method.endswith('upnext_prepared'):  # Method looks like Other.upnext_prepared
+            # Small reply to our prepare event, handled directly so it is ready at play time
+            decoded_data, _ = decode_json(data)
+            if decoded_data is not None:
+                self.api.addon_item_prepared(sender.replace('.SIGNAL', ''), decoded_data)
+            return
+
         if not method.endswith('upnext_data'):  # Method looks like Other.upnext_data
             return
 
-        decoded_data, encoding = decode_json(data)
-        if decoded_data is None:
-            self.log('Received data from sender %s is not JSON: %s' % (sender, data), 2)
+        # Decoding and handling the data is done on the ingestion thread
+        self.ingest.put(sender.replace('.SIGNAL', ''), data)
+
+    def handle_addon_data(self, sender, data, digest, duplicate=False):
+        """Handle upnext_data from add-ons, called from the ingestion thread"""
+        health = ProviderHealth()
+        if health.is_open(sender):
+            self.log('Ignoring data from sender %s, it failed repeatedly' % sender, 2)
+            Diagnostics().record('monitor', decision='rejected', sender=sender)
+            Metrics().count('health.rejected')
             return
 
-        self.playback_manager.handle_demo()
-        decoded_data.update(id='%s_play_action' % sender.replace('.SIGNAL', ''))
-        self.api.addon_data_received(decoded_data, encoding=encoding)
+        # Data resent unchanged, e.g. after a resume, is not decoded and stored again
+        if not duplicate or not self.api.reuse_addon_data(sender, digest):
+            decoded_data, encoding = decode_json(data)
+            if decoded_data is None:
+                self.log('Received data from sender %s is not JSON: %s' % (sender, data), 2)
+                health.decode_failed(sender)
+                return
+            decoded_data.update(id='%s_play_action' % sender)
+            self.api.addon_data_received(decoded_data, encoding=encoding, sender=sender, digest=digest)
+
+        if get_setting_bool('enableDemoMode'):
+            self.playback_manager.handle_demo()
+        else:
+            self.hide_demo()
         self.player.enable_tracking()
         self.player.reset_queue()
@@ -2,15 +2,25 @@
 # GNU General Public License v2.0 (see COPYING or https://www.gnu.org/licenses/gpl-2.0.txt)
 
 from __future__ import absolute_import, division, unicode_literals
+from time import time
 from xbmc import sleep
 from api import Api
 from demo import DemoOverlay
+from diagnostics import Diagnostics
+from dispatcher import EventDispatcher
+from metrics import Metrics
 from player import UpNextPlayer
 from playitem import PlayItem
+from profiler import profile_call
+from readahead import ReadAhead
+from session import SessionCancelled
 from state import State
 from stillwatching import StillWatching
+from texturecache import TextureCache
+from tracing import Tracer
 from upnext import UpNext
-from utils import addon_path, calculate_progress_steps, clear_property, event, get_setting_bool, get_setting_int, log as ulog, set_property
+from utils import (addon_path, calculate_progress_steps, clear_property, get_setting_bool, get_setting_int, JsonRpcTimeout, log as ulog,
+                   set_property, set_setting)
 
 
 class PlaybackManager:
@@ -21,6 +31,7 @@ class PlaybackManager:
         self.api = Api()
         self.play_item = PlayItem()
         self.state = State()
+        self.session = self.state.session
         self.player = UpNextPlayer()
         self.demo = DemoOverlay(12005)
 
@@ -39,23 +50,101 @@ class PlaybackManager:
         else:
             self.demo.hide()
 
+    def abandon(self, start):
+        """Log and count work abandoned because its playback session ended"""
+        self.log('Playback session ended, abandoning work', 2)
+        metrics = Metrics()
+        metrics.count('session.cancelled')
+        metrics.timing('session.wasted', time() - start)
+
+    def degrade(self, exc):
+        """Log and count work skipped because Kodi did not answer in time"""
+        self.log('Kodi library is busy, %s did not answer in time, skipping the next episode' % exc, 1)
+        Diagnostics().error('skipped', reason=str(exc))
+        Metrics().count('jsonrpc.skipped')
+
+    def prefetch(self, current_file):
+        """Prepare the next episode before the notification is shown, once per playing file"""
+        if self.state.prefetched_file == current_file:
+            return
+        self.state.prefetched_file = current_file
+        start = time()
+        try:
+            self.handle_prefetch()
+        except SessionCancelled:
+            self.abandon(start)
+        except JsonRpcTimeout as exc:
+            self.degrade(exc)
+
+    def handle_prefetch(self):
+        self.play_item.select_addon_data()
+        if self.api.has_addon_data():
+            # Let the add-on resolve the next episode
+            self.state.prefetched = None
+            self.api.prepare_addon_item()
+            episode = self.api.data.get('next_episode')
+        else:
+            # Look up the next episode once, and wake up the disk it is stored on
+            if self.state.prefetched is None:
+                self.state.prefetched = self.play_item.get_next()
+            episode, source = self.state.prefetched
+            if episode and source in ('library', 'playlist'):
+                ReadAhead().start(episode.get('file'), abort=self.play_item.playback_stopped)
+
+        if episode:
+            # Cache the artwork the popup will show
+            TextureCache().prewarm(episode.get('art'), self.popup_skin_files())
+
+    @staticmethod
+    def popup_skin_files():
+        """Return the window XML files of the Up Next and Still Watching popups"""
+        if get_setting_int('simpleMode') == 0:
+            return 'script-upnext-upnext-simple.xml', 'script-upnext-stillwatching-simple.xml'
+        return 'script-upnext-upnext.xml', 'script-upnext-stillwatching.xml'
+
     def launch_up_next(self):
+        """Show the popup for the next episode, unless the playback session ends in the meantime"""
+        start = time()
+        self.session = self.state.session
+        try:
+            if get_setting_bool('profileTransition', default=False):
+                # Capture an exact call profile of this transition only
+                set_setting('profileTransition', 'false')
+                profile_call('upnext_transition', self.handle_up_next)
+            else:
+                self.handle_up_next()
+        except SessionCancelled:
+            self.abandon(start)
+        except JsonRpcTimeout as exc:
+            self.degrade(exc)
+
+    def handle_up_next(self):
         enable_playlist = get_setting_bool('enablePlaylist')
-        episode, source = self.play_item.get_next()
+        with Tracer().span('lookup', prefetched=bool(self.state.prefetched)):
+            episode, source = self.state.prefetched or self.play_item.get_next()
+        self.state.prefetched = None
+        self.session.check()
         self.log('Playlist setting: %s' % enable_playlist)
         if source == 'playlist' and not enable_playlist:
             self.log('Playlist integration disabled', 2)
+            Diagnostics().record('up next', result='playlist disabled')
             return
         if not episode:
             # No episode get out of here
             self.log('Error: no episode could be found to play next...exiting', 1)
+            Diagnostics().record('up next', result='no next episode')
             return
         self.log('episode details %s' % episode, 2)
         play_next, keep_playing = self.launch_popup(episode, source)
+        Diagnostics().record('up next', result='finished', source=source, play_next=play_next, keep_playing=keep_playing)
+        self.session.check()
         self.state.playing_next = play_next
 
         # Dequeue and stop playback if not playing next file
-        if not play_next and self.state.queued:
+        if not play_next and self.state.queue:
+            self.player.dequeue()
+            self.state.queued = False
+        elif not play_next and self.state.queued:
             self.state.queued = self.api.dequeue_next_item()
         if not keep_playing:
             self.log('Stopping playback', 2)
@@ -63,7 +152,7 @@ class PlaybackManager:
 
         self.api.reset_addon_data()
 
-    def launch_popup(self, episode, source=None):
+    def launch_popup(self, episode, source=None):  # pylint: disable=too-many-branches,too-many-locals
         episode_id = episode.get('episodeid')
         no_play_count = episode.get('playcount') is None or episode.get('playcount') == 0
         include_play_count = True if self.state.include_watched else no_play_count
@@ -75,26 +164,44 @@ class PlaybackManager:
             return False, True
 
         # Add next file to playlist if existing playlist is not being used
-        if source != 'playlist':
+        self.session.check()
+        if source == 'library' and self.state.queue_ahead:
+            queued = self.state.queued = self.queue_ahead(episode)
+        elif source != 'playlist':
+            self.player.dequeue()
             queued = self.state.queued = self.api.queue_next_item(episode)
         else:
+            self.player.dequeue()
             queued = False
 
         # We have a next up episode choose mode
-        if get_setting_int('simpleMode') == 0:
-            next_up_page = UpNext('script-upnext-upnext-simple.xml', addon_path(), 'default', '1080i')
-            still_watching_page = StillWatching('script-upnext-stillwatching-simple.xml', addon_path(), 'default', '1080i')
-        else:
-            next_up_page = UpNext('script-upnext-upnext.xml', addon_path(), 'default', '1080i')
-            still_watching_page = StillWatching('script-upnext-stillwatching.xml', addon_path(), 'default', '1080i')
+        tracer = Tracer()
+        next_up_xml, still_watching_xml = self.popup_skin_files()
+        with tracer.span('dialogs'):
+            next_up_page = UpNext(next_up_xml, addon_path(), 'default', '1080i')
+            still_watching_page = StillWatching(still_watching_xml, addon_path(), 'default', '1080i')
+        self.session.check()
 
-        showing_next_up_page, showing_still_watching_page = self.show_popup_and_wait(episode,
-                                                                                     next_up_page,
-                                                                                     still_watching_page)
+        try:
+            with tracer.span('popup'):
+                showing_next_up_page, showing_still_watching_page = self.show_popup_and_wait(episode,
+                                                                                             next_up_page,
+                                                                                             still_watching_page)
+            # The popup was closed, only play the next episode for a running session
+            self.session.check()
+        finally:
+            if self.session.is_cancelled():
+                # Playback ended while the popup was shown, do not leave a dialog behind
+                next_up_page.close()
+                still_watching_page.close()
+                clear_property('service.upnext.dialog')
         should_play_default, should_play_non_default = self.extract_play_info(next_up_page,
                                                                               showing_next_up_page,
                                                                               showing_still_watching_page,
                                                                               still_watching_page)
+        tracer.instant('user action', play_default=should_play_default, play_non_default=should_play_non_default)
+        Diagnostics().record('popup', next_up=showing_next_up_page, still_watching=showing_still_watching_page,
+                             play_default=should_play_default, play_non_default=should_play_non_default)
         if not self.state.track:
             self.log('exit launch_popup early due to disabled tracking', 2)
             # play_next = False
@@ -118,19 +225,33 @@ class PlaybackManager:
             )
 
         self.log('playing media episode', 2)
-        # Signal to trakt previous episode watched
-        event(message='NEXTUPWATCHEDSIGNAL', data={'episodeid': self.state.current_episode_id}, encoding='base64')
-        if source == 'playlist' or queued:
-            # Play playlist media
-            if should_play_non_default:
-                # Only start the next episode if the user asked for it specifically
-                self.player.playnext()
-        elif self.api.has_addon_data():
-            # Play add-on media
-            self.api.play_addon_item()
-        else:
-            # Play local media
-            self.api.play_kodi_item(episode)
+        dispatcher = EventDispatcher()
+        # Events of this transition are sent in one batch, after the play command was issued
+        dispatcher.hold()
+        # The transition ends when the next episode starts rendering, queued episodes start when playback ends
+        if not (source == 'playlist' or queued) or should_play_non_default:
+            tracer.start('transition')
+        try:
+            # Signal to trakt previous episode watched
+            dispatcher.send(message='NEXTUPWATCHEDSIGNAL', data={'episodeid': self.state.current_episode_id}, encoding='base64')
+            with tracer.span('play', source=source, queued=bool(queued)):
+                if source == 'playlist' or queued:
+                    # Play playlist media
+                    if should_play_non_default:
+                        # Only start the next episode if the user asked for it specifically
+                        self.player.playnext()
+                elif self.api.has_addon_data():
+                    # Play add-on media
+                    self.api.play_addon_item()
+                else:
+                    # Play local media
+                    self.api.play_kodi_item(episode)
+        finally:
+            dispatcher.release()
+
+        if self.api.has_addon_data():
+            # Use the remaining upcoming episodes for the next episode
+            self.api.advance_addon_data()
 
         # play_next = True
         # keep_playing = True
@@ -138,6 +259,22 @@ class PlaybackManager:
         # Play next file, and keep playing current file
         return True, True
 
+    def queue_ahead(self, episode):
+        """Keep the next episodes queued in the playlist, adding only the ones missing"""
+        window = [episode] + self.state.upcoming
+        window_ids = [item.get('episodeid') for item in window]
+        if self.state.queue[:len(window_ids)] != window_ids[:len(self.state.queue)]:
+            # Changed show or watched out of order, the queued episodes are no longer next
+            self.log('Queued episodes %s do not match next episodes %s' % (self.state.queue, window_ids), 2)
+            self.player.dequeue()
+        missing = window[len(self.state.queue):]
+        self.session.check()
+        if missing:
+            self.log('Queueing %d episodes ahead' % len(missing), 2)
+            self.api.queue_next_items(missing)
+            self.state.queue += window_ids[len(self.state.queue):]
+        return True
+
     def show_popup_and_wait(self, episode, next_up_page, still_watching_page):
         try:
             play_time = self.player.getTime()
@@ -165,7 +302,7 @@ class PlaybackManager:
             still_watching_page.show()
             set_property('service.upnext.dialog', 'true')
             showing_still_watching_page = True
-        while (self.player.isPlaying() and (total_time - play_time > 1)
+        while (self.player.isPlaying() and (total_time - play_time > 1) and not self.session.is_cancelled()
                and not next_up_page.is_cancel() and not next_up_page.is_watch_now()
                and not still_watching_page.is_still_watching() and not still_watching_page.is_cancel()):
             try:
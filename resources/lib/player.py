@@ -2,9 +2,17 @@
 # GNU General Public License v2.0 (see COPYING or https://www.gnu.org/licenses/gpl-2.0.txt)
 
 from __future__ import absolute_import, division, unicode_literals
+from time import time
 from xbmc import getCondVisibility, Player, Monitor
 from api import Api
+from capabilities import get_capabilities
+from diagnostics import Diagnostics
+from health import ProviderHealth
+from metrics import Metrics
+from readahead import ReadAhead
 from state import State
+from tracing import Tracer
+from utils import clear_locale_cache
 
 
 class UpNextPlayer(Player):
@@ -18,6 +26,38 @@ class UpNextPlayer(Player):
         self.monitor = Monitor()
         Player.__init__(self)
 
+    def call(self, method, *args):
+        """Call a Kodi player method, recording its duration and errors"""
+        start = time()
+        try:
+            return getattr(Player, method)(self, *args)
+        except RuntimeError:
+            Metrics().count('player.%s.errors' % method)
+            raise
+        finally:
+            Metrics().timing('player.%s' % method, time() - start)
+
+    def getPlayingFile(self):
+        return self.call('getPlayingFile')
+
+    def getTime(self):
+        return self.call('getTime')
+
+    def getTotalTime(self):
+        return self.call('getTotalTime')
+
+    def getVideoInfoTag(self):
+        return self.call('getVideoInfoTag')
+
+    def isExternalPlayer(self):
+        return self.call('isExternalPlayer')
+
+    def isPlaying(self):
+        return self.call('isPlaying')
+
+    def seekTime(self, seekTime):
+        return self.call('seekTime', seekTime)
+
     def set_last_file(self, filename):
         self.state.last_file = filename
 
@@ -28,34 +68,55 @@ class UpNextPlayer(Player):
         return self.state.track
 
     def disable_tracking(self):
+        Diagnostics().record('tracking', enabled=False)
         self.state.track = False
 
     def enable_tracking(self):
+        Diagnostics().record('tracking', enabled=True)
         self.state.track = True
 
     def reset_queue(self):
         if self.state.queued:
             self.api.reset_queue()
             self.state.queued = False
+            # The first episode queued ahead is the one playing now
+            self.state.queue = self.state.queue[1:]
+
+    def dequeue(self):
+        """Remove all episodes queued ahead from the playlist"""
+        if self.state.queue:
+            self.api.dequeue_items(len(self.state.queue))
+            self.state.queue = []
 
     def _check_video(self):
+        ProviderHealth().playback_started()
+        self.transition_ended()
         self.monitor.waitForAbort(5)
         if not getCondVisibility('videoplayer.content(episodes)'):
             return
-        self.state.track = True
+        self.enable_tracking()
+
+    @staticmethod
+    def transition_ended():
+        """Record the time between the play command, or the end of the previous episode, and the next episode"""
+        tracer = Tracer()
+        duration = tracer.finish('transition')
+        if duration is None:
+            return
+        tracer.instant('av started')
+        Metrics().timing('transition', duration)
+        tracer.request_export()
 
-    if callable(getattr(Player, 'onAVStarted', None)):
-        def onAVStarted(self):  # pylint: disable=invalid-name
-            """Will be called when Kodi has a video or audiostream"""
-            self._check_video()
+    def onAVStarted(self):  # pylint: disable=invalid-name
+        """Will be called when Kodi has a video or audiostream, Kodi v18 onward"""
+        self._check_video()
 
-        def onPlayBackStarted(self):  # pylint: disable=invalid-name
-            """Will be called when kodi starts playing a file"""
-            self.reset_queue()
-    else:
-        def onPlayBackStarted(self):  # pylint: disable=invalid-name
-            """Will be called when kodi starts playing a file"""
-            self.reset_queue()
+    def onPlayBackStarted(self):  # pylint: disable=invalid-name
+        """Will be called when kodi starts playing a file"""
+        self.reset_queue()
+        # Kodi does not notify locale changes, the popups for this playback resolve them again
+        clear_locale_cache()
+        if not get_capabilities().av_started:
             self._check_video()
 
     def onPlayBackPaused(self):  # pylint: disable=invalid-name
@@ -66,20 +127,38 @@ class UpNextPlayer(Player):
 
     def onPlayBackStopped(self):  # pylint: disable=invalid-name
         """Will be called when user stops playing a file"""
-        self.reset_queue()
-        self.api.reset_addon_data()
-        self.state = State()  # Reset state
+        ReadAhead().cancel()
+        # Playlist calls can miss their deadline, the playback session must end regardless
+        try:
+            self.dequeue()
+            self.reset_queue()
+        finally:
+            self.api.reset_addon_data()
+            self.state.reset()
 
     def onPlayBackEnded(self):  # pylint: disable=invalid-name
         """Will be called when Kodi has ended playing a file"""
-        self.reset_queue()
         # Only reset state if not playing the next episode
-        if not self.state.playing_next:
-            self.api.reset_addon_data()
-            self.state = State()  # Reset state
+        try:
+            if not self.state.playing_next:
+                self.dequeue()
+            else:
+                # Queued episodes start playing now
+                Tracer().start('transition')
+            self.reset_queue()
+        finally:
+            if not self.state.playing_next:
+                self.api.reset_addon_data()
+                self.state.reset()
 
     def onPlayBackError(self):  # pylint: disable=invalid-name
         """Will be called when when playback stops due to an error"""
-        self.reset_queue()
-        self.api.reset_addon_data()
-        self.state = State()  # Reset state
+        Diagnostics().error('playback error', playing_next=self.state.playing_next)
+        ReadAhead().cancel()
+        Tracer().cancel('transition')
+        try:
+            self.dequeue()
+            self.reset_queue()
+        finally:
+            self.api.reset_addon_data()
+            self.state.reset()
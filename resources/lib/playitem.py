@@ -2,9 +2,9 @@
 # GNU General Public License v2.0 (see COPYING or https://www.gnu.org/licenses/gpl-2.0.txt)
 
 from __future__ import absolute_import, division, unicode_literals
-from xbmc import PlayList
 from api import Api
 from player import UpNextPlayer
+from playlistmirror import PlaylistMirror
 from state import State
 from utils import log as ulog
 
@@ -17,17 +17,32 @@ class PlayItem:
         self.api = Api()
         self.player = UpNextPlayer()
         self.state = State()
+        self.session = self.state.session
 
     def log(self, msg, level=2):
         ulog(msg, name=self.__class__.__name__, level=level)
 
+    def playback_stopped(self):
+        """Abort callback for library scans"""
+        return self.session.is_cancelled() or not self.player.isPlaying()
+
+    def select_addon_data(self):
+        """Use the add-on data sent for the playing item, when several add-ons sent data"""
+        try:
+            tag = self.player.getVideoInfoTag()
+        except RuntimeError:
+            return
+        self.api.select_addon_data(tag.getTVShowTitle(), tag.getSeason(), tag.getEpisode())
+
     def get_playlist_position(self):
         """Function to get current playlist playback position"""
 
-        playlist = PlayList(self.api.get_playlistid(playlistid_cache=[None]))
-        position = playlist.getposition()
+        mirror = PlaylistMirror()
+        playlistid = self.api.get_playlistid()
+        position = mirror.get_position(playlistid)
+        size = mirror.get_size(playlistid)
         # A playlist with only one element has no next item and PlayList().getposition() starts counting from zero
-        if playlist.size() > 1 and position < (playlist.size() - 1):
+        if size > 1 and position < (size - 1):
             # Return 1 based index value
             return position + 1
         return False
@@ -37,7 +52,11 @@ class PlayItem:
 
         episode = None
         source = None
+        # Lookups are abandoned when the playback session this lookup is for ends
+        self.session = self.state.session
         position = self.get_playlist_position()
+        self.session.check()
+        self.select_addon_data()
         has_addon_data = self.api.has_addon_data()
 
         # Next video from addon data
@@ -61,11 +80,17 @@ class PlayItem:
             current_file = self.player.get_last_file()
             # Get the active player
             result = self.api.get_now_playing()
+            self.session.check()
             self.handle_now_playing_result(result)
-            # Get the next episode from Kodi
-            episode = self.api.handle_kodi_lookup_of_episode(
-                self.state.tv_show_id, current_file, self.state.include_watched, self.state.current_episode_id
+            self.session.check()
+            # Get the next episodes from Kodi, as many as we queue ahead
+            episodes = self.api.handle_kodi_lookup_of_episodes(
+                self.state.tv_show_id, current_file, self.state.include_watched, self.state.current_episode_id,
+                count=max(self.state.queue_ahead, 1), abort=self.playback_stopped
             )
+            self.session.check()
+            episode = episodes[0] if episodes else None
+            self.state.upcoming = episodes[1:]
             source = 'library'
 
         return episode, source
@@ -80,9 +105,10 @@ class PlayItem:
 
         self.state.tv_show_id = item.get('tvshowid')
         if int(self.state.tv_show_id) == -1:
-            current_show_title = item.get('showtitle').encode('utf-8')
-            self.state.tv_show_id = self.api.showtitle_to_id(title=current_show_title)
+            current_show_title = item.get('showtitle')
+            self.state.tv_show_id = self.api.showtitle_to_id(title=current_show_title, abort=self.playback_stopped)
             self.log('Fetched missing tvshowid %s' % self.state.tv_show_id, 2)
+            self.session.check()
 
         current_episode_number = item.get('episode')
         current_season_id = item.get('season')
@@ -91,6 +117,7 @@ class PlayItem:
             showid=str(self.state.tv_show_id),
             show_episode=current_episode_number,
             show_season=current_season_id,
+            abort=self.playback_stopped,
         )
         self.state.current_episode_id = current_episode_id
         if self.state.current_tv_show_id != self.state.tv_show_id:
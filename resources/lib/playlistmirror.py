@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v2.0 (see COPYING or https://www.gnu.org/licenses/gpl-2.0.txt)
+"""Implements an in-process mirror of Kodi playlists"""
+
+from __future__ import absolute_import, division, unicode_literals
+import json
+from threading import Lock
+from xbmc import PlayList
+from utils import get_int, jsonrpc, JsonRpcTimeout, log as ulog
+
+
+class PlaylistMirror:
+    """Mirror of Kodi playlists, kept up to date from Playlist and VideoLibrary notifications"""
+    _shared_state = {}
+
+    # Number of playlist items read ahead on a cache miss
+    PAGE_SIZE = 5
+    PROPERTIES = ['art', 'dateadded', 'episode', 'file', 'firstaired', 'lastplayed',
+                  'playcount', 'plot', 'rating', 'resume', 'runtime', 'season',
+                  'showtitle', 'streamdetails', 'title', 'tvshowid', 'writer']
+
+    def __init__(self):
+        self.__dict__ = self._shared_state
+        if 'playlists' in self.__dict__:
+            return
+        self.lock = Lock()
+        self.playlists = {}
+        # Playlistid of the active player, resolved once per playback
+        self.playlistid = None
+
+    def log(self, msg, level=2):
+        ulog(msg, name=self.__class__.__name__, level=level)
+
+    def _get(self, playlistid):
+        """Return the mirror of a playlist, must be called with the lock held"""
+        playlist = self.playlists.get(playlistid)
+        if playlist is None:
+            playlist = self.playlists[playlistid] = {
+                'handle': PlayList(playlistid),
+                'generation': 0,
+                'items': {},
+                'position': None,
+                'size': None,
+            }
+        return playlist
+
+    def get_position(self, playlistid):
+        """Return the zero-based position of the playing item"""
+        with self.lock:
+            playlist = self._get(playlistid)
+            if playlist.get('position') is None:
+                playlist['position'] = playlist.get('handle').getposition()
+            return playlist.get('position')
+
+    def get_size(self, playlistid):
+        """Return the number of items in the playlist"""
+        with self.lock:
+            playlist = self._get(playlistid)
+            if playlist.get('size') is None:
+                playlist['size'] = playlist.get('handle').size()
+            return playlist.get('size')
+
+    def get_item(self, playlistid, position):
+        """Return the playlist item at the zero-based position, reading ahead on a cache miss"""
+        with self.lock:
+            playlist = self._get(playlistid)
+            item = playlist.get('items').get(position)
+            generation = playlist.get('generation')
+        if item is not None:
+            return item
+
+        try:
+            result = jsonrpc(method='Playlist.GetItems', params={
+                'playlistid': playlistid,
+                'limits': {'start': position, 'end': position + self.PAGE_SIZE},
+                'properties': self.PROPERTIES,
+            })
+        except JsonRpcTimeout:
+            self.log('Kodi is busy, failed to read playlist %s at position %d' % (playlistid, position), 1)
+            return None
+        items = result.get('result', {}).get('items') or []
+        self.log('Read %d items ahead from playlist %s at position %d' % (len(items), playlistid, position), 2)
+
+        with self.lock:
+            playlist = self._get(playlistid)
+            # Do not cache items when the playlist changed in the meantime
+            if playlist.get('generation') == generation:
+                for offset, page_item in enumerate(items):
+                    playlist.get('items')[position + offset] = page_item
+        return items[0] if items else None
+
+    def handle_notification(self, method, data):
+        """Handle Player, Playlist and VideoLibrary notifications"""
+        if method in ('Player.OnPlay', 'Player.OnAVStart', 'Player.OnStop'):
+            with self.lock:
+                self.playlistid = None
+                for playlist in self.playlists.values():
+                    playlist['position'] = None
+                    playlist['size'] = None
+            return
+
+        if method not in ('Playlist.OnAdd', 'Playlist.OnRemove', 'Playlist.OnClear', 'VideoLibrary.OnUpdate'):
+            return
+        try:
+            data = json.loads(data)
+        except (TypeError, ValueError):
+            return
+        if method == 'VideoLibrary.OnUpdate':
+            self._drop_updated(data)
+            return
+        playlistid = get_int(data, 'playlistid')
+        if playlistid == -1:
+            return
+
+        with self.lock:
+            playlist = self._get(playlistid)
+            playlist['generation'] += 1
+            if method == 'Playlist.OnClear':
+                playlist.update(items={}, position=None, size=0)
+                return
+
+            position = get_int(data, 'position')
+            if position == -1:
+                # Unknown position, start over
+                playlist.update(items={}, position=None, size=None)
+                return
+
+            self._shift(playlist, position, 1 if method == 'Playlist.OnAdd' else -1)
+
+    def _drop_updated(self, data):
+        """Drop the mirrored copies of a library item that changed, e.g. its playcount or resume point"""
+        # Kodi sends the item either nested or at the top level
+        item = data.get('item', data) if isinstance(data, dict) else {}
+        itemid = get_int(item, 'id')
+        if itemid == -1:
+            return
+        with self.lock:
+            for playlist in self.playlists.values():
+                items = playlist.get('items')
+                updated = [position for position, mirrored in items.items()
+                           if mirrored.get('id') == itemid and mirrored.get('type') == item.get('type')]
+                if not updated:
+                    continue
+                # Do not cache the old item when it is being read from Kodi right now
+                playlist['generation'] += 1
+                for position in updated:
+                    del items[position]
+
+    @staticmethod
+    def _shift(playlist, position, shift):
+        """Move mirrored items and position after an item was added or removed, must be called with the lock held"""
+        if shift > 0:
+            items = {(idx + shift if idx >= position else idx): item for idx, item in playlist.get('items').items()}
+        else:
+            items = {(idx + shift if idx > position else idx): item for idx, item in playlist.get('items').items() if idx != position}
+        playlist['items'] = items
+        if playlist.get('size') is not None:
+            playlist['size'] += shift
+
+        current = playlist.get('position')
+        if current is None:
+            return
+        if position < current or (shift > 0 and position == current):
+            playlist['position'] = current + shift
+        elif position == current:
+            # The playing item was removed, read the position again when needed
+            playlist['position'] = None
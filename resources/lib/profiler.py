@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v2.0 (see COPYING or https://www.gnu.org/licenses/gpl-2.0.txt)
+"""Implements an opt-in sampling profiler of the service threads"""
+
+from __future__ import absolute_import, division, unicode_literals
+import io
+import os
+import sys
+from threading import Event, Lock, Thread, current_thread, enumerate as enumerate_threads
+from time import strftime, time
+from metrics import Metrics
+from statichelper import to_unicode
+from utils import addon_profile, get_setting_bool, get_setting_int, log as ulog
+
+
+# Number of functions in the text summary of a call profile
+PROFILE_TOP = 40
+
+
+def profile_call(name, func, *args, **kwargs):
+    """Run a function under cProfile, and write a .pstats file and a text summary to the add-on profile folder"""
+    import cProfile  # Only imported when a call profile is asked for
+    import pstats
+    try:  # Python 2
+        from StringIO import StringIO
+    except ImportError:  # Python 3
+        from io import StringIO
+
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        profile.disable()
+        path = os.path.join(addon_profile(), '%s_%s' % (name, strftime('%Y%m%d-%H%M%S')))
+        summary = StringIO()
+        stats = pstats.Stats(profile, stream=summary)
+        stats.sort_stats('cumulative').print_stats(PROFILE_TOP)
+        try:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            stats.dump_stats(path + '.pstats')
+            with io.open(path + '.txt', 'w', encoding='utf-8') as fdesc:
+                fdesc.write(to_unicode(summary.getvalue()))
+            ulog('Wrote call profile to %s.pstats' % path, name='Profiler', level=0)
+        except (IOError, OSError) as exc:
+            ulog('Failed to write call profile to %s: %s' % (path, exc), name='Profiler', level=1)
+
+
+def collapse(thread_name, frame):
+    """Return the stack of a frame in collapsed format, from the thread down to the innermost function"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append('%s:%s' % (os.path.basename(code.co_filename), code.co_name))
+        frame = frame.f_back
+    names.append(thread_name)
+    return ';'.join(reversed(names))
+
+
+class SamplingProfiler:
+    """Samples the stacks of the service threads, and writes them as collapsed stacks for flame graph tools"""
+    _shared_state = {}
+
+    FILENAME = 'upnext_samples.collapsed'
+    # Seconds between writes of the samples to the add-on profile folder
+    WRITE_INTERVAL = 30
+    # Number of distinct stacks kept, samples of new stacks are counted as dropped once reached
+    MAX_STACKS = 5000
+
+    def __init__(self):
+        self.__dict__ = self._shared_state
+        if 'stacks' in self.__dict__:
+            return
+        self.lock = Lock()
+        self.stacks = {}
+        self.rate = None
+        self.stopped = None
+        self.thread = None
+
+    def log(self, msg, level=2):
+        ulog(msg, name=self.__class__.__name__, level=level)
+
+    def configure(self):
+        """Start or stop sampling, following the add-on settings"""
+        if not get_setting_bool('samplingProfiler', default=False):
+            self.stop()
+            return
+        rate = max(get_setting_int('samplingRate', 10), 1)
+        if self.thread and self.rate == rate:
+            return
+        self.stop()
+        self.start(rate)
+
+    def start(self, rate):
+        """Start sampling the service threads rate times per second"""
+        self.log('Sampling the service threads %d times per second' % rate, 0)
+        self.rate = rate
+        self.stopped = Event()
+        self.thread = Thread(target=self.run, args=(1.0 / rate, self.stopped), name='UpNextProfiler')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """Stop sampling, the samples are written by the sampling thread"""
+        if not self.thread:
+            return
+        self.log('Stopped sampling the service threads', 0)
+        self.stopped.set()
+        self.thread = None
+
+    def sample(self):
+        """Add the current stacks of all service threads, except the sampling thread itself"""
+        names = {thread.ident: thread.name for thread in enumerate_threads()}
+        own = current_thread().ident
+        frames = sys._current_frames()  # pylint: disable=protected-access
+        with self.lock:
+            for ident, frame in frames.items():
+                if ident == own:
+                    continue
+                stack = collapse(names.get(ident, 'Thread-%s' % ident).replace(' ', '_'), frame)
+                if stack not in self.stacks and len(self.stacks) >= self.MAX_STACKS:
+                    stack = 'dropped'
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    def run(self, interval, stopped):
+        """Sampling thread, writes the samples periodically and when stopped"""
+        metrics = Metrics()
+        written = time()
+        while not stopped.wait(interval):
+            start = time()
+            self.sample()
+            metrics.count('profiler.samples')
+            metrics.timing('profiler.sample', time() - start)
+            if time() - written > self.WRITE_INTERVAL:
+                self.write()
+                written = time()
+        self.write()
+
+    def write(self, path=None):
+        """Write the samples taken so far in collapsed stack format, returns False when that failed"""
+        path = path or os.path.join(addon_profile(), self.FILENAME)
+        with self.lock:
+            lines = ['%s %d\n' % item for item in sorted(self.stacks.items())]
+        try:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with io.open(path, 'w', encoding='utf-8') as fdesc:
+                fdesc.write(to_unicode(''.join(lines)))
+        except (IOError, OSError) as exc:
+            self.log('Failed to write %s: %s' % (path, exc), 1)
+            return False
+        return True
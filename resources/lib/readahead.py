@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v2.0 (see COPYING or https://www.gnu.org/licenses/gpl-2.0.txt)
+"""Implements read-ahead of the next episode file to wake up sleeping disks"""
+
+from __future__ import absolute_import, division, unicode_literals
+from threading import Event, Thread
+from time import time
+from xbmcvfs import File
+from metrics import Metrics
+from utils import get_setting_bool, get_setting_int, log as ulog
+
+
+class ReadAhead:
+    """Reads the leading bytes of the next episode file on a worker thread"""
+    _shared_state = {}
+
+    CHUNK_SIZE = 256 * 1024
+    # Setting enabling read-ahead per protocol, files without protocol are local
+    PROTOCOL_SETTINGS = {
+        '': 'readAheadLocal',
+        'nfs': 'readAheadNfs',
+        'smb': 'readAheadSmb',
+    }
+
+    def __init__(self):
+        self.__dict__ = self._shared_state
+        if 'cancelled' in self.__dict__:
+            return
+        self.cancelled = Event()
+        self.filename = None
+
+    def log(self, msg, level=2):
+        ulog(msg, name=self.__class__.__name__, level=level)
+
+    @staticmethod
+    def protocol(filename):
+        """Return the protocol of a Kodi path, or an empty string for local files"""
+        if '://' not in filename:
+            return ''
+        return filename.split('://', 1)[0].lower()
+
+    def is_enabled(self, filename):
+        """Check whether read-ahead is enabled for the protocol of a file"""
+        setting = self.PROTOCOL_SETTINGS.get(self.protocol(filename))
+        return bool(setting) and get_setting_bool(setting, default=True)
+
+    def start(self, filename, abort=None):
+        """Start reading ahead a file, unless it is already being read"""
+        size = get_setting_int('readAheadSize', 0) * 1024 * 1024
+        if not filename or size <= 0 or filename == self.filename or not self.is_enabled(filename):
+            return False
+        self.cancel()
+        self.filename = filename
+        self.cancelled = Event()
+        thread = Thread(target=self.run, args=(filename, size, self.cancelled, abort), name='UpNextReadAhead')
+        thread.daemon = True
+        thread.start()
+        return True
+
+    def cancel(self):
+        """Stop reading ahead"""
+        self.cancelled.set()
+        self.filename = None
+
+    def run(self, filename, size, cancelled, abort=None):
+        """Worker thread reading up to size bytes, until cancelled or aborted"""
+        metrics = Metrics()
+        start = time()
+        try:
+            vfs_file = File(filename)
+        except (IOError, OSError, RuntimeError, ValueError) as exc:
+            self.log('Failed to open %s: %s' % (filename, exc), 1)
+            metrics.count('readahead.errors')
+            return
+        metrics.timing('readahead.open', time() - start)
+
+        read = 0
+        try:
+            while read < size:
+                if cancelled.is_set() or (abort and abort()):
+                    self.log('Cancelled reading ahead %s after %d bytes' % (filename, read), 2)
+                    metrics.count('readahead.cancelled')
+                    return
+                chunk = vfs_file.readBytes(min(self.CHUNK_SIZE, size - read))
+                if not chunk:
+                    break
+                read += len(chunk)
+        finally:
+            vfs_file.close()
+        elapsed = time() - start
+        metrics.timing('readahead.read', elapsed)
+        metrics.count('readahead.bytes', read)
+        self.log('Read %d bytes ahead of %s in %.3fs' % (read, filename, elapsed), 2)
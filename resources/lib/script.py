@@ -8,7 +8,7 @@ from math import ceil
 from xbmc import Monitor
 from xbmcgui import WindowXMLDialog
 from statichelper import from_unicode
-from utils import addon_path, get_setting_bool, localize, localize_time
+from utils import addon_path, event, get_setting_bool, localize, localize_time
 
 
 class TestPopup(WindowXMLDialog):
@@ -99,6 +99,11 @@ def test_popup(window):
         step += wait
 
 
+def dump_diagnostics():
+    """Ask the service to write its diagnostics to the add-on profile folder"""
+    event(message='upnext_dump_diagnostics')
+
+
 def open_settings():
     from xbmcaddon import Addon
     Addon().openSettings()
@@ -108,5 +113,7 @@ def run(argv):
     """Route to API method"""
     if len(argv) == 3 and argv[1] == 'test_window':
         test_popup(argv[2])
+    elif len(argv) == 2 and argv[1] == 'dump_diagnostics':
+        dump_diagnostics()
     else:
         open_settings()
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v2.0 (see COPYING or https://www.gnu.org/licenses/gpl-2.0.txt)
+"""Implements cancellation tokens for playback sessions"""
+
+from __future__ import absolute_import, division, unicode_literals
+from threading import Event
+from time import time
+
+
+class SessionCancelled(Exception):
+    """Raised when work is done for a playback session that ended"""
+
+
+class Session:
+    """Cancellation token of a playback session, cancelled when the state is reset"""
+
+    def __init__(self):
+        self.event = Event()
+        self.started = time()
+
+    def cancel(self):
+        """Cancel all work for this session"""
+        self.event.set()
+
+    def is_cancelled(self):
+        """Check whether the session ended"""
+        return self.event.is_set()
+
+    def check(self):
+        """Raise SessionCancelled when the session ended"""
+        if self.event.is_set():
+            raise SessionCancelled
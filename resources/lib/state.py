@@ -2,6 +2,9 @@
 # GNU General Public License v2.0 (see COPYING or https://www.gnu.org/licenses/gpl-2.0.txt)
 
 from __future__ import absolute_import, division, unicode_literals
+from metrics import Metrics
+from session import Session
+from tracing import Tracer
 from utils import get_setting_bool, get_setting_int
 
 
@@ -11,8 +14,21 @@ class State:
 
     def __init__(self):
         self.__dict__ = self._shared_state
+        if 'session' in self.__dict__:
+            return
+        self.session = None
+        self.reset()
+
+    def reset(self):
+        """Start a new playback session, work still running for the previous session is abandoned"""
+        if self.session:
+            self.session.cancel()
+        self.session = Session()
+        Metrics().start_session()
+        Tracer().new_session()
         self.play_mode = get_setting_int('autoPlayMode')
         self.include_watched = get_setting_bool('includeWatched')
+        self.queue_ahead = get_setting_int('queueAhead', 0)
         self.current_tv_show_id = None
         self.current_episode_id = None
         self.tv_show_id = None
@@ -21,4 +37,10 @@ class State:
         self.track = False
         self.pause = False
         self.queued = False
+        # Library episodes queued ahead in the playlist, and the ones to queue
+        self.queue = []
+        self.upcoming = []
+        # Next episode and source looked up ahead of the notification, and the file it was looked up for
+        self.prefetched = None
+        self.prefetched_file = None
         self.playing_next = False
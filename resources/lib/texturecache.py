@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v2.0 (see COPYING or https://www.gnu.org/licenses/gpl-2.0.txt)
+"""Implements pre-warming of the Kodi texture cache for next episode artwork"""
+
+from __future__ import absolute_import, division, unicode_literals
+import os
+from re import compile as re_compile
+from threading import Lock, Thread
+from time import time
+from xbmc import getSkinDir
+from xbmcvfs import File, exists
+from metrics import Metrics
+from utils import addon_path, jsonrpc, log as ulog
+
+try:  # Python 3
+    from urllib.parse import quote, unquote
+except ImportError:  # Python 2
+    from urllib import quote, unquote
+
+WINDOW_PROPERTY = re_compile(r'Window\.Property\((\w+)\)')
+
+# Popup window properties and the artwork they show
+ART_PROPERTIES = {
+    'clearart': 'tvshow.clearart',
+    'clearlogo': 'tvshow.clearlogo',
+    'fanart': 'tvshow.fanart',
+    'landscape': 'tvshow.landscape',
+    'poster': 'tvshow.poster',
+    'thumb': 'thumb',
+}
+
+
+def wrap_image_url(url):
+    """Return the image:// URL of an image"""
+    if url.startswith('image://'):
+        return url
+    return 'image://%s/' % quote(url, safe='')
+
+
+def unwrap_image_url(url):
+    """Return the URL of an image as stored in the texture cache, like Kodi's UnwrapImageURL"""
+    if not url.startswith('image://'):
+        return url
+    host = url[len('image://'):].split('/', 1)[0]
+    # Generated images, e.g. video thumbnails, keep their image:// URL
+    if '@' in host or '?' in host:
+        return url
+    return unquote(host)
+
+
+class TextureCache:
+    """Caches the artwork the popup will show ahead of time, so it renders on its first frame"""
+    _shared_state = {}
+
+    # Folders where skins keep their window XML files
+    SKIN_FOLDERS = ('1080i', '720p', '16x9', 'xml')
+    # Number of cached URLs remembered, to not check them again
+    MAX_WARMED = 100
+
+    def __init__(self):
+        self.__dict__ = self._shared_state
+        if 'warmed' in self.__dict__:
+            return
+        self.lock = Lock()
+        self.skin_art = {}
+        self.skin_files = {}
+        self.warmed = set()
+
+    def log(self, msg, level=2):
+        ulog(msg, name=self.__class__.__name__, level=level)
+
+    def skin_file(self, xml_file):
+        """Return the path of a popup window XML file, the active skin may provide its own. Resolved once per skin"""
+        key = (getSkinDir(), xml_file)
+        path = self.skin_files.get(key)
+        if path is None:
+            path = self.skin_files[key] = self.find_skin_file(xml_file)
+        return path
+
+    def find_skin_file(self, xml_file):
+        """Look up a popup window XML file in the folders of the active skin, or use the one of the add-on"""
+        for folder in self.SKIN_FOLDERS:
+            path = 'special://skin/%s/%s' % (folder, xml_file)
+            if exists(path):
+                return path
+        return os.path.join(addon_path(), 'resources', 'skins', 'default', '1080i', xml_file)
+
+    def get_skin_art(self, xml_file):
+        """Return the artwork types shown by a popup window XML file"""
+        path = self.skin_file(xml_file)
+        art_types = self.skin_art.get(path)
+        if art_types is None:
+            try:
+                with File(path) as fdesc:
+                    properties = set(WINDOW_PROPERTY.findall(fdesc.read()))
+            except (IOError, OSError, RuntimeError, ValueError) as exc:
+                self.log('Failed to read %s: %s' % (path, exc), 1)
+                properties = set(ART_PROPERTIES)
+            art_types = self.skin_art[path] = [art for prop, art in sorted(ART_PROPERTIES.items()) if prop in properties]
+        return art_types
+
+    @staticmethod
+    def is_cached(url):
+        """Check whether an image is in the Kodi texture cache"""
+        result = jsonrpc(method='Textures.GetTextures', params={
+            'properties': ['cachedurl'],
+            'filter': {'field': 'url', 'operator': 'is', 'value': unwrap_image_url(url)},
+        })
+        return bool(result.get('result', {}).get('textures'))
+
+    @staticmethod
+    def cache(url):
+        """Add an image to the Kodi texture cache, opening its image:// URL caches it"""
+        File(wrap_image_url(url)).close()
+
+    def prewarm(self, art, xml_files):
+        """Cache the artwork used by the popup windows on a worker thread, returns the URLs to check"""
+        if not art:
+            return []
+        art_types = set()
+        for xml_file in xml_files:
+            art_types.update(self.get_skin_art(xml_file))
+        with self.lock:
+            urls = sorted(set(art.get(art_type) for art_type in art_types if art.get(art_type)) - self.warmed)
+            if len(self.warmed) + len(urls) > self.MAX_WARMED:
+                self.warmed = set()
+            self.warmed.update(urls)
+        if urls:
+            thread = Thread(target=self.run, args=(urls,), name='UpNextTextureCache')
+            thread.daemon = True
+            thread.start()
+        return urls
+
+    def run(self, urls):
+        """Worker thread caching the images missing from the texture cache"""
+        metrics = Metrics()
+        for url in urls:
+            if self.is_cached(url):
+                metrics.count('texturecache.hits')
+                continue
+            start = time()
+            try:
+                self.cache(url)
+            except (IOError, OSError, RuntimeError, ValueError) as exc:
+                self.log('Failed to cache %s: %s' % (url, exc), 1)
+                metrics.count('texturecache.errors')
+                continue
+            metrics.count('texturecache.misses')
+            metrics.timing('texturecache.cache', time() - start)
+            self.log('Cached %s in %.3fs' % (url, time() - start), 2)
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v2.0 (see COPYING or https://www.gnu.org/licenses/gpl-2.0.txt)
+"""Implements a TV show title to tvshowid index for the Kodi library"""
+
+from __future__ import absolute_import, division, unicode_literals
+import json
+from re import compile as re_compile, UNICODE
+from unicodedata import normalize
+from statichelper import to_unicode
+from utils import get_int, jsonrpc, jsonrpc_paged, JsonRpcTimeout, log as ulog
+
+WHITESPACE = re_compile(r'\s+', UNICODE)
+YEAR_SUFFIX = re_compile(r'\s*[\(\[]\d{4}[\)\]]$')
+
+
+def normalize_title(title):
+    """Return a case-folded, Unicode-normalized title for index lookups"""
+    title = normalize('NFKC', to_unicode(title or ''))
+    title = WHITESPACE.sub(' ', title).strip()
+    try:
+        return title.casefold()
+    except AttributeError:  # Python 2 has no str.casefold()
+        return title.lower()
+
+
+def strip_year(title):
+    """Return a normalized title without a year suffix like ' (2005)'"""
+    return YEAR_SUFFIX.sub('', title)
+
+
+class TitleIndex:
+    """Maps normalized TV show titles to tvshowid, built once and kept up to date from library notifications.
+       The index lives as long as the service, the library may change while the service is not running"""
+    _shared_state = {}
+
+    def __init__(self):
+        self.__dict__ = self._shared_state
+        if 'titles' in self.__dict__:
+            return
+        self.built = False
+        # Normalized titles, and the TV shows of each title variant without year suffix
+        self.titles = {}
+        self.variants = {}
+        # The keys we added for each tvshowid, so they are removed without scanning the index
+        self.keys = {}
+        # TV shows updated (True) or removed (False) in the library, applied on the next lookup
+        self.changed = {}
+
+    def log(self, msg, level=2):
+        ulog(msg, name=self.__class__.__name__, level=level)
+
+    def _add(self, tvshowid, *titles):
+        keys = self.keys.setdefault(tvshowid, set())
+        for title in titles:
+            if not title:
+                continue
+            key = normalize_title(title)
+            keys.add(key)
+            self.titles[key] = tvshowid
+            variant = strip_year(key)
+            if variant != key:
+                keys.add(variant)
+                self.variants.setdefault(variant, set()).add(tvshowid)
+
+    def _remove(self, tvshowid):
+        # Also drops keys added by an earlier title of the show
+        for key in self.keys.pop(tvshowid, ()):
+            if self.titles.get(key) == tvshowid:
+                del self.titles[key]
+            tvshowids = self.variants.get(key)
+            if tvshowids is None:
+                continue
+            tvshowids.discard(tvshowid)
+            if not tvshowids:
+                del self.variants[key]
+
+    def build(self, abort=None):
+        """Build the index from a paged scan of all TV shows"""
+        self.titles = {}
+        self.variants = {}
+        self.keys = {}
+        self.changed = {}
+        tvshows = jsonrpc_paged('tvshows', abort=abort, method='VideoLibrary.GetTVShows', id='libTvShows', params={'properties': ['title']})
+        for tvshow in tvshows:
+            self._add(tvshow.get('tvshowid'), tvshow.get('label'), tvshow.get('title'))
+        # An interrupted scan is incomplete, try again on the next lookup
+        self.built = not (abort and abort())
+        self.log('Built index of %d TV shows' % len(self.keys), 2)
+
+    def get_tvshowid(self, title, abort=None):
+        """Return the tvshowid matching title, or None"""
+        if not self.built:
+            self.build(abort=abort)
+        self.refresh()
+
+        key = normalize_title(title)
+        tvshowid = self.titles.get(key)
+        if tvshowid is None:
+            tvshowid = self.titles.get(strip_year(key))
+        if tvshowid is None:
+            # Ambiguous variants (e.g. remakes) do not match any show
+            tvshowids = self.variants.get(key, ())
+            if len(tvshowids) == 1:
+                tvshowid = next(iter(tvshowids))
+        return tvshowid
+
+    def update(self, tvshowid):
+        """Refresh the index entries of a single TV show, it stays pending when Kodi does not answer in time"""
+        try:
+            result = jsonrpc(method='VideoLibrary.GetTVShowDetails', params={'tvshowid': tvshowid, 'properties': ['title']})
+        except JsonRpcTimeout:
+            self.log('Kodi library is busy, refreshing TV show %s on a later lookup' % tvshowid, 1)
+            self.changed.setdefault(tvshowid, True)
+            return
+        tvshow = result.get('result', {}).get('tvshowdetails')
+        self._remove(tvshowid)
+        if tvshow:
+            self._add(tvshowid, tvshow.get('label'), tvshow.get('title'))
+
+    def refresh(self):
+        """Apply the library changes notified since the last lookup"""
+        # Updates that fail are pending again, each change is only tried once per lookup
+        for _ in range(len(self.changed)):
+            tvshowid, updated = self.changed.popitem()
+            if updated:
+                self.update(tvshowid)
+            else:
+                self._remove(tvshowid)
+
+    def handle_notification(self, method, data):
+        """Handle VideoLibrary notifications for TV shows, called from Kodi's notification thread"""
+        if not self.built or method not in ('VideoLibrary.OnUpdate', 'VideoLibrary.OnRemove'):
+            return
+        try:
+            data = json.loads(data)
+        except (TypeError, ValueError):
+            return
+        # Kodi sends the item either nested or at the top level
+        item = data.get('item', data) if isinstance(data, dict) else {}
+        if item.get('type') != 'tvshow':
+            return
+
+        tvshowid = get_int(item, 'id')
+        if tvshowid == -1:
+            return
+        # The index is changed on the next lookup, no JSON-RPC calls are made from the notification thread
+        self.log('TV show %s changed, refreshing it on the next lookup' % tvshowid, 2)
+        self.changed[tvshowid] = method == 'VideoLibrary.OnUpdate'
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v2.0 (see COPYING or https://www.gnu.org/licenses/gpl-2.0.txt)
+"""Implements tracing of episode transitions, exported as Chrome trace events"""
+
+from __future__ import absolute_import, division, unicode_literals
+import io
+import json
+import os
+from collections import deque
+from contextlib import contextmanager
+from threading import Lock, current_thread
+from time import time
+from statichelper import to_unicode
+from utils import addon_profile, log as ulog
+
+
+class Tracer:
+    """Records timestamped spans per playback session, viewable in chrome://tracing or Perfetto"""
+    _shared_state = {}
+
+    FILENAME = 'upnext_trace.json'
+    # Number of trace events kept, older events are dropped
+    MAX_EVENTS = 2000
+    # Seconds after which a span started elsewhere is considered abandoned, e.g. when playback was stopped
+    MAX_PENDING = 60
+
+    def __init__(self):
+        self.__dict__ = self._shared_state
+        if 'events' in self.__dict__:
+            return
+        self.lock = Lock()
+        self.events = deque(maxlen=self.MAX_EVENTS)
+        self.pending = {}
+        # Thread names by thread id, exported as metadata events
+        self.threads = {}
+        self.session = 0
+        self.pid = os.getpid()
+        # Set when the trace file should be written by the service loop
+        self.export_requested = False
+
+    def log(self, msg, level=2):
+        ulog(msg, name=self.__class__.__name__, level=level)
+
+    def new_session(self):
+        """Tag the events that follow with a new playback session"""
+        with self.lock:
+            self.session += 1
+
+    def add(self, name, phase, start, duration=None, **args):
+        """Add a trace event, timestamps are in seconds"""
+        thread = current_thread()
+        event = {
+            'name': name,
+            'cat': 'upnext',
+            'ph': phase,
+            'ts': int(start * 1000000),
+            'pid': self.pid,
+            'tid': thread.ident,
+        }
+        if duration is not None:
+            event['dur'] = int(duration * 1000000)
+        if phase == 'i':
+            event['s'] = 'p'
+        with self.lock:
+            event['args'] = dict(args, session=self.session)
+            self.events.append(event)
+            self.threads[thread.ident] = thread.name
+
+    @contextmanager
+    def span(self, name, **args):
+        """Record the duration of a block of code"""
+        start = time()
+        try:
+            yield
+        finally:
+            self.add(name, 'X', start, time() - start, **args)
+
+    def instant(self, name, **args):
+        """Record a moment, e.g. a user action"""
+        self.add(name, 'i', time(), **args)
+
+    def start(self, name):
+        """Start a span that ends somewhere else, unless it was already started"""
+        now = time()
+        with self.lock:
+            if now - self.pending.get(name, 0) > self.MAX_PENDING:
+                self.pending[name] = now
+
+    def finish(self, name, **args):
+        """End a span started elsewhere, returns its duration or None when it was not started"""
+        with self.lock:
+            start = self.pending.pop(name, None)
+        if start is None:
+            return None
+        duration = time() - start
+        if duration > self.MAX_PENDING:
+            return None
+        self.add(name, 'X', start, duration, **args)
+        return duration
+
+    def cancel(self, name):
+        """Forget a span started elsewhere"""
+        with self.lock:
+            self.pending.pop(name, None)
+
+    def request_export(self):
+        """Ask the service loop to write the trace file, writing it from a Kodi callback would delay the callback"""
+        self.export_requested = True
+
+    def pending_export(self):
+        """Check whether the trace file should be written, clearing the request"""
+        with self.lock:
+            requested, self.export_requested = self.export_requested, False
+        return requested
+
+    def export(self, path=None):
+        """Write all trace events to a Chrome trace event JSON file, returns False when that failed"""
+        path = path or os.path.join(addon_profile(), self.FILENAME)
+        with self.lock:
+            # Trace viewers expect integer thread ids, their names are given by metadata events
+            tids = set(event.get('tid') for event in self.events)
+            self.threads = {tid: name for tid, name in self.threads.items() if tid in tids}
+            metadata = [
+                {'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': tid, 'args': {'name': name}}
+                for tid, name in sorted(self.threads.items())
+            ]
+            trace = {'traceEvents': metadata + list(self.events), 'displayTimeUnit': 'ms'}
+        try:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with io.open(path, 'w', encoding='utf-8') as fdesc:
+                fdesc.write(to_unicode(json.dumps(trace)))
+        except (IOError, OSError) as exc:
+            self.log('Failed to write %s: %s' % (path, exc), 1)
+            return False
+        return True
@@ -2,21 +2,90 @@
 # GNU General Public License v2.0 (see COPYING or https://www.gnu.org/licenses/gpl-2.0.txt)
 
 from __future__ import absolute_import, division, unicode_literals
-import sys
 import json
-from datetime import date
-from re import split as re_split
-from xbmc import executeJSONRPC, getInfoLabel, getRegion, log as xlog, LOGDEBUG, LOGINFO
+from collections import OrderedDict
+from re import compile as re_compile
+from threading import Event, Lock, Thread, local
+from time import time as now
+from xbmc import executeJSONRPC, getInfoLabel, getRegion, log as xlog, LOGDEBUG, LOGINFO, Monitor
 from xbmcaddon import Addon
 from xbmcgui import Window
+from diagnostics import Diagnostics
+from metrics import Metrics
+try:  # Python 3
+    from queue import Queue
+except ImportError:  # Python 2
+    from Queue import Queue
+try:  # Kodi v19 or newer
+    from xbmcvfs import translatePath
+except ImportError:  # Kodi v18 and older
+    from xbmc import translatePath  # pylint: disable=ungrouped-imports
 from statichelper import from_unicode, to_unicode
 
-ADDON = Addon()
+JSON_DECODER = json.JSONDecoder()
+JSON_WHITESPACE = re_compile(r'[ \t\n\r]*')
+
+# Window handles per window ID, and the property values the service wrote itself.
+# Only the properties written for every log line skip unchanged values, others may be changed outside the service.
+WINDOWS = {}
+PROPERTIES = {}
+PROPERTIES_LOCK = Lock()
+PROPERTIES_DEDUPED = ('logLevel',)
+
+# Region formats, strings and dates of the current locale, resolved on first use
+LOCALE_CACHE = {}
+# Dates are parsed from their first three numbers, e.g. 2020-01-31
+DATE_SEPARATOR = re_compile(r'[\W]')
+
+# Paged library scans start at PAGE_SIZE items and adapt the page size per method
+# between PAGE_SIZE_MIN and PAGE_SIZE_MAX to keep each page close to PAGE_TIME seconds
+PAGE_SIZE = 100
+PAGE_SIZE_MIN = 25
+PAGE_SIZE_MAX = 1000
+PAGE_TIME = 0.05
+PAGE_SIZES = {}
+
+# Deadline in seconds per JSON-RPC method, calls of other methods run without deadline
+JSONRPC_DEADLINES = {
+    'Player.GetItem': 2,
+    'Player.GetProperties': 2,
+    'Playlist.GetItems': 2,
+    'VideoLibrary.GetEpisodes': 5,
+    'VideoLibrary.GetTVShowDetails': 2,
+    'VideoLibrary.GetTVShows': 5,
+}
+# Calls taking longer than this many seconds are logged by the watchdog
+JSONRPC_SLOW = 0.5
+# Latest responses of library reads with a deadline, used when a later identical call misses its deadline.
+# Player and playlist calls are not cached, their identical requests get different answers for every episode.
+JSONRPC_STALE = ('VideoLibrary.',)
+# The cache keeps at most JSONRPC_CACHE_SIZE responses of JSONRPC_CACHE_BYTES in total, larger responses are not kept.
+JSONRPC_CACHE = OrderedDict()
+JSONRPC_CACHE_LOCK = Lock()
+JSONRPC_CACHE_SIZE = 32
+JSONRPC_CACHE_BYTES = 1024 * 1024
+# Calls with a deadline run one after another on a single worker thread, started on first use
+JSONRPC_QUEUE = Queue()
+JSONRPC_WORKER = []
+JSONRPC_WORKER_LOCK = Lock()
+# Logging performs JSON-RPC calls itself, the watchdog skips the calls made while logging
+JSONRPC_WATCHDOG = local()
+
+
+class JsonRpcTimeout(Exception):
+    """Raised when a JSON-RPC call misses its deadline and no earlier response is available"""
+
+
+def get_addon(addon_cache=[]):  # pylint: disable=dangerous-default-value
+    """Return the add-on instance, created on first use"""
+    if not addon_cache:
+        addon_cache.append(Addon())
+    return addon_cache[0]
 
 
 def get_addon_info(key):
     """Return add-on information"""
-    return to_unicode(ADDON.getAddonInfo(key))
+    return to_unicode(get_addon().getAddonInfo(key))
 
 
 def addon_id():
@@ -29,25 +98,58 @@ def addon_path():
     return get_addon_info('path')
 
 
-def get_kodi_version():
+def addon_profile():
+    """Return the local path of the add-on profile folder"""
+    return to_unicode(translatePath(get_addon_info('profile')))
+
+
+def get_kodi_version(version_cache=[]):  # pylint: disable=dangerous-default-value
     """Return Kodi version number as float"""
-    build = getInfoLabel("System.BuildVersion")
-    return float(build[:4])
+    # The version does not change while Kodi runs, parse it only once
+    if not version_cache:
+        build = getInfoLabel("System.BuildVersion")
+        version_cache.append(float(build[:4]))
+    return version_cache[0]
+
+
+def get_window(window_id=10000):
+    """Return the handle of a window, created once per window ID"""
+    window = WINDOWS.get(window_id)
+    if window is None:
+        window = WINDOWS[window_id] = Window(window_id)
+    return window
 
 
 def get_property(key, window_id=10000):
     """Get a Window property"""
-    return to_unicode(Window(window_id).getProperty(key))
+    return to_unicode(get_window(window_id).getProperty(key))
 
 
 def set_property(key, value, window_id=10000):
     """Set a Window property"""
-    return Window(window_id).setProperty(key, from_unicode(str(value)))
+    set_properties({key: value}, window_id=window_id)
 
 
 def clear_property(key, window_id=10000):
     """Clear a Window property"""
-    return Window(window_id).clearProperty(key)
+    set_properties({key: None}, window_id=window_id)
+
+
+def set_properties(properties, window_id=10000):
+    """Set or clear (for a value of None) several Window properties, skipping unchanged values of frequent properties"""
+    window = get_window(window_id)
+    with PROPERTIES_LOCK:
+        for key, value in sorted(properties.items()):
+            value = '' if value is None else from_unicode(str(value))
+            # Properties this service did not write yet may have been left behind by an earlier run
+            if key in PROPERTIES_DEDUPED:
+                if PROPERTIES.get((window_id, key)) == value:
+                    continue
+                PROPERTIES[(window_id, key)] = value
+            if value:
+                window.setProperty(key, value)
+            else:
+                window.clearProperty(key)
 
 
 def get_int(obj, key=None, default=-1):
@@ -77,6 +179,11 @@ def get_setting(key, default=None):
     return value
 
 
+def set_setting(key, value):
+    """Set an add-on setting, writes go through the cached add-on instance"""
+    return get_addon().setSetting(key, from_unicode(str(value)))
+
+
 def get_setting_bool(key, default=None):
     """Get an add-on setting as boolean"""
     try:
@@ -106,63 +213,69 @@ def get_setting_int(key, default=None):
 
 def encode_data(data, encoding='base64'):
     """Encode data for a notification event"""
-    json_data = json.dumps(data).encode()
-    if encoding == 'base64':
-        from base64 import b64encode
-        encoded_data = b64encode(json_data)
-    elif encoding == 'hex':
-        from binascii import hexlify
-        encoded_data = hexlify(json_data)
-    else:
+    import codec  # Only needed once add-ons send data
+    encoded_data = codec.encode(data, encoding=encoding)
+    if encoded_data is None:
         log("Unknown payload encoding type '%s'" % encoding, level=0)
-        return None
-    if sys.version_info[0] > 2:
-        encoded_data = encoded_data.decode('ascii')
     return encoded_data
 
 
 def decode_data(encoded):
     """Decode data coming from a notification event"""
-    encoding = 'base64'
-    from binascii import Error, unhexlify
-    try:
-        json_data = unhexlify(encoded)
-    except (TypeError, Error):
-        from base64 import b64decode
-        json_data = b64decode(encoded)
-    else:
-        encoding = 'hex'
-    # NOTE: With Python 3.5 and older json.loads() does not support bytes or bytearray, so we convert to unicode
-    return json.loads(to_unicode(json_data)), encoding
+    import codec  # Only needed once add-ons send data
+    return codec.decode(encoded)
 
 
 def decode_json(data):
-    encoded = json.loads(data)
-    if not encoded:
+    """Decode the JSON list of encoded data sent by a notification event"""
+    try:
+        encoded = json.loads(data)
+        if not encoded:
+            return None, None
+        return decode_data(encoded[0])
+    except (TypeError, ValueError) as exc:
+        log('Failed to decode data: %s' % exc, level=0)
         return None, None
-    return decode_data(encoded[0])
 
 
-def event(message, data=None, sender=None, encoding='base64'):
-    """Send internal notification event"""
+def notify_request(message, data=None, sender=None, encoding='base64'):
+    """Return the JSONRPC request for an internal notification event, or None"""
     data = data or {}
     sender = sender or addon_id()
 
     encoded = encode_data(data, encoding=encoding)
     if not encoded:
+        return None
+
+    return {
+        'method': 'JSONRPC.NotifyAll',
+        'params': {
+            'sender': '%s.SIGNAL' % sender,
+            'message': message,
+            'data': [encoded],
+        },
+    }
+
+
+def event(message, data=None, sender=None, encoding='base64'):
+    """Send internal notification event"""
+    request = notify_request(message, data=data, sender=sender, encoding=encoding)
+    if not request:
         return
 
-    jsonrpc(method='JSONRPC.NotifyAll', params={
-        'sender': '%s.SIGNAL' % sender,
-        'message': message,
-        'data': [encoded],
-    })
+    jsonrpc(**request)
 
 
 def log(msg, name=None, level=1):
     """Log information to the Kodi log"""
     log_level = get_setting_int('logLevel', level)
-    debug_logging = get_global_setting('debug.showloginfo')
+    # The watchdog skips the JSON-RPC call made for every log line
+    logging = getattr(JSONRPC_WATCHDOG, 'logging', False)
+    JSONRPC_WATCHDOG.logging = True
+    try:
+        debug_logging = get_global_setting('debug.showloginfo')
+    finally:
+        JSONRPC_WATCHDOG.logging = logging
     set_property('logLevel', log_level)
     if not debug_logging and log_level < level:
         return
@@ -182,13 +295,221 @@ def calculate_progress_steps(period):
     return (100.0 / int(period)) / 10
 
 
+def _execute(request):
+    """Execute a JSON-RPC request, within its deadline for methods that have one"""
+    method = request.get('method') if isinstance(request, dict) else 'batch'
+    payload = json.dumps(request)
+    deadline = JSONRPC_DEADLINES.get(method)
+    if deadline is None:
+        start = now()
+        response = executeJSONRPC(payload)
+        _watchdog(method, payload, response, now() - start)
+        return response
+
+    # Kodi cannot interrupt a call, a call that misses its deadline completes in the background
+    result = []
+    done = Event()
+    stale = method.startswith(JSONRPC_STALE)
+
+    def call():
+        start = now()
+        response = executeJSONRPC(payload)
+        _watchdog(method, payload, response, now() - start)
+        if stale:
+            with JSONRPC_CACHE_LOCK:
+                JSONRPC_CACHE.pop(payload, None)
+                if len(response) <= JSONRPC_CACHE_BYTES:
+                    JSONRPC_CACHE[payload] = response
+                while (len(JSONRPC_CACHE) > JSONRPC_CACHE_SIZE
+                       or sum(len(cached) for cached in JSONRPC_CACHE.values()) > JSONRPC_CACHE_BYTES):
+                    JSONRPC_CACHE.popitem(last=False)
+        result.append(response)
+        done.set()
+
+    _submit(call)
+    if done.wait(deadline):
+        return result[0]
+
+    Metrics().count('jsonrpc.timeouts')
+    with JSONRPC_CACHE_LOCK:
+        response = JSONRPC_CACHE.get(payload) if stale else None
+    if response is None:
+        log('%s missed its deadline of %ss' % (method, deadline), name='jsonrpc', level=0)
+        Diagnostics().error('jsonrpc timeout', method=method, deadline=deadline)
+        raise JsonRpcTimeout(method)
+    log('%s missed its deadline of %ss, using an earlier response' % (method, deadline), name='jsonrpc', level=0)
+    Diagnostics().record('jsonrpc stale', method=method, deadline=deadline)
+    Metrics().count('jsonrpc.stale')
+    return response
+
+
+def _submit(call):
+    """Queue a call for the JSON-RPC worker thread, starting the thread when needed"""
+    with JSONRPC_WORKER_LOCK:
+        if not JSONRPC_WORKER:
+            thread = Thread(target=_worker, name='UpNextJsonRpc')
+            thread.daemon = True
+            thread.start()
+            JSONRPC_WORKER.append(thread)
+    JSONRPC_QUEUE.put(call)
+
+
+def _worker():
+    """Run queued JSON-RPC calls, a call that missed its deadline still completes and updates the cache"""
+    while True:
+        call = JSONRPC_QUEUE.get()
+        try:
+            call()
+        except Exception as exc:  # pylint: disable=broad-except
+            # The caller misses its deadline, the worker keeps running for later calls
+            log('Failed to execute a JSON-RPC call: %s' % exc, name='jsonrpc', level=0)
+
+
+def _watchdog(method, payload, response, elapsed):
+    """Record the duration and sizes of a JSON-RPC call, and record and log slow calls"""
+    if getattr(JSONRPC_WATCHDOG, 'logging', False):
+        return
+    metrics = Metrics()
+    metrics.timing('jsonrpc.%s' % method, elapsed)
+    metrics.size('jsonrpc.%s.request' % method, len(payload))
+    metrics.size('jsonrpc.%s.response' % method, len(response))
+    if elapsed <= JSONRPC_SLOW:
+        return
+    Diagnostics().record('jsonrpc slow', method=method, elapsed=elapsed, size=len(response))
+    log('Slow call %s took %.3fs, request %d bytes, response %d bytes' % (method, elapsed, len(payload), len(response)),
+        name='jsonrpc', level=0)
+
+
 def jsonrpc(**kwargs):
     """Perform JSONRPC calls"""
     if kwargs.get('id') is None:
         kwargs.update(id=0)
     if kwargs.get('jsonrpc') is None:
         kwargs.update(jsonrpc='2.0')
-    return json.loads(executeJSONRPC(json.dumps(kwargs)))
+    result = json.loads(_execute(kwargs))
+    if 'error' in result:
+        Diagnostics().record('jsonrpc error', method=kwargs.get('method'), error=result.get('error'))
+        Metrics().count('jsonrpc.%s.errors' % kwargs.get('method'))
+    return result
+
+
+def jsonrpc_batch(requests):
+    """Perform several JSONRPC calls in one batch, returns the responses in the order of the requests"""
+    requests = [dict(request, id=idx, jsonrpc='2.0') for idx, request in enumerate(requests)]
+    responses = json.loads(_execute(requests))
+    if not isinstance(responses, list):
+        # A single error response for the whole batch
+        return [responses] * len(requests)
+    by_id = {response.get('id'): response for response in responses if isinstance(response, dict)}
+    for request in requests:
+        if 'error' in by_id.get(request.get('id'), {}):
+            Diagnostics().record('jsonrpc error', method=request.get('method'), error=by_id.get(request.get('id')).get('error'))
+            Metrics().count('jsonrpc.%s.errors' % request.get('method'))
+    return [by_id.get(idx, {}) for idx in range(len(requests))]
+
+
+def jsonrpc_items(key, **kwargs):
+    """Perform JSONRPC calls and lazily decode the items of the result array named key"""
+    if kwargs.get('id') is None:
+        kwargs.update(id=0)
+    if kwargs.get('jsonrpc') is None:
+        kwargs.update(jsonrpc='2.0')
+    return iter_result_items(_execute(kwargs), key)
+
+
+def jsonrpc_paged(key, abort=None, **kwargs):
+    """Perform paged JSONRPC calls and lazily yield the items of the result array named key.
+       Between pages the scan yields to other threads and stops when Kodi is exiting
+       or when the optional abort callable returns True."""
+    method = kwargs.get('method')
+    params = dict(kwargs.get('params', {}))
+    kwargs.update(params=params)
+    start = 0
+    while True:
+        page_size = PAGE_SIZES.get(method, PAGE_SIZE)
+        params.update(limits={'start': start, 'end': start + page_size})
+        page_start = now()
+        items = jsonrpc_items(key, **kwargs)
+        _adapt_page_size(method, page_size, now() - page_start)
+
+        count = 0
+        for item in items:
+            count += 1
+            yield item
+        if count < page_size:
+            return
+        start += count
+
+        if _get_monitor().waitForAbort(0.001) or (abort and abort()):
+            log('Paged %s scan aborted after %d items' % (method, start), name='jsonrpc_paged', level=2)
+            return
+
+
+def _adapt_page_size(method, page_size, elapsed):
+    """Grow fast pages and shrink slow pages, within limits"""
+    if elapsed < PAGE_TIME / 2:
+        PAGE_SIZES[method] = min(page_size * 2, PAGE_SIZE_MAX)
+    elif elapsed > PAGE_TIME:
+        PAGE_SIZES[method] = max(page_size // 2, PAGE_SIZE_MIN)
+
+
+def _get_monitor(monitor_cache=[None]):  # pylint: disable=dangerous-default-value
+    """Return a Monitor instance for use in utility functions"""
+    if monitor_cache[0] is None:
+        monitor_cache[0] = Monitor()
+    return monitor_cache[0]
+
+
+def _skip_whitespace(data, idx):
+    """Return the index of the first non-whitespace character from idx"""
+    return JSON_WHITESPACE.match(data, idx).end()
+
+
+def _find_member(data, idx, name):
+    """Return the index of the value of member name in the JSON object at idx, or None"""
+    idx = _skip_whitespace(data, idx)
+    if data[idx] != '{':
+        return None
+    idx = _skip_whitespace(data, idx + 1)
+    while data[idx] != '}':
+        key, idx = JSON_DECODER.raw_decode(data, idx)
+        idx = _skip_whitespace(data, idx)
+        if data[idx] != ':':
+            raise ValueError('Expecting : delimiter at char %d' % idx)
+        idx = _skip_whitespace(data, idx + 1)
+        if key == name:
+            return idx
+        # Other members are small (id, jsonrpc, limits), decode and drop them
+        _, idx = JSON_DECODER.raw_decode(data, idx)
+        idx = _skip_whitespace(data, idx)
+        if data[idx] == ',':
+            idx = _skip_whitespace(data, idx + 1)
+    return None
+
+
+def iter_result_items(data, key):
+    """Lazily decode the items of the result array named key from a JSONRPC response.
+       Items are decoded one by one, so callers that stop iterating early never
+       build the remainder of the array."""
+    try:
+        idx = _find_member(data, 0, 'result')
+        if idx is None:
+            return
+        idx = _find_member(data, idx, key)
+        if idx is None or data[idx] != '[':
+            return
+        idx = _skip_whitespace(data, idx + 1)
+        if data[idx] == ']':
+            return
+        while True:
+            item, idx = JSON_DECODER.raw_decode(data, idx)
+            yield item
+            idx = _skip_whitespace(data, idx)
+            if data[idx] != ',':
+                return
+            idx = _skip_whitespace(data, idx + 1)
+    except IndexError:
+        raise ValueError('Unexpected end of JSONRPC response')  # pylint: disable=raise-missing-from
 
 
 def get_global_setting(setting):
@@ -198,39 +519,59 @@ def get_global_setting(setting):
     return result.get('result', {}).get('value')
 
 
+def clear_locale_cache():
+    """Forget the resolved region formats and strings, so a changed locale is used"""
+    LOCALE_CACHE.clear()
+
+
 def localize(string_id):
     """Return the translated string from the .po language files"""
-
-    return ADDON.getLocalizedString(string_id)
+    key = ('string', string_id)
+    value = LOCALE_CACHE.get(key)
+    if value is None:
+        value = LOCALE_CACHE[key] = get_addon().getLocalizedString(string_id)
+    return value
 
 
 def localize_date(date_string):
     """Localize date format"""
-    date_format = getRegion('dateshort')
+    key = ('date', date_string)
+    value = LOCALE_CACHE.get(key)
+    if value is not None:
+        return value
+
+    from datetime import date  # Only needed by the popups
+    date_format = LOCALE_CACHE.get('dateshort')
+    if date_format is None:
+        date_format = LOCALE_CACHE['dateshort'] = getRegion('dateshort')
 
     try:
         # A number of assumptions are made here about date_string
         # format to avoid having to import dateutil or similar
         date_object = date(*(
             int(part)
-            for part in re_split(r'[\W]', date_string)[:3]
+            for part in DATE_SEPARATOR.split(date_string)[:3]
         ))
+        value = date_object.strftime(date_format)
     except ValueError:
-        return date_string
+        value = date_string
 
-    return date_object.strftime(date_format)
+    LOCALE_CACHE[key] = value
+    return value
 
 
 def localize_time(time):
     """Localize time format"""
-    time_format = getRegion('time')
+    time_format = LOCALE_CACHE.get('time')
+    if time_format is None:
+        time_format = getRegion('time')
 
-    # Fix a bug in Kodi v18.5 and older causing double hours
-    # https://github.com/xbmc/xbmc/pull/17380
-    time_format = time_format.replace('%H%H:', '%H:')
+        # Fix a bug in Kodi v18.5 and older causing double hours
+        # https://github.com/xbmc/xbmc/pull/17380
+        time_format = time_format.replace('%H%H:', '%H:')
 
-    # Strip off seconds
-    time_format = time_format.replace(':%S', '')
+        # Strip off seconds
+        time_format = LOCALE_CACHE['time'] = time_format.replace(':%S', '')
 
     return time.strftime(time_format)
 
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v2.0 (see COPYING or https://www.gnu.org/licenses/gpl-2.0.txt)
+
+# pylint: disable=missing-docstring
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+import unittest
+from resources.lib import addondata
+
+
+def payload(showtitle, season, episode, plot=''):
+    return {
+        'current_episode': {
+            'episodeid': episode, 'tvshowid': 1, 'showtitle': showtitle, 'season': season, 'episode': episode,
+            'title': 'Episode %d' % episode, 'plot': plot, 'art': {'tvshow.fanart': 'fanart.jpg', 'tvshow.banner': 'banner.jpg'},
+        },
+        'next_episode': {
+            'episodeid': episode + 1, 'tvshowid': 1, 'showtitle': showtitle, 'season': season, 'episode': episode + 1,
+            'title': 'Episode %d' % (episode + 1), 'plot': plot, 'cast': ['Someone'] * 100,
+            'art': {'tvshow.fanart': 'fanart.jpg', 'tvshow.banner': 'banner.jpg', 'thumb': 'thumb.jpg'},
+        },
+        'play_info': {'episode_id': episode + 1},
+        'unused': 'x' * 1000,
+    }
+
+
+class TestAddonDataRegistry(unittest.TestCase):
+
+    def setUp(self):
+        addondata.AddonDataRegistry._shared_state.clear()  # pylint: disable=protected-access
+        self.registry = addondata.AddonDataRegistry()
+
+    def tearDown(self):
+        addondata.AddonDataRegistry._shared_state.clear()  # pylint: disable=protected-access
+
+    def test_trim_payload(self):
+        data = addondata.trim_payload(payload('Show', 1, 1, plot='Plot'))
+        self.assertNotIn('unused', data)
+        self.assertNotIn('plot', data.get('current_episode'))
+        self.assertNotIn('art', data.get('current_episode'))
+        self.assertNotIn('cast', data.get('next_episode'))
+        self.assertEqual(data.get('next_episode').get('plot'), 'Plot')
+        self.assertEqual(data.get('next_episode').get('art'), {'tvshow.fanart': 'fanart.jpg', 'thumb': 'thumb.jpg'})
+        self.assertEqual(data.get('play_info'), {'episode_id': 2})
+
+    def test_senders_do_not_clobber(self):
+        self.registry.put('plugin.video.one', payload('One', 1, 1), encoding='base64')
+        self.registry.put('plugin.video.two', payload('Two', 2, 5), encoding='hex')
+        self.assertEqual(self.registry.get_data().get('next_episode').get('showtitle'), 'Two')
+        self.assertEqual(self.registry.get_encoding(), 'hex')
+
+        self.registry.select('One', 1, 1)
+        self.assertEqual(self.registry.get_data().get('next_episode').get('showtitle'), 'One')
+        self.assertEqual(self.registry.get_encoding(), 'base64')
+
+        # Unknown items keep the active payload
+        self.registry.select('Three', 1, 1)
+        self.assertEqual(self.registry.get_data().get('next_episode').get('showtitle'), 'One')
+
+    def test_lru_eviction(self):
+        setattr(self.registry, 'MAX_SIZE', 4096)
+        for episode in range(1, 51):
+            self.registry.put('plugin.video.one', payload('One', 1, episode, plot='Plot ' * 50))
+            self.assertLessEqual(self.registry.size, self.registry.MAX_SIZE)
+        self.assertEqual(self.registry.get_data().get('current_episode').get('episode'), 50)
+        self.assertLess(len(self.registry.entries), 50)
+        self.assertEqual(self.registry.size, sum(entry.get('size') for entry in self.registry.entries.values()))
+
+    def test_expire(self):
+        self.registry.put('plugin.video.one', payload('One', 1, 1))
+        # Data that just arrived survives the end of the previous playback, but is not used for an unrelated item
+        self.registry.expire()
+        self.assertEqual(self.registry.get_data(), {})
+        self.registry.select('Other', 1, 1)
+        self.assertEqual(self.registry.get_data(), {})
+        self.registry.select('One', 1, 1)
+        self.assertTrue(self.registry.get_data())
+
+        for entry in self.registry.entries.values():
+            entry['received'] -= self.registry.GRACE_TIME + 1
+        self.registry.expire()
+        self.assertEqual(self.registry.get_data(), {})
+        self.assertEqual(self.registry.size, 0)
+
+    def test_next_episodes(self):
+        data = payload('One', 1, 1)
+        del data['next_episode']
+        data['next_episodes'] = [
+            dict(payload('One', 1, episode).get('next_episode'), play_info={'episode_id': episode + 1}) for episode in range(1, 4)
+        ]
+        self.registry.put('plugin.video.one', data)
+        self.assertEqual(self.registry.get_data().get('next_episode').get('episode'), 2)
+        self.assertEqual(self.registry.get_data().get('play_info'), {'episode_id': 2})
+
+        # Advance locally through the upcoming episodes
+        self.assertTrue(self.registry.advance())
+        data = self.registry.get_data()
+        self.assertEqual(data.get('current_episode').get('episode'), 2)
+        self.assertEqual(data.get('next_episode').get('episode'), 3)
+        self.assertEqual(data.get('play_info'), {'episode_id': 3})
+        self.assertEqual(data.get('id'), None)
+
+        self.assertTrue(self.registry.advance())
+        self.assertEqual(self.registry.get_data().get('next_episode').get('episode'), 4)
+        self.assertEqual(self.registry.get_data().get('play_info'), {'episode_id': 4})
+        self.registry.select('One', 1, 2)
+        self.assertEqual(self.registry.get_data().get('next_episode').get('episode'), 3)
+
+        # The list ran out, wait for new data from the add-on
+        self.registry.select('One', 1, 3)
+        self.assertFalse(self.registry.advance())
+        self.assertFalse(self.registry.advance())
+
+        # Payloads without next_episodes do not advance
+        self.registry.put('plugin.video.two', payload('Two', 1, 1))
+        self.assertFalse(self.registry.advance())
+
+
+if __name__ == '__main__':
+    unittest.main()
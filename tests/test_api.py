@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v2.0 (see COPYING or https://www.gnu.org/licenses/gpl-2.0.txt)
+
+# pylint: disable=missing-docstring
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+import unittest
+from resources.lib import api, capabilities
+
+EPISODES = [
+    {'episodeid': 1, 'file': '/show/s01e01.mkv', 'playcount': 1},
+    {'episodeid': 2, 'file': '/show/s01e02.mkv', 'playcount': 0},
+    {'episodeid': 3, 'file': '/show/s01e03-04.mkv', 'playcount': 1},
+    {'episodeid': 4, 'file': '/show/s01e03-04.mkv', 'playcount': 1},
+    {'episodeid': 5, 'file': '/show/s01e05.mkv', 'playcount': 0},
+    {'episodeid': 6, 'file': '/show/s01e06.mkv', 'playcount': 0},
+]
+
+
+class TestApi(unittest.TestCase):
+
+    def setUp(self):
+        self.requests = []
+        self.capabilities = capabilities.Capabilities(kodi_version=19.4, jsonrpc_version=(12, 4, 0), av_started=True,
+                                                      external_player=True, episode_filter=True, playlist_add_array=True)
+        self.saved = api.jsonrpc, api.jsonrpc_batch, api.jsonrpc_paged, api.sleep, api.get_capabilities
+        api.jsonrpc = self.fake_jsonrpc
+        api.jsonrpc_batch = lambda requests: [self.fake_jsonrpc(**request) for request in requests]
+        api.jsonrpc_paged = self.fake_jsonrpc_paged
+        api.sleep = lambda msec: None
+        api.get_capabilities = lambda: self.capabilities
+        self.api = api.Api()
+
+    def tearDown(self):
+        api.jsonrpc, api.jsonrpc_batch, api.jsonrpc_paged, api.sleep, api.get_capabilities = self.saved
+
+    def fake_jsonrpc(self, **kwargs):
+        self.requests.append(kwargs)
+        return {'result': {}}
+
+    def fake_jsonrpc_paged(self, key, abort=None, **kwargs):  # pylint: disable=unused-argument
+        self.requests.append(kwargs)
+        return iter(EPISODES)
+
+    def test_lookup_of_episodes(self):
+        episodes = self.api.handle_kodi_lookup_of_episodes(1, '/show/s01e01.mkv', True, 1, count=3)
+        self.assertEqual([episode.get('episodeid') for episode in episodes], [2, 3, 5])
+
+        episodes = self.api.handle_kodi_lookup_of_episodes(1, '/show/s01e01.mkv', False, 1, count=3)
+        self.assertEqual([episode.get('episodeid') for episode in episodes], [2, 5, 6])
+
+        episode = self.api.handle_kodi_lookup_of_episode(1, '/show/s01e02.mkv', True, 2)
+        self.assertEqual(episode.get('episodeid'), 3)
+
+        self.assertEqual(self.api.handle_kodi_lookup_of_episodes(1, '/show/s01e06.mkv', True, 6, count=3), [])
+
+    def test_queue_next_items(self):
+        api.Api.queue_next_items(EPISODES[1:3])
+        add = self.requests[-1]
+        self.assertEqual(add.get('method'), 'Playlist.Add')
+        self.assertEqual(add.get('params').get('item'), [{'episodeid': 2}, {'episodeid': 3}])
+
+    def test_queue_next_items_single(self):
+        self.capabilities = self.capabilities._replace(playlist_add_array=False)
+        self.requests = []
+        api.Api.queue_next_items(EPISODES[1:3])
+        items = [request.get('params').get('item') for request in self.requests if request.get('method') == 'Playlist.Add']
+        self.assertEqual(items, [{'episodeid': 2}, {'episodeid': 3}])
+
+    def test_get_episode_id(self):
+        self.assertEqual(api.Api.get_episode_id('1', 1, 2), 0)
+        self.assertEqual(self.requests[-1].get('params').get('filter'), {'field': 'episode', 'operator': 'is', 'value': '2'})
+        self.capabilities = self.capabilities._replace(episode_filter=False)
+        api.Api.get_episode_id('1', 1, 2)
+        self.assertNotIn('filter', self.requests[-1].get('params'))
+
+    def test_dequeue_items(self):
+        self.requests = []
+        api.Api.dequeue_items(3)
+        positions = [request.get('params').get('position') for request in self.requests if request.get('method') == 'Playlist.Remove']
+        self.assertEqual(positions, [3, 2, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
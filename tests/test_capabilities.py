@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v2.0 (see COPYING or https://www.gnu.org/licenses/gpl-2.0.txt)
+
+# pylint: disable=missing-docstring
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+import unittest
+from resources.lib import capabilities
+
+# Introspection of Kodi v19, trimmed to the parameters that are probed
+METHODS = {
+    'Playlist.Add': {'params': [
+        {'name': 'playlistid', '$ref': 'Playlist.Id', 'required': True},
+        {'name': 'item', 'required': True, 'type': [{'$ref': 'Playlist.Item'}, {'type': 'array', 'items': {'$ref': 'Playlist.Item'}}]},
+    ]},
+    'VideoLibrary.GetEpisodes': {'params': [
+        {'name': 'tvshowid', '$ref': 'Library.Id'},
+        {'name': 'season', 'type': 'integer'},
+        {'name': 'properties', '$ref': 'Video.Fields.Episode'},
+        {'name': 'filter', 'type': [{'$ref': 'List.Filter.Episodes'}]},
+    ]},
+}
+
+
+class TestCapabilities(unittest.TestCase):
+
+    def setUp(self):
+        self.methods = dict(METHODS)
+        self.saved = capabilities.jsonrpc
+        capabilities.jsonrpc = self.fake_jsonrpc
+        del capabilities.CAPABILITIES[:]
+
+    def tearDown(self):
+        capabilities.jsonrpc = self.saved
+        del capabilities.CAPABILITIES[:]
+
+    def fake_jsonrpc(self, **kwargs):
+        if kwargs.get('method') == 'JSONRPC.Version':
+            return {'result': {'version': {'major': 12, 'minor': 4, 'patch': 0}}}
+        method = kwargs.get('params').get('filter').get('id')
+        if method not in self.methods:
+            return {'error': {'code': -32602, 'message': 'Invalid params.'}}
+        return {'result': {'methods': {method: self.methods.get(method)}}}
+
+    def test_probe(self):
+        probed = capabilities.get_capabilities()
+        self.assertEqual(probed.jsonrpc_version, (12, 4, 0))
+        self.assertTrue(probed.episode_filter)
+        self.assertTrue(probed.playlist_add_array)
+        # The result is kept and cannot be changed
+        self.methods = {}
+        self.assertIs(capabilities.get_capabilities(), probed)
+        self.assertRaises(AttributeError, setattr, probed, 'episode_filter', False)
+
+    def test_probe_older(self):
+        self.methods['Playlist.Add'] = {'params': [{'name': 'playlistid'}, {'name': 'item', '$ref': 'Playlist.Item'}]}
+        del self.methods['VideoLibrary.GetEpisodes']
+        probed = capabilities.probe()
+        self.assertFalse(probed.episode_filter)
+        self.assertFalse(probed.playlist_add_array)
+
+
+if __name__ == '__main__':
+    unittest.main()
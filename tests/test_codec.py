@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v2.0 (see COPYING or https://www.gnu.org/licenses/gpl-2.0.txt)
+
+# pylint: disable=missing-docstring
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+import json
+import os
+import timeit
+import unittest
+from base64 import b64encode
+from zlib import compress
+from resources.lib import codec
+
+
+def episode(idx, plot):
+    return {
+        'episodeid': idx,
+        'tvshowid': 12,
+        'title': 'Épisode %d' % idx,
+        'art': {
+            'thumb': 'https://image.provider.example/episodes/%d/thumb.jpg?width=1280&height=720' % idx,
+            'tvshow.clearart': 'https://image.provider.example/shows/12/clearart.png',
+            'tvshow.clearlogo': 'https://image.provider.example/shows/12/clearlogo.png',
+            'tvshow.fanart': 'https://image.provider.example/shows/12/fanart.jpg?width=1920&height=1080',
+            'tvshow.landscape': 'https://image.provider.example/shows/12/landscape.jpg',
+            'tvshow.poster': 'https://image.provider.example/shows/12/poster.jpg?width=1000&height=1500',
+        },
+        'season': 2,
+        'episode': idx,
+        'showtitle': 'Ünïcode Show',
+        'plot': plot,
+        'playcount': 0,
+        'rating': 8.1,
+        'firstaired': '2021-03-%02d' % idx,
+        'runtime': 2580,
+    }
+
+
+PAYLOADS = {
+    # A typical payload with short plots
+    'typical': {
+        'current_episode': episode(4, 'A short plot.'),
+        'next_episode': episode(5, 'Another short plot.'),
+        'play_info': {'episode_id': 'b1e3c4d5-0f6e-4a7b-8c9d-0e1f2a3b4c5d', 'stream_type': 'dash'},
+        'notification_time': 45,
+    },
+    # Long plots and a play_url with a signed token
+    'large': {
+        'current_episode': episode(4, 'Lorem ipsum dolor sit amet, consectetur adipiscing elit. ' * 20),
+        'next_episode': episode(5, 'Sed ut perspiciatis unde omnis iste natus error sit voluptatem. ' * 20),
+        'play_url': 'plugin://plugin.video.provider/play/?id=5&token=%s' % ('0123456789abcdef' * 32),
+        'notification_offset': 120,
+    },
+}
+
+
+class TestCodec(unittest.TestCase):
+
+    def test_roundtrip(self):
+        for encoding in codec.CODECS:
+            for payload in PAYLOADS.values():
+                encoded = codec.encode(payload, encoding)
+                self.assertEqual(codec.decode(encoded), (payload, encoding))
+
+    def test_header(self):
+        self.assertTrue(codec.encode('Fòöbàr', 'zlib').startswith('upnext/1/zlib:'))
+        # Legacy encodings stay readable by older add-ons
+        self.assertEqual(codec.encode('Fòöbàr', 'base64'), 'IkZcdTAwZjJcdTAwZjZiXHUwMGUwciI=')
+        self.assertEqual(codec.encode('Fòöbàr', 'hex'), '22465c75303066325c7530306636625c75303065307222')
+        self.assertEqual(codec.decode('upnext/1/base64:IkZcdTAwZjJcdTAwZjZiXHUwMGUwciI='), ('Fòöbàr', 'base64'))
+
+    def test_detect(self):
+        self.assertEqual(codec.detect('7b7d'), ('hex', 0))
+        self.assertEqual(codec.detect('e30='), ('base64', 0))
+        self.assertEqual(codec.detect('upnext/1/zlib:eJyrrgUAAXUA+Q=='), ('zlib', 14))
+        self.assertEqual(codec.detect('upnext/2/zlib:eJyrrgUAAXUA+Q=='), (None, 0))
+        self.assertEqual(codec.detect('upnext/1/brotli:abcd'), (None, 0))
+        self.assertEqual(codec.detect('{"not": "encoded"}'), (None, 0))
+        self.assertEqual(codec.detect('e30'), (None, 0))
+
+    def test_unknown(self):
+        self.assertEqual(codec.encode('Fòöbàr', 'rot13'), None)
+        self.assertRaises(codec.PayloadError, codec.decode, '{"not": "encoded"}')
+        self.assertRaises(codec.PayloadError, codec.decode, 'upnext/1/zlib:AAAA')
+
+    def test_size_guard(self):
+        self.assertRaises(codec.PayloadError, codec.encode, 'x' * (codec.MAX_SIZE + 1), 'base64')
+        self.assertRaises(codec.PayloadError, codec.decode, 'A' * (codec.MAX_SIZE + 4))
+        # A small compressed payload that inflates far beyond the limit
+        bomb = 'upnext/1/zlib:%s' % b64encode(compress(b'"' + b' ' * 50 * codec.MAX_SIZE + b'"', 9)).decode()
+        self.assertLess(len(bomb), codec.MAX_SIZE)
+        self.assertRaises(codec.PayloadError, codec.decode, bomb)
+
+    def test_compression(self):
+        for payload in PAYLOADS.values():
+            sizes = {encoding: len(codec.encode(payload, encoding)) for encoding in codec.CODECS}
+            self.assertLess(sizes.get('zlib'), sizes.get('base64'))
+            self.assertLess(sizes.get('base64'), sizes.get('hex'))
+
+
+@unittest.skipUnless(os.environ.get('UPNEXT_BENCHMARKS'), 'set UPNEXT_BENCHMARKS=1 to run benchmarks')
+class TestCodecBenchmark(unittest.TestCase):
+    """Compare encoded size and decode time of each codec on realistic provider payloads"""
+
+    def test_benchmark(self):
+        number = 200
+        for name, payload in sorted(PAYLOADS.items()):
+            json_size = len(json.dumps(payload))
+            for encoding in sorted(codec.CODECS):
+                encoded = codec.encode(payload, encoding)
+                seconds = timeit.timeit(lambda encoded=encoded: codec.decode(encoded), number=number) / number
+                print('\n%s payload (%d bytes JSON): %s %d bytes (%.2fx), decode %.1fus' % (
+                    name, json_size, encoding, len(encoded), len(encoded) / json_size, seconds * 1e6), end='')
+
+
+if __name__ == '__main__':
+    unittest.main()
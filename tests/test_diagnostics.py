@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v2.0 (see COPYING or https://www.gnu.org/licenses/gpl-2.0.txt)
+
+# pylint: disable=missing-docstring,protected-access
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from resources.lib import diagnostics, script, utils
+
+
+class TestDiagnostics(unittest.TestCase):
+
+    def setUp(self):
+        self.profile = tempfile.mkdtemp()
+        self.path = os.path.join(self.profile, diagnostics.Diagnostics.FILENAME)
+        diagnostics.Diagnostics._shared_state.clear()
+        self.diagnostics = diagnostics.Diagnostics()
+
+    def tearDown(self):
+        diagnostics.Diagnostics._shared_state.clear()
+        shutil.rmtree(self.profile)
+
+    def test_ring_buffer(self):
+        for idx in range(diagnostics.Diagnostics.MAX_EVENTS + 10):
+            self.diagnostics.record('jsonrpc', method='Player.GetItem', idx=idx)
+        events = self.diagnostics.snapshot()
+        self.assertEqual(len(events), diagnostics.Diagnostics.MAX_EVENTS)
+        self.assertEqual(events[0].get('data'), {'method': 'Player.GetItem', 'idx': 10})
+        self.assertEqual(events[-1].get('event'), 'jsonrpc')
+        self.assertEqual(events[-1].get('thread'), 'MainThread')
+
+    def test_record_is_cheap(self):
+        start = time.time()
+        for _ in range(10000):
+            self.diagnostics.record('tracking', enabled=True)
+        self.assertLess((time.time() - start) / 10000, 0.0001)
+
+    def test_error_dump(self):
+        self.assertIsNone(self.diagnostics.pending_dump())
+        self.diagnostics.record('tracking', enabled=True)
+        self.diagnostics.error('playback error', playing_next=True)
+        self.diagnostics.error('skipped', reason='VideoLibrary.GetEpisodes')
+        self.assertEqual(self.diagnostics.pending_dump(), 'playback error')
+
+        self.assertTrue(self.diagnostics.save(self.path, 'playback error', health={'plugin.video.test': {'failures': 3}}))
+        with io.open(self.path, encoding='utf-8') as fdesc:
+            dump = json.load(fdesc)
+        self.assertEqual(dump.get('reason'), 'playback error')
+        self.assertEqual([event.get('event') for event in dump.get('events')], ['tracking', 'playback error', 'skipped'])
+        self.assertEqual(dump.get('health').get('plugin.video.test').get('failures'), 3)
+
+        # Errors right after a dump are only kept in the buffer
+        self.diagnostics.error('playback error', playing_next=False)
+        self.assertIsNone(self.diagnostics.pending_dump())
+        self.diagnostics.dumped -= diagnostics.Diagnostics.DUMP_INTERVAL
+        self.assertEqual(self.diagnostics.pending_dump(), 'playback error')
+
+    def test_jsonrpc_events(self):
+        slow = utils.JSONRPC_SLOW
+        events = utils.Diagnostics().events
+        events.clear()
+        # Fast calls are only counted in the metrics
+        utils.jsonrpc(method='Settings.GetSettingValue', params={'setting': 'locale.language'})
+        self.assertEqual(len(events), 0)
+        utils.JSONRPC_SLOW = -1
+        try:
+            utils.jsonrpc(method='Settings.GetSettingValue', params={'setting': 'locale.language'})
+            self.assertEqual(len(events), 1)
+            # The calls made for logging are skipped, every log line would add an event
+            utils.log('Message', name='test')
+            self.assertEqual(len(events), 1)
+        finally:
+            utils.JSONRPC_SLOW = slow
+        snapshot = utils.Diagnostics().snapshot()
+        self.assertEqual(snapshot[-1].get('event'), 'jsonrpc slow')
+        self.assertEqual(snapshot[-1].get('data').get('method'), 'Settings.GetSettingValue')
+
+    def test_script_route(self):
+        sent = []
+        event = script.event
+        script.event = lambda **kwargs: sent.append(kwargs)
+        try:
+            script.run(['script_entry.py', 'dump_diagnostics'])
+        finally:
+            script.event = event
+        self.assertEqual(sent, [{'message': 'upnext_dump_diagnostics'}])
+
+
+if __name__ == '__main__':
+    unittest.main()
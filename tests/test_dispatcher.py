@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v2.0 (see COPYING or https://www.gnu.org/licenses/gpl-2.0.txt)
+
+# pylint: disable=missing-docstring
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+import json
+import threading
+import unittest
+from resources.lib import dispatcher, utils
+
+
+class TestEventDispatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.batches = []
+        self.busy = 0
+        self.invalid = ()
+        self.delivered = threading.Event()
+        self.execute = utils.executeJSONRPC
+        self.jsonrpc_batch = dispatcher.jsonrpc_batch
+        utils.executeJSONRPC = self.fake_execute
+        dispatcher.jsonrpc_batch = utils.jsonrpc_batch
+        dispatcher.EventDispatcher._shared_state.clear()  # pylint: disable=protected-access
+        self.dispatcher = dispatcher.EventDispatcher()
+        dispatcher.Metrics().reset()
+        setattr(self.dispatcher, 'RETRY_DELAY', 0.01)
+
+    def tearDown(self):
+        self.dispatcher.stop()
+        utils.executeJSONRPC = self.execute
+        dispatcher.jsonrpc_batch = self.jsonrpc_batch
+        dispatcher.EventDispatcher._shared_state.clear()  # pylint: disable=protected-access
+
+    def fake_execute(self, request):
+        requests = json.loads(request)
+        if not isinstance(requests, list):
+            return self.execute(request)
+        self.batches.append([item.get('params').get('message') for item in requests])
+        if self.busy:
+            self.busy -= 1
+            # Kodi answers a batch with an error per request it could not handle
+            responses = [{'error': {'code': -32100, 'message': 'Failed to execute method.'}, 'id': item.get('id'), 'jsonrpc': '2.0'}
+                         for item in requests]
+        else:
+            responses = [{'id': item.get('id'), 'jsonrpc': '2.0', 'result': 'OK'} for item in requests]
+        for response, item in zip(responses, requests):
+            if item.get('params').get('message') in self.invalid:
+                response.pop('result', None)
+                response['error'] = {'code': -32602, 'message': 'Invalid params.'}
+        self.delivered.set()
+        return json.dumps(responses)
+
+    def test_transition_batch(self):
+        self.dispatcher.hold()
+        self.dispatcher.send('NEXTUPWATCHEDSIGNAL', {'episodeid': 1})
+        self.dispatcher.send('other_signal', {'episodeid': 1})
+        self.assertEqual(self.batches, [])
+        # The play command is not held back
+        self.dispatcher.send('plugin.video.one_play_action', {'episode_id': 2}, sender='upnextprovider', urgent=True)
+        self.assertEqual(self.batches, [['plugin.video.one_play_action']])
+        self.dispatcher.release()
+        self.assertEqual(self.batches[1], ['NEXTUPWATCHEDSIGNAL', 'other_signal'])
+
+    def test_worker_thread(self):
+        self.dispatcher.start()
+        self.dispatcher.hold()
+        self.dispatcher.send('NEXTUPWATCHEDSIGNAL', {'episodeid': 1})
+        self.dispatcher.send('NEXTUPWATCHEDSIGNAL', {'episodeid': 2})
+        self.dispatcher.send('plugin.video.one_play_action', {'episode_id': 2}, sender='upnextprovider', urgent=True)
+        self.assertTrue(self.delivered.wait(2))
+        self.delivered.clear()
+        self.dispatcher.release()
+        self.assertTrue(self.delivered.wait(2))
+        self.assertEqual(self.batches, [['plugin.video.one_play_action'], ['NEXTUPWATCHEDSIGNAL', 'NEXTUPWATCHEDSIGNAL']])
+
+    def test_retry(self):
+        self.busy = 2
+        self.dispatcher.send('NEXTUPWATCHEDSIGNAL', {'episodeid': 1})
+        self.assertEqual(len(self.batches), 3)
+        self.assertEqual(dispatcher.Metrics().snapshot().get('counters').get('dispatcher.failed'), None)
+
+        self.busy = 3
+        self.dispatcher.send('NEXTUPWATCHEDSIGNAL', {'episodeid': 1})
+        self.assertEqual(len(self.batches), 6)
+        self.assertEqual(dispatcher.Metrics().snapshot().get('counters').get('dispatcher.failed'), 1)
+
+    def test_permanent_error(self):
+        # An invalid request fails on every attempt, it is dropped while the other events are retried
+        self.busy = 1
+        self.invalid = ('invalid_signal',)
+        self.dispatcher.hold()
+        self.dispatcher.send('invalid_signal', {'episodeid': 1})
+        self.dispatcher.send('NEXTUPWATCHEDSIGNAL', {'episodeid': 1})
+        self.dispatcher.release()
+        self.assertEqual(self.batches, [['invalid_signal', 'NEXTUPWATCHEDSIGNAL'], ['NEXTUPWATCHEDSIGNAL']])
+        counters = dispatcher.Metrics().snapshot().get('counters')
+        self.assertEqual(counters.get('dispatcher.dropped'), 1)
+        self.assertEqual(counters.get('dispatcher.failed'), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v2.0 (see COPYING or https://www.gnu.org/licenses/gpl-2.0.txt)
+
+# pylint: disable=missing-docstring
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+import io
+import shutil
+import tempfile
+import time
+import unittest
+from resources.lib import health
+
+SENDER = 'plugin.video.provider'
+
+
+class TestProviderHealth(unittest.TestCase):
+
+    def setUp(self):
+        self.profile = tempfile.mkdtemp()
+        self.addon_profile = health.addon_profile
+        health.addon_profile = lambda: self.profile
+        health.ProviderHealth._shared_state.clear()  # pylint: disable=protected-access
+        self.health = health.ProviderHealth()
+
+    def tearDown(self):
+        health.addon_profile = self.addon_profile
+        health.ProviderHealth._shared_state.clear()  # pylint: disable=protected-access
+        shutil.rmtree(self.profile)
+
+    def restart(self):
+        health.ProviderHealth._shared_state.clear()  # pylint: disable=protected-access
+        self.health = health.ProviderHealth()
+
+    def test_decode_failures(self):
+        for _ in range(health.ProviderHealth.FAILURE_THRESHOLD - 1):
+            self.health.decode_failed(SENDER)
+        self.assertFalse(self.health.is_open(SENDER))
+        self.health.decode_failed(SENDER)
+        self.assertTrue(self.health.is_open(SENDER))
+        self.assertFalse(self.health.is_open('plugin.video.other'))
+        self.assertEqual(self.health.snapshot().get(SENDER).get('decode_errors'), health.ProviderHealth.FAILURE_THRESHOLD)
+
+    def test_time_to_playback(self):
+        self.health.decode_failed(SENDER)
+        self.health.play_sent(SENDER)
+        self.health.playback_started()
+        record = self.health.snapshot().get(SENDER)
+        self.assertEqual(record.get('playbacks'), 1)
+        self.assertEqual(record.get('failures'), 0)
+        self.assertLess(record.get('time_to_playback'), 1)
+        # Playback without a play event is not counted
+        self.health.playback_started()
+        self.assertEqual(self.health.snapshot().get(SENDER).get('playbacks'), 1)
+
+    def test_save_on_change(self):
+        saved = []
+        save = self.health.save
+        setattr(self.health, 'save', lambda: saved.append(True) or save())
+        self.health.decode_failed(SENDER)
+        self.assertEqual(len(saved), 1)
+        # The first playback resets the failures, later playbacks only update the statistics
+        for _ in range(3):
+            self.health.play_sent(SENDER)
+            self.health.playback_started()
+        self.assertEqual(len(saved), 2)
+        self.health.flush()
+        self.health.flush()
+        self.assertEqual(len(saved), 3)
+        self.restart()
+        self.assertEqual(self.health.snapshot().get(SENDER).get('playbacks'), 3)
+
+    def test_timeouts(self):
+        setattr(self.health, 'PLAY_TIMEOUT', 0.05)
+        for _ in range(health.ProviderHealth.FAILURE_THRESHOLD):
+            self.health.play_sent(SENDER)
+            self.health.check_timeout()
+            time.sleep(0.06)
+            self.health.check_timeout()
+        self.assertEqual(self.health.snapshot().get(SENDER).get('timeouts'), health.ProviderHealth.FAILURE_THRESHOLD)
+        self.assertTrue(self.health.is_open(SENDER))
+
+    def test_half_open(self):
+        for _ in range(health.ProviderHealth.FAILURE_THRESHOLD):
+            self.health.decode_failed(SENDER)
+        setattr(self.health, 'OPEN_TIME', 0)
+        self.assertFalse(self.health.is_open(SENDER))
+        # A single failure opens the breaker again, a playback closes it
+        self.health.decode_failed(SENDER)
+        self.assertIsNotNone(self.health.snapshot().get(SENDER).get('opened'))
+        self.health.play_sent(SENDER)
+        self.health.playback_started()
+        self.assertIsNone(self.health.snapshot().get(SENDER).get('opened'))
+
+    def test_persistence(self):
+        for _ in range(health.ProviderHealth.FAILURE_THRESHOLD):
+            self.health.decode_failed(SENDER)
+        self.restart()
+        self.assertTrue(self.health.is_open(SENDER))
+
+        # Records saved before a failure reason existed
+        with io.open(self.health.path, 'w', encoding='utf-8') as fdesc:
+            fdesc.write('{"%s": {"failures": 1, "opened": null}}' % SENDER)
+        self.restart()
+        self.health.failed(SENDER, 'timeouts')
+        self.assertEqual(self.health.snapshot().get(SENDER).get('timeouts'), 1)
+        self.assertEqual(self.health.snapshot().get(SENDER).get('failures'), 2)
+
+        with io.open(self.health.path, 'w', encoding='utf-8') as fdesc:
+            fdesc.write('{"truncated": ')
+        self.restart()
+        self.assertEqual(self.health.snapshot(), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
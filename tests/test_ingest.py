@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v2.0 (see COPYING or https://www.gnu.org/licenses/gpl-2.0.txt)
+
+# pylint: disable=missing-docstring
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+import threading
+import time
+import unittest
+from resources.lib import ingest
+
+
+class TestNotificationQueue(unittest.TestCase):
+
+    def setUp(self):
+        ingest.Metrics().reset()
+        self.handled = []
+        self.done = threading.Event()
+        self.kept = set()
+        self.queue = ingest.NotificationQueue(self.handler, is_duplicate=lambda sender, digest: (sender, digest) in self.kept)
+
+    def tearDown(self):
+        self.queue.stop()
+
+    def handler(self, sender, data, digest, duplicate):
+        self.handled.append((sender, data, duplicate))
+        self.kept.add((sender, digest))
+        if data == 'done':
+            self.done.set()
+
+    def test_put_returns_immediately(self):
+        def slow_handler(sender, data, digest, duplicate):  # pylint: disable=unused-argument
+            time.sleep(0.5)
+            self.done.set()
+
+        self.queue.handler = slow_handler
+        self.queue.start()
+        start = time.time()
+        self.queue.put('plugin.video.one', 'payload')
+        self.assertLess(time.time() - start, 0.1)
+        self.assertTrue(self.done.wait(2))
+
+    def test_coalesce_per_sender(self):
+        for idx in range(10):
+            self.queue.put('plugin.video.one', 'payload %d' % idx)
+        self.queue.put('plugin.video.two', 'payload')
+        self.queue.put('plugin.video.one', 'done')
+        self.queue.start()
+        self.assertTrue(self.done.wait(2))
+        self.assertEqual(self.handled, [('plugin.video.two', 'payload', False), ('plugin.video.one', 'done', False)])
+        self.assertEqual(ingest.Metrics().snapshot().get('counters').get('ingest.coalesced'), 10)
+
+    def test_deduplicate(self):
+        self.queue.put('plugin.video.one', 'payload')
+        self.queue.put('plugin.video.two', 'done')
+        self.queue.start()
+        self.assertTrue(self.done.wait(2))
+        self.done.clear()
+        # Resent payloads that are still kept are flagged, so the handler can skip decoding them
+        self.queue.put('plugin.video.one', 'payload')
+        self.queue.put('plugin.video.three', 'done')
+        self.assertTrue(self.done.wait(2))
+        self.assertEqual([(sender, duplicate) for sender, _, duplicate in self.handled],
+                         [('plugin.video.one', False), ('plugin.video.two', False), ('plugin.video.one', True), ('plugin.video.three', False)])
+        self.assertEqual(ingest.Metrics().snapshot().get('counters').get('ingest.duplicates'), 1)
+
+        timings = ingest.Metrics().snapshot().get('timings')
+        self.assertEqual(timings.get('ingest.latency').get('count'), 4)
+
+    def test_duplicates_counted_once(self):
+        self.kept.add(('plugin.video.one', ingest.content_hash('payload')))
+        # A resent payload coalesced with itself is handled once, and counted as one duplicate
+        self.queue.put('plugin.video.one', 'payload')
+        self.queue.put('plugin.video.one', 'payload')
+        self.queue.put('plugin.video.two', 'done')
+        self.queue.start()
+        self.assertTrue(self.done.wait(2))
+        counters = ingest.Metrics().snapshot().get('counters')
+        self.assertEqual(counters.get('ingest.coalesced'), 1)
+        self.assertEqual(counters.get('ingest.duplicates'), 1)
+
+    def test_handler_errors(self):
+        def failing_handler(sender, data, digest, duplicate):  # pylint: disable=unused-argument
+            if data != 'done':
+                raise ValueError('Not JSON')
+            self.done.set()
+
+        self.queue.handler = failing_handler
+        self.queue.start()
+        self.queue.put('plugin.video.one', 'garbage')
+        self.queue.put('plugin.video.two', 'done')
+        self.assertTrue(self.done.wait(2))
+        self.assertEqual(ingest.Metrics().snapshot().get('counters').get('ingest.errors'), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
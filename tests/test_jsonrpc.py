@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v2.0 (see COPYING or https://www.gnu.org/licenses/gpl-2.0.txt)
+
+# pylint: disable=missing-docstring
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+import json
+import os
+import threading
+import time
+import unittest
+from resources.lib import utils
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2 and PyPy
+    tracemalloc = None
+
+EPISODE = ('{"art":{"thumb":"image://video@%%2fshows%%2fshow%(idx)d.mkv/","tvshow.fanart":"image://fanart.jpg/"},'
+           '"episode":%(idx)d,"episodeid":%(idx)d,"file":"/shows/show%(idx)d.mkv","firstaired":"2020-01-01",'
+           '"label":"1x%(idx)02d. Episode %(idx)d","playcount":0,"plot":"%(plot)s","rating":7.5,"runtime":2700,'
+           '"season":1,"showtitle":"Show","title":"Episode %(idx)d","tvshowid":1}')
+PLOT = 'Lorem ipsum dolor sit amet, consectetur adipiscing elit. ' * 30
+
+
+def episodes_response(count):
+    episodes = ','.join(EPISODE % {'idx': idx, 'plot': PLOT} for idx in range(1, count + 1))
+    return '{"id":0,"jsonrpc":"2.0","result":{"episodes":[%s],"limits":{"end":%d,"start":0,"total":%d}}}' % (episodes, count, count)
+
+
+def find_next(episodes, current_episode_id):
+    found_match = False
+    for episode in episodes:
+        if found_match:
+            return episode
+        if episode.get('episodeid') == current_episode_id:
+            found_match = True
+    return None
+
+
+class TestJsonrpcItems(unittest.TestCase):
+
+    def test_iter_result_items(self):
+        response = episodes_response(5)
+        items = list(utils.iter_result_items(response, 'episodes'))
+        self.assertEqual(items, json.loads(response).get('result').get('episodes'))
+
+    def test_iter_result_items_whitespace(self):
+        response = json.dumps({'id': 0, 'jsonrpc': '2.0', 'result': {'limits': {'total': 2}, 'tvshows': [
+            {'label': 'A "quoted" [show]', 'tvshowid': 1},
+            {'label': 'B', 'tvshowid': 2},
+        ]}}, indent=4)
+        items = list(utils.iter_result_items(response, 'tvshows'))
+        self.assertEqual([item.get('tvshowid') for item in items], [1, 2])
+
+    def test_iter_result_items_empty(self):
+        self.assertEqual(list(utils.iter_result_items('{"id":0,"jsonrpc":"2.0","result":{"episodes":[]}}', 'episodes')), [])
+        self.assertEqual(list(utils.iter_result_items('{"id":0,"jsonrpc":"2.0","result":{"limits":{}}}', 'episodes')), [])
+        self.assertEqual(list(utils.iter_result_items('{"error":{"code":-32602},"id":0,"jsonrpc":"2.0"}', 'episodes')), [])
+
+    def test_iter_result_items_truncated(self):
+        response = episodes_response(3)
+        items = utils.iter_result_items(response[:len(response) // 2], 'episodes')
+        self.assertRaises(ValueError, list, items)
+
+    def test_iter_result_items_lazy(self):
+        response = episodes_response(3)
+        # Corrupt the last episode, an early exit never decodes it
+        response = response.replace('"episodeid":3', '"episodeid":}')
+        self.assertEqual(find_next(utils.iter_result_items(response, 'episodes'), 1).get('episodeid'), 2)
+
+    def test_iter_result_items_incremental(self):
+        # Items are yielded one at a time, the first item is available before the rest of the response is decoded
+        response = episodes_response(3).replace('"episodeid":2', '"episodeid":}')
+        items = utils.iter_result_items(response, 'episodes')
+        self.assertEqual(next(items).get('episodeid'), 1)
+        self.assertRaises(ValueError, next, items)
+
+
+class TestJsonrpcPaged(unittest.TestCase):
+
+    def setUp(self):
+        self.requests = []
+        self.episodes = [{'episodeid': idx, 'season': 1, 'episode': idx} for idx in range(1, 251)]
+        self.execute = utils.executeJSONRPC
+        utils.executeJSONRPC = self.fake_execute
+        utils.PAGE_SIZES.clear()
+
+    def tearDown(self):
+        utils.executeJSONRPC = self.execute
+        utils.PAGE_SIZES.clear()
+
+    def fake_execute(self, request):
+        if 'GetEpisodes' not in request:
+            return self.execute(request)
+        request = json.loads(request)
+        self.requests.append(request)
+        limits = request.get('params').get('limits')
+        page = self.episodes[limits.get('start'):limits.get('end')]
+        return json.dumps({'id': 0, 'jsonrpc': '2.0', 'result': {'episodes': page, 'limits': dict(limits, total=len(self.episodes))}})
+
+    def test_paged_all(self):
+        items = list(utils.jsonrpc_paged('episodes', method='VideoLibrary.GetEpisodes', params={'tvshowid': 1}))
+        self.assertEqual(items, self.episodes)
+        self.assertEqual(self.requests[0].get('params').get('limits'), {'start': 0, 'end': utils.PAGE_SIZE})
+        self.assertEqual(self.requests[0].get('params').get('tvshowid'), 1)
+
+    def test_paged_early_exit(self):
+        for item in utils.jsonrpc_paged('episodes', method='VideoLibrary.GetEpisodes', params={}):
+            if item.get('episodeid') == 10:
+                break
+        self.assertEqual(len(self.requests), 1)
+
+    def test_paged_abort(self):
+        items = list(utils.jsonrpc_paged('episodes', abort=lambda: True, method='VideoLibrary.GetEpisodes', params={}))
+        self.assertEqual(len(self.requests), 1)
+        self.assertEqual(items, self.episodes[:utils.PAGE_SIZE])
+
+    def test_page_size_adapts(self):
+        utils._adapt_page_size('fast', 100, 0.001)  # pylint: disable=protected-access
+        utils._adapt_page_size('slow', 100, 10)  # pylint: disable=protected-access
+        self.assertEqual(utils.PAGE_SIZES.get('fast'), 200)
+        self.assertEqual(utils.PAGE_SIZES.get('slow'), 50)
+        utils._adapt_page_size('slow', utils.PAGE_SIZE_MIN, 10)  # pylint: disable=protected-access
+        self.assertEqual(utils.PAGE_SIZES.get('slow'), utils.PAGE_SIZE_MIN)
+
+
+class TestJsonrpcDeadline(unittest.TestCase):
+
+    def setUp(self):
+        self.tvshowid = 1
+        self.title = ''
+        self.threads = []
+        # Calls block until released, like calls to a busy Kodi
+        self.released = threading.Event()
+        self.released.set()
+        self.execute = utils.executeJSONRPC
+        self.deadlines = dict(utils.JSONRPC_DEADLINES)
+        utils.executeJSONRPC = self.fake_execute
+        utils.JSONRPC_DEADLINES['VideoLibrary.GetTVShowDetails'] = 0.1
+        utils.JSONRPC_CACHE.clear()
+        self.cache_bytes = utils.JSONRPC_CACHE_BYTES
+        utils.Metrics().reset()
+
+    def tearDown(self):
+        self.released.set()
+        self.drain()
+        utils.executeJSONRPC = self.execute
+        utils.JSONRPC_DEADLINES.clear()
+        utils.JSONRPC_DEADLINES.update(self.deadlines)
+        utils.JSONRPC_CACHE.clear()
+        utils.JSONRPC_CACHE_BYTES = self.cache_bytes
+
+    @staticmethod
+    def drain():
+        # Calls run in order on the worker thread, wait for the calls that missed their deadline
+        drained = threading.Event()
+        utils._submit(drained.set)  # pylint: disable=protected-access
+        drained.wait(5)
+
+    def fake_execute(self, request):
+        if 'Player.GetProperties' in request:
+            self.released.wait()
+            return json.dumps({'id': 0, 'jsonrpc': '2.0', 'result': {'position': self.tvshowid}})
+        if 'GetTVShowDetails' not in request:
+            return self.execute(request)
+        self.threads.append(threading.current_thread())
+        self.released.wait()
+        details = {'tvshowid': self.tvshowid, 'title': self.title} if self.title else {'tvshowid': self.tvshowid}
+        return json.dumps({'id': 0, 'jsonrpc': '2.0', 'result': {'tvshowdetails': details}})
+
+    def get_details(self):
+        return utils.jsonrpc(method='VideoLibrary.GetTVShowDetails', params={'tvshowid': 1})
+
+    def test_within_deadline(self):
+        self.assertEqual(self.get_details().get('result').get('tvshowdetails'), {'tvshowid': 1})
+        timings = utils.Metrics().snapshot().get('timings')
+        self.assertEqual(timings.get('jsonrpc.VideoLibrary.GetTVShowDetails').get('count'), 1)
+
+    def test_single_worker(self):
+        self.get_details()
+        utils.JSONRPC_CACHE.clear()
+        self.get_details()
+        # Calls with a deadline reuse one worker thread
+        self.assertEqual(len(self.threads), 2)
+        self.assertIs(self.threads[0], self.threads[1])
+        self.assertIsNot(self.threads[0], threading.current_thread())
+
+    def test_timeout(self):
+        self.released.clear()
+        self.assertRaises(utils.JsonRpcTimeout, self.get_details)
+        self.assertEqual(utils.Metrics().snapshot().get('counters').get('jsonrpc.timeouts'), 1)
+
+    def test_stale_response(self):
+        self.get_details()
+        self.released.clear()
+        self.tvshowid = 2
+        self.assertEqual(self.get_details().get('result').get('tvshowdetails'), {'tvshowid': 1})
+        self.assertEqual(utils.Metrics().snapshot().get('counters').get('jsonrpc.stale'), 1)
+        # The late response replaces the earlier one once it completes
+        self.released.set()
+        self.drain()
+        self.released.clear()
+        self.tvshowid = 3
+        self.assertEqual(self.get_details().get('result').get('tvshowdetails'), {'tvshowid': 2})
+
+    def test_cache_bytes(self):
+        utils.JSONRPC_CACHE_BYTES = 200
+        for tvshowid in range(1, 4):
+            utils.jsonrpc(method='VideoLibrary.GetTVShowDetails', params={'tvshowid': tvshowid})
+        # The oldest responses are dropped to stay within the byte limit
+        self.assertEqual(len(utils.JSONRPC_CACHE), 2)
+        self.assertLessEqual(sum(len(response) for response in utils.JSONRPC_CACHE.values()), 200)
+        self.assertFalse(any('"tvshowid": 1}' in payload for payload in utils.JSONRPC_CACHE))
+
+        # A response larger than the limit is not kept, and drops the earlier response
+        request = {'method': 'VideoLibrary.GetTVShowDetails', 'params': {'tvshowid': 3}}
+        self.title = 'x' * 200
+        utils.jsonrpc(**request)
+        self.assertEqual(len(utils.JSONRPC_CACHE), 1)
+        self.released.clear()
+        self.assertRaises(utils.JsonRpcTimeout, utils.jsonrpc, **request)
+
+    def test_no_stale_player_state(self):
+        # The answer to the same player request changes for every episode, an earlier answer is never used
+        utils.JSONRPC_DEADLINES['Player.GetProperties'] = 0.1
+        request = {'method': 'Player.GetProperties', 'params': {'playerid': 1, 'properties': ['position']}}
+        self.assertEqual(utils.jsonrpc(**request).get('result'), {'position': 1})
+        self.released.clear()
+        self.assertRaises(utils.JsonRpcTimeout, utils.jsonrpc, **request)
+        self.assertEqual(len(utils.JSONRPC_CACHE), 0)
+
+
+@unittest.skipUnless(os.environ.get('UPNEXT_BENCHMARKS'), 'set UPNEXT_BENCHMARKS=1 to run benchmarks')
+class TestJsonrpcBenchmark(unittest.TestCase):
+    """Compare a full json.loads() against the lazy decoder on a synthetic 50 MB GetEpisodes response"""
+
+    @classmethod
+    def setUpClass(cls):
+        count = 50 * 1024 * 1024 // len(EPISODE % {'idx': 1000, 'plot': PLOT})
+        cls.response = episodes_response(count)
+
+    @classmethod
+    def tearDownClass(cls):
+        del cls.response
+
+    def full_decode(self):
+        return find_next(json.loads(self.response).get('result', {}).get('episodes', []), 10)
+
+    def lazy_decode(self):
+        return find_next(utils.iter_result_items(self.response, 'episodes'), 10)
+
+    def test_decode_time(self):
+        start = time.time()
+        expected = self.full_decode()
+        full_time = time.time() - start
+
+        start = time.time()
+        episode = self.lazy_decode()
+        lazy_time = time.time() - start
+
+        print('\n%.1f MB response: json.loads %.3fs, lazy decode %.6fs' % (len(self.response) / 1024 / 1024, full_time, lazy_time))
+        self.assertEqual(episode, expected)
+
+    @unittest.skipIf(tracemalloc is None, 'tracemalloc is not available')
+    def test_decode_memory(self):
+        tracemalloc.start()
+        self.full_decode()
+        full_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        tracemalloc.start()
+        self.lazy_decode()
+        lazy_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        print('\n%.1f MB response: json.loads peak %.1f MB, lazy decode peak %.3f MB' % (
+            len(self.response) / 1024 / 1024, full_peak / 1024 / 1024, lazy_peak / 1024 / 1024))
+
+
+if __name__ == '__main__':
+    unittest.main()
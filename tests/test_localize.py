@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v2.0 (see COPYING or https://www.gnu.org/licenses/gpl-2.0.txt)
+
+# pylint: disable=invalid-name,missing-docstring
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+import unittest
+from datetime import datetime
+from resources.lib import utils
+
+
+class TestLocalize(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+        self.regions = {'dateshort': '%d/%m/%Y', 'time': '%H%H:%M:%S'}
+        self.getRegion = utils.getRegion
+        utils.getRegion = self.fake_get_region
+        utils.clear_locale_cache()
+
+    def tearDown(self):
+        utils.getRegion = self.getRegion
+        utils.clear_locale_cache()
+
+    def fake_get_region(self, key):
+        self.calls.append(key)
+        return self.regions.get(key)
+
+    def test_localize_date(self):
+        self.assertEqual(utils.localize_date('2020-01-31'), '31/01/2020')
+        self.assertEqual(utils.localize_date('2020-02-01'), '01/02/2020')
+        self.assertEqual(utils.localize_date('unknown'), 'unknown')
+        self.assertEqual(utils.localize_date('2020-01-31'), '31/01/2020')
+        self.assertEqual(self.calls, ['dateshort'])
+
+    def test_localize_time(self):
+        now = datetime(2020, 1, 31, 21, 45, 10)
+        for _ in range(10):
+            self.assertEqual(utils.localize_time(now), '21:45')
+        self.assertEqual(self.calls, ['time'])
+
+    def test_locale_change(self):
+        self.assertEqual(utils.localize_date('2020-01-31'), '31/01/2020')
+        self.regions['dateshort'] = '%Y-%m-%d'
+        utils.clear_locale_cache()
+        self.assertEqual(utils.localize_date('2020-01-31'), '2020-01-31')
+        self.assertEqual(self.calls, ['dateshort', 'dateshort'])
+
+
+if __name__ == '__main__':
+    unittest.main()
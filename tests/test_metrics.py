@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v2.0 (see COPYING or https://www.gnu.org/licenses/gpl-2.0.txt)
+
+# pylint: disable=missing-docstring
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from resources.lib import metrics
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        metrics.Metrics._shared_state.clear()  # pylint: disable=protected-access
+        self.metrics = metrics.Metrics()
+
+    def tearDown(self):
+        metrics.Metrics._shared_state.clear()  # pylint: disable=protected-access
+
+    def test_histogram(self):
+        for seconds in (0.001, 0.002, 0.02, 0.03, 0.04, 0.3, 20):
+            self.metrics.timing('jsonrpc.VideoLibrary.GetEpisodes', seconds)
+        timing = self.metrics.snapshot().get('timings').get('jsonrpc.VideoLibrary.GetEpisodes')
+        self.assertEqual(timing.get('count'), 7)
+        self.assertEqual(timing.get('buckets'), [2, 0, 1, 2, 0, 0, 1, 0, 0, 0, 0, 1])
+        self.assertEqual(metrics.percentile(timing, 0.5), 0.05)
+        self.assertEqual(metrics.percentile(timing, 1), 20)
+
+    def test_sessions(self):
+        self.metrics.count('jsonrpc.Player.GetItem.errors')
+        self.metrics.size('jsonrpc.Player.GetItem.response', 100)
+        self.metrics.start_session()
+        self.metrics.count('jsonrpc.Player.GetItem.errors')
+        self.metrics.size('jsonrpc.Player.GetItem.response', 300)
+        snapshot = self.metrics.snapshot()
+        self.assertEqual(snapshot.get('counters').get('jsonrpc.Player.GetItem.errors'), 2)
+        self.assertEqual(snapshot.get('sizes').get('jsonrpc.Player.GetItem.response'), {'count': 2, 'total': 400, 'max': 300})
+        self.assertEqual(snapshot.get('session').get('sizes').get('jsonrpc.Player.GetItem.response').get('total'), 300)
+        self.assertEqual(snapshot.get('last_session').get('counters').get('jsonrpc.Player.GetItem.errors'), 1)
+
+    def test_save_and_summary(self):
+        self.metrics.timing('jsonrpc.Player.GetItem', 0.02)
+        self.metrics.size('jsonrpc.Player.GetItem.response', 512)
+        self.metrics.count('jsonrpc.timeouts')
+        profile = tempfile.mkdtemp()
+        try:
+            path = os.path.join(profile, 'addon_data', 'metrics.json')
+            self.assertTrue(self.metrics.save(path))
+            with io.open(path, encoding='utf-8') as fdesc:
+                saved = json.load(fdesc)
+        finally:
+            shutil.rmtree(profile)
+        self.assertEqual(saved.get('timings').get('jsonrpc.Player.GetItem').get('count'), 1)
+        self.assertEqual(self.metrics.summary(), [
+            'jsonrpc.Player.GetItem: 1 calls, 0.020s total, 20.0ms avg, p95 <= 25ms, max 20.0ms, 512 bytes received',
+            'jsonrpc.timeouts=1',
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v2.0 (see COPYING or https://www.gnu.org/licenses/gpl-2.0.txt)
+
+# pylint: disable=missing-docstring
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+import json
+import unittest
+from resources.lib import monitor, utils
+
+SENDER = 'plugin.video.test'
+PAYLOAD = {
+    'current_episode': {'episodeid': 1, 'tvshowid': 1, 'showtitle': 'Show', 'season': 1, 'episode': 1},
+    'next_episode': {'episodeid': 2, 'tvshowid': 1, 'showtitle': 'Show', 'season': 1, 'episode': 2},
+    'play_info': {'episode_id': 2},
+}
+
+
+class TestAddonData(unittest.TestCase):
+
+    def setUp(self):
+        self.monitor = monitor.UpNextMonitor()
+        self.data = json.dumps([utils.encode_data(PAYLOAD)])
+        self.decoded = []
+        self.decode_json = monitor.decode_json
+        monitor.decode_json = self.counting_decode_json
+
+    def tearDown(self):
+        monitor.decode_json = self.decode_json
+        self.monitor.player.disable_tracking()
+        self.monitor.api.reset_addon_data()
+
+    def counting_decode_json(self, data):
+        self.decoded.append(data)
+        return self.decode_json(data)
+
+    def test_resent_data(self):
+        self.monitor.handle_addon_data(SENDER, self.data, 'digest')
+        self.assertTrue(self.monitor.player.is_tracking())
+
+        # Playback was stopped and resumed, the add-on resends the same data
+        self.monitor.player.disable_tracking()
+        self.monitor.api.reset_addon_data()
+        self.monitor.handle_addon_data(SENDER, self.data, 'digest', duplicate=True)
+        self.assertTrue(self.monitor.player.is_tracking())
+        self.assertEqual(self.monitor.api.data.get('next_episode').get('episode'), 2)
+        self.assertEqual(len(self.decoded), 1)
+
+
+class TestPlaybackManager(unittest.TestCase):
+
+    def test_lazy_playback_manager(self):
+        mon = monitor.UpNextMonitor()
+        mon.player.enable_tracking()
+        session = mon.player.state.session
+        # The playback manager is built on first use during playback, this must not reset the playback state
+        self.assertIsNotNone(mon.playback_manager)
+        self.assertTrue(mon.player.is_tracking())
+        self.assertIs(mon.player.state.session, session)
+        self.assertFalse(session.is_cancelled())
+        mon.player.disable_tracking()
+
+    def test_prefetch_once(self):
+        manager = monitor.UpNextMonitor().playback_manager
+        manager.state.reset()
+        calls = []
+        setattr(manager, 'handle_prefetch', lambda: calls.append(manager.state.prefetched_file))
+        try:
+            # The monitor loop asks on every tick of the lead time, the next episode is prepared once per file
+            for _ in range(3):
+                manager.prefetch('/shows/show1.mkv')
+            manager.prefetch('/shows/show2.mkv')
+        finally:
+            del manager.handle_prefetch
+        self.assertEqual(calls, ['/shows/show1.mkv', '/shows/show2.mkv'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v2.0 (see COPYING or https://www.gnu.org/licenses/gpl-2.0.txt)
+
+# pylint: disable=missing-docstring
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+import json
+import unittest
+from resources.lib import playlistmirror
+
+
+class FakePlayList:
+
+    def __init__(self, playlistid):
+        self.playlistid = playlistid
+
+    @staticmethod
+    def getposition():
+        return 2
+
+    @staticmethod
+    def size():
+        return 300
+
+
+class TestPlaylistMirror(unittest.TestCase):
+
+    def setUp(self):
+        self.requests = []
+        self.items = [{'id': idx, 'label': 'Item %d' % idx, 'type': 'episode'} for idx in range(300)]
+        self.saved = playlistmirror.jsonrpc, playlistmirror.PlayList
+        playlistmirror.jsonrpc = self.fake_jsonrpc
+        playlistmirror.PlayList = FakePlayList
+        playlistmirror.PlaylistMirror._shared_state.clear()  # pylint: disable=protected-access
+        self.mirror = playlistmirror.PlaylistMirror()
+
+    def tearDown(self):
+        playlistmirror.jsonrpc, playlistmirror.PlayList = self.saved
+        playlistmirror.PlaylistMirror._shared_state.clear()  # pylint: disable=protected-access
+
+    def fake_jsonrpc(self, **kwargs):
+        self.requests.append(kwargs)
+        limits = kwargs.get('params').get('limits')
+        return {'result': {'items': self.items[limits.get('start'):limits.get('end')]}}
+
+    def notify(self, method, **data):
+        self.mirror.handle_notification(method, json.dumps(data))
+
+    def test_read_ahead(self):
+        self.assertEqual(self.mirror.get_item(1, 3).get('id'), 3)
+        for position in range(3, 3 + self.mirror.PAGE_SIZE):
+            self.assertEqual(self.mirror.get_item(1, position).get('id'), position)
+        self.assertEqual(len(self.requests), 1)
+        self.assertEqual(self.mirror.get_item(1, 3 + self.mirror.PAGE_SIZE).get('id'), 3 + self.mirror.PAGE_SIZE)
+        self.assertEqual(len(self.requests), 2)
+
+    def test_busy_kodi(self):
+        def timeout_jsonrpc(**kwargs):
+            raise playlistmirror.JsonRpcTimeout(kwargs.get('method'))
+
+        playlistmirror.jsonrpc = timeout_jsonrpc
+        self.assertEqual(self.mirror.get_item(1, 3), None)
+        playlistmirror.jsonrpc = self.fake_jsonrpc
+        self.assertEqual(self.mirror.get_item(1, 3).get('id'), 3)
+
+    def test_position_and_size(self):
+        self.assertEqual(self.mirror.get_position(1), 2)
+        self.assertEqual(self.mirror.get_size(1), 300)
+
+        self.notify('Playlist.OnRemove', playlistid=1, position=0)
+        self.assertEqual(self.mirror.get_position(1), 1)
+        self.assertEqual(self.mirror.get_size(1), 299)
+
+        self.notify('Playlist.OnAdd', playlistid=1, position=299, item={'id': 1000})
+        self.assertEqual(self.mirror.get_position(1), 1)
+        self.assertEqual(self.mirror.get_size(1), 300)
+
+        self.notify('Playlist.OnClear', playlistid=1)
+        self.assertEqual(self.mirror.get_size(1), 0)
+
+    def test_notifications_shift_items(self):
+        self.mirror.get_item(1, 3)
+        self.notify('Playlist.OnRemove', playlistid=1, position=4)
+        self.assertEqual(self.mirror.get_item(1, 3).get('id'), 3)
+        self.assertEqual(self.mirror.get_item(1, 4).get('id'), 5)
+
+        self.notify('Playlist.OnAdd', playlistid=1, position=3, item={'id': 1000})
+        self.assertEqual(self.mirror.get_item(1, 4).get('id'), 3)
+        self.assertEqual(len(self.requests), 1)
+
+        # Inserted items are read from Kodi
+        self.mirror.get_item(1, 3)
+        self.assertEqual(len(self.requests), 2)
+
+    def test_library_update(self):
+        self.mirror.get_item(1, 3)
+        self.items[4] = dict(self.items[4], playcount=1)
+        # Updates of other items, and of items that are not mirrored, keep the mirror
+        self.notify('VideoLibrary.OnUpdate', item={'id': 4, 'type': 'movie'})
+        self.notify('VideoLibrary.OnUpdate', id=100, type='episode')
+        self.assertEqual(self.mirror.get_item(1, 4).get('playcount'), None)
+        self.assertEqual(len(self.requests), 1)
+
+        # The watched episode is read from Kodi again
+        self.notify('VideoLibrary.OnUpdate', item={'id': 4, 'type': 'episode'}, playcount=1)
+        self.assertEqual(self.mirror.get_item(1, 4).get('playcount'), 1)
+        self.assertEqual(len(self.requests), 2)
+        self.assertEqual(self.mirror.get_item(1, 3).get('id'), 3)
+        self.assertEqual(len(self.requests), 2)
+
+    def test_playback_resets_playlistid(self):
+        self.mirror.playlistid = 1
+        self.mirror.get_position(1)
+        self.notify('Player.OnPlay', item={'type': 'episode', 'id': 1}, player={'playerid': 1})
+        self.assertIsNone(self.mirror.playlistid)
+        self.assertIsNone(self.mirror.playlists.get(1).get('position'))
+
+
+if __name__ == '__main__':
+    unittest.main()
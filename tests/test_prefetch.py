@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v2.0 (see COPYING or https://www.gnu.org/licenses/gpl-2.0.txt)
+
+# pylint: disable=missing-docstring
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+import unittest
+from resources.lib import addondata, api
+
+SENDER = 'plugin.video.provider'
+PAYLOAD = {
+    'current_episode': {'episodeid': 1, 'tvshowid': 1, 'showtitle': 'Show', 'season': 1, 'episode': 1},
+    'next_episode': {'episodeid': 2, 'tvshowid': 1, 'showtitle': 'Show', 'season': 1, 'episode': 2},
+    'play_info': {'episode_id': 2},
+    'id': '%s_play_action' % SENDER,
+}
+
+
+class MockProvider:
+    """Resolves streams on request, like a manifest fetch and DRM licence request"""
+
+    def __init__(self, api_instance, expires_in=60):
+        self.api = api_instance
+        self.expires_in = expires_in
+        self.resolved = 0
+        self.opened = None
+
+    def resolve(self, play_info):
+        self.resolved += 1
+        return 'https://cdn.provider.example/%(episode_id)s/manifest.mpd?token=abc' % play_info
+
+    def send(self, message, data=None, sender=None, encoding='base64', urgent=False):  # pylint: disable=unused-argument
+        if message == '%s_prepare_action' % SENDER:
+            # Reply with Other.upnext_prepared
+            self.api.addon_item_prepared(SENDER, {'play_url': self.resolve(data), 'expires_in': self.expires_in})
+        elif message == '%s_play_action' % SENDER:
+            self.opened = (self.resolve(data), 'play_action')
+
+    def jsonrpc(self, **kwargs):
+        if kwargs.get('method') == 'Player.Open':
+            self.opened = (kwargs.get('params').get('item').get('file'), 'Player.Open')
+        return {'result': {}}
+
+    def play_sent(self, sender):
+        pass
+
+
+class TestPrefetch(unittest.TestCase):
+
+    def setUp(self):
+        addondata.AddonDataRegistry._shared_state.clear()  # pylint: disable=protected-access
+        self.api = api.Api()
+        self.provider = MockProvider(self.api)
+        self.saved = api.EventDispatcher, api.ProviderHealth, api.jsonrpc
+        api.EventDispatcher = lambda: self.provider
+        api.ProviderHealth = lambda: self.provider
+        api.jsonrpc = self.provider.jsonrpc
+
+    def tearDown(self):
+        api.EventDispatcher, api.ProviderHealth, api.jsonrpc = self.saved
+        addondata.AddonDataRegistry._shared_state.clear()  # pylint: disable=protected-access
+
+    def test_without_prefetch(self):
+        self.api.addon_data_received(dict(PAYLOAD), sender=SENDER)
+        self.assertFalse(self.api.prepare_addon_item())
+        self.api.play_addon_item()
+        # The add-on resolves the stream when asked to play it
+        self.assertEqual(self.provider.opened, ('https://cdn.provider.example/2/manifest.mpd?token=abc', 'play_action'))
+        self.assertEqual(self.provider.resolved, 1)
+
+    def test_with_prefetch(self):
+        self.api.addon_data_received(dict(PAYLOAD, prefetch=True), sender=SENDER)
+        self.api.addon_data_received(dict(PAYLOAD), sender=SENDER)
+        self.api.addon_data_received(dict(PAYLOAD, prefetch=True), sender=SENDER)
+        self.assertTrue(self.api.prepare_addon_item())
+        # Only asked once per payload
+        self.assertFalse(self.api.prepare_addon_item())
+        self.assertEqual(self.provider.resolved, 1)
+
+        # The prepared stream is opened directly, without resolving it again
+        self.api.play_addon_item()
+        self.assertEqual(self.provider.opened, ('https://cdn.provider.example/2/manifest.mpd?token=abc', 'Player.Open'))
+        self.assertEqual(self.provider.resolved, 1)
+
+    def test_expired(self):
+        self.provider.expires_in = 0
+        self.api.addon_data_received(dict(PAYLOAD, prefetch=True), sender=SENDER)
+        self.api.prepare_addon_item()
+        self.api.play_addon_item()
+        self.assertEqual(self.provider.opened[1], 'play_action')
+        self.assertEqual(self.provider.resolved, 2)
+
+    def test_unrequested(self):
+        self.api.addon_data_received(dict(PAYLOAD, prefetch=True), sender=SENDER)
+        self.assertFalse(self.api.addon_item_prepared(SENDER, {'play_url': 'https://cdn.provider.example/other.mpd'}))
+        self.api.prepare_addon_item()
+        self.assertFalse(self.api.addon_item_prepared('plugin.video.other', {'play_url': 'https://cdn.other.example/2.mpd'}))
+        self.assertFalse(self.api.addon_item_prepared(SENDER, {}))
+
+
+if __name__ == '__main__':
+    unittest.main()
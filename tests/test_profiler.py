@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v2.0 (see COPYING or https://www.gnu.org/licenses/gpl-2.0.txt)
+
+# pylint: disable=missing-docstring
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from resources.lib import profiler
+
+xbmcaddon = __import__('xbmcaddon')
+
+
+def busy_popup(stopped):
+    while not stopped.is_set():
+        sum(range(1000))
+
+
+class TestSamplingProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.addon = xbmcaddon.Addon()
+        self.profile = tempfile.mkdtemp()
+        self.addon_profile = profiler.addon_profile
+        profiler.addon_profile = lambda: self.profile
+        profiler.SamplingProfiler._shared_state.clear()  # pylint: disable=protected-access
+        self.profiler = profiler.SamplingProfiler()
+
+    def tearDown(self):
+        self.profiler.stop()
+        self.addon.setSetting('samplingProfiler', '')
+        self.addon.setSetting('samplingRate', '')
+        profiler.addon_profile = self.addon_profile
+        profiler.SamplingProfiler._shared_state.clear()  # pylint: disable=protected-access
+        shutil.rmtree(self.profile)
+
+    def read_samples(self):
+        with io.open(os.path.join(self.profile, profiler.SamplingProfiler.FILENAME), encoding='utf-8') as fdesc:
+            return dict(line.rsplit(' ', 1) for line in fdesc.read().splitlines())
+
+    def test_sample(self):
+        stopped = threading.Event()
+        thread = threading.Thread(target=busy_popup, args=(stopped,), name='UpNext Popup')
+        thread.start()
+        try:
+            for _ in range(5):
+                self.profiler.sample()
+        finally:
+            stopped.set()
+            thread.join()
+        self.assertTrue(self.profiler.write())
+        stacks = [stack for stack in self.read_samples() if stack.startswith('UpNext_Popup;')]
+        self.assertTrue(stacks)
+        self.assertTrue(all('test_profiler.py:busy_popup' in stack for stack in stacks))
+
+    def test_settings(self):
+        self.profiler.configure()
+        self.assertIsNone(self.profiler.thread)
+
+        self.addon.setSetting('samplingProfiler', 'true')
+        self.addon.setSetting('samplingRate', '100')
+        self.profiler.configure()
+        thread = self.profiler.thread
+        self.assertEqual(self.profiler.rate, 100)
+        time.sleep(0.2)
+
+        # Switched off without restarting, the samples are written when the sampling thread stops
+        self.addon.setSetting('samplingProfiler', 'false')
+        self.profiler.configure()
+        thread.join(2)
+        self.assertFalse(thread.is_alive())
+        self.assertTrue(any(stack.startswith('MainThread;') for stack in self.read_samples()))
+
+    def test_profile_call(self):
+        self.assertEqual(profiler.profile_call('upnext_transition', sum, range(1000)), 499500)
+        files = sorted(os.listdir(self.profile))
+        self.assertEqual([os.path.splitext(name)[1] for name in files], ['.pstats', '.txt'])
+        with io.open(os.path.join(self.profile, files[1]), encoding='utf-8') as fdesc:
+            self.assertIn('cumulative', fdesc.read())
+
+    def test_profile_call_raises(self):
+        with self.assertRaises(ZeroDivisionError):
+            profiler.profile_call('upnext_transition', lambda: 1 / 0)
+        self.assertEqual(len(os.listdir(self.profile)), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
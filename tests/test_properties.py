@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v2.0 (see COPYING or https://www.gnu.org/licenses/gpl-2.0.txt)
+
+# pylint: disable=invalid-name,missing-docstring
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+import unittest
+from resources.lib import utils
+
+
+class TestProperties(unittest.TestCase):
+
+    def setUp(self):
+        self.windows = []
+        self.calls = []
+        self.saved = utils.Window
+        utils.Window = self.fake_window
+        utils.WINDOWS.clear()
+        utils.PROPERTIES.clear()
+
+    def tearDown(self):
+        utils.Window = self.saved
+        utils.WINDOWS.clear()
+        utils.PROPERTIES.clear()
+
+    def fake_window(self, window_id):
+        test = self
+
+        class FakeWindow:
+            @staticmethod
+            def getProperty(key):
+                test.calls.append(('get', window_id, key))
+                return 'True'
+
+            @staticmethod
+            def setProperty(key, value):
+                test.calls.append(('set', window_id, key, value))
+
+            @staticmethod
+            def clearProperty(key):
+                test.calls.append(('clear', window_id, key))
+
+        self.windows.append(window_id)
+        return FakeWindow()
+
+    def test_window_handles(self):
+        for _ in range(3):
+            utils.get_property('PseudoTVRunning')
+        utils.set_property('logLevel', 2)
+        utils.get_property('other', window_id=12005)
+        self.assertEqual(self.windows, [10000, 12005])
+
+    def test_redundant_writes(self):
+        for _ in range(3):
+            utils.set_property('logLevel', 2)
+        utils.set_property('logLevel', 1)
+        # Other properties are always written, skins and add-ons may change them too
+        utils.clear_property('service.upnext.dialog')
+        utils.clear_property('service.upnext.dialog')
+        self.assertEqual(self.calls, [
+            ('set', 10000, 'logLevel', '2'),
+            ('set', 10000, 'logLevel', '1'),
+            ('clear', 10000, 'service.upnext.dialog'),
+            ('clear', 10000, 'service.upnext.dialog'),
+        ])
+
+    def test_batch(self):
+        utils.set_property('logLevel', 2)
+        utils.set_properties({'logLevel': 2, 'service.upnext.dialog': 'true', 'other': None})
+        self.assertEqual(self.calls[1:], [
+            ('clear', 10000, 'other'),
+            ('set', 10000, 'service.upnext.dialog', 'true'),
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()
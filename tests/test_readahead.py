@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v2.0 (see COPYING or https://www.gnu.org/licenses/gpl-2.0.txt)
+
+# pylint: disable=missing-docstring
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+import os
+import tempfile
+import threading
+import unittest
+from resources.lib import readahead
+
+xbmcaddon = __import__('xbmcaddon')
+
+
+class TestReadAhead(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        with tempfile.NamedTemporaryFile(suffix='.mkv', delete=False) as fdesc:
+            fdesc.write(os.urandom(3 * 1024 * 1024))
+        cls.filename = fdesc.name
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove(cls.filename)
+
+    def setUp(self):
+        self.addon = xbmcaddon.Addon()
+        self.addon.setSetting('readAheadSize', '2')
+        readahead.ReadAhead._shared_state.clear()  # pylint: disable=protected-access
+        readahead.Metrics().reset()
+        self.readahead = readahead.ReadAhead()
+
+    def tearDown(self):
+        self.addon.setSetting('readAheadSize', '')
+        self.addon.setSetting('readAheadSmb', '')
+        readahead.ReadAhead._shared_state.clear()  # pylint: disable=protected-access
+
+    def test_protocols(self):
+        self.assertTrue(self.readahead.is_enabled('/media/usb/show/s01e01.mkv'))
+        self.assertTrue(self.readahead.is_enabled('smb://nas/show/s01e01.mkv'))
+        self.assertTrue(self.readahead.is_enabled('NFS://nas/show/s01e01.mkv'))
+        self.assertFalse(self.readahead.is_enabled('https://cdn.example/show/s01e01.mkv'))
+        self.addon.setSetting('readAheadSmb', 'false')
+        self.assertFalse(self.readahead.is_enabled('smb://nas/show/s01e01.mkv'))
+
+    def test_read(self):
+        self.readahead.run(self.filename, 2 * 1024 * 1024, threading.Event())
+        snapshot = readahead.Metrics().snapshot()
+        self.assertEqual(snapshot.get('counters').get('readahead.bytes'), 2 * 1024 * 1024)
+        self.assertEqual(snapshot.get('timings').get('readahead.read').get('count'), 1)
+        self.assertEqual(snapshot.get('timings').get('readahead.open').get('count'), 1)
+
+    def test_cancel(self):
+        calls = []
+
+        def abort():
+            calls.append(True)
+            return len(calls) > 2
+
+        self.readahead.run(self.filename, 2 * 1024 * 1024, threading.Event(), abort=abort)
+        counters = readahead.Metrics().snapshot().get('counters')
+        self.assertEqual(counters.get('readahead.cancelled'), 1)
+        self.assertEqual(counters.get('readahead.bytes'), None)
+
+    def test_start(self):
+        self.assertTrue(self.readahead.start(self.filename))
+        # The same file is only read once
+        self.assertFalse(self.readahead.start(self.filename))
+        self.readahead.cancel()
+        self.assertFalse(self.readahead.start('https://cdn.example/show/s01e01.mkv'))
+        self.addon.setSetting('readAheadSize', '0')
+        self.assertFalse(self.readahead.start(self.filename))
+
+    def test_missing_file(self):
+        self.readahead.run(self.filename + '.missing', 1024, threading.Event())
+        self.assertEqual(readahead.Metrics().snapshot().get('counters').get('readahead.errors'), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
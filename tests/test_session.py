@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v2.0 (see COPYING or https://www.gnu.org/licenses/gpl-2.0.txt)
+
+# pylint: disable=missing-docstring
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+import unittest
+from resources.lib import playbackmanager, player, session, state, utils
+
+EPISODE = {'episodeid': 2, 'tvshowid': 1, 'season': 1, 'episode': 2, 'playcount': 0}
+
+
+class TestSession(unittest.TestCase):
+
+    def test_session(self):
+        token = session.Session()
+        self.assertFalse(token.is_cancelled())
+        token.check()
+        token.cancel()
+        self.assertTrue(token.is_cancelled())
+        self.assertRaises(session.SessionCancelled, token.check)
+
+    def test_state_reset(self):
+        token = state.State().session
+        self.assertFalse(token.is_cancelled())
+        # Other components getting the state keep the playback session
+        self.assertIs(state.State().session, token)
+        self.assertFalse(token.is_cancelled())
+        # Resetting the state ends the playback session
+        state.State().reset()
+        self.assertIsNot(state.State().session, token)
+        self.assertTrue(token.is_cancelled())
+
+
+class TestPlaybackManagerSession(unittest.TestCase):
+
+    def setUp(self):
+        self.manager = playbackmanager.PlaybackManager()
+        self.calls = []
+        playbackmanager.Metrics().reset()
+        setattr(self.manager.play_item, 'get_next', self.stopped_get_next)
+        setattr(self.manager, 'launch_popup', self.launch_popup)
+
+    def tearDown(self):
+        del self.manager.play_item.get_next
+        del self.manager.launch_popup
+
+    def stopped_get_next(self):
+        # Playback stops while the next episode is looked up
+        self.manager.player.state.reset()
+        return EPISODE, 'library'
+
+    def launch_popup(self, episode, source=None):
+        self.calls.append((episode, source))
+        return True, True
+
+    def test_abandon_stale_lookup(self):
+        self.manager.launch_up_next()
+        self.assertEqual(self.calls, [])
+        self.assertFalse(self.manager.state.playing_next)
+        snapshot = playbackmanager.Metrics().snapshot()
+        self.assertEqual(snapshot.get('counters').get('session.cancelled'), 1)
+        self.assertEqual(snapshot.get('timings').get('session.wasted').get('count'), 1)
+
+    def test_running_session(self):
+        setattr(self.manager.play_item, 'get_next', lambda: (EPISODE, 'library'))
+        self.manager.launch_up_next()
+        self.assertEqual(self.calls, [(EPISODE, 'library')])
+        self.assertTrue(self.manager.state.playing_next)
+
+
+class TestPopupSession(unittest.TestCase):
+
+    def setUp(self):
+        self.manager = playbackmanager.PlaybackManager()
+        self.manager.state.reset()
+        self.manager.session = self.manager.state.session
+        self.closed = []
+        self.cleared = []
+        self.patched = {
+            'UpNext': playbackmanager.UpNext,
+            'StillWatching': playbackmanager.StillWatching,
+            'clear_property': playbackmanager.clear_property,
+        }
+        playbackmanager.UpNext = self.dialog('next_up')
+        playbackmanager.StillWatching = self.dialog('still_watching')
+        playbackmanager.clear_property = self.cleared.append
+        setattr(self.manager, 'show_popup_and_wait', self.stopped_popup)
+
+    def tearDown(self):
+        for name, value in self.patched.items():
+            setattr(playbackmanager, name, value)
+        del self.manager.show_popup_and_wait
+
+    def dialog(self, name):
+        closed = self.closed
+
+        class Dialog(object):  # pylint: disable=useless-object-inheritance
+            def __init__(self, *args):
+                pass
+
+            @staticmethod
+            def close():
+                closed.append(name)
+        return Dialog
+
+    def stopped_popup(self, episode, next_up_page, still_watching_page):  # pylint: disable=unused-argument
+        # Playback stops while the popup is shown
+        self.manager.state.reset()
+        return True, False
+
+    def test_close_stale_popup(self):
+        self.assertRaises(playbackmanager.SessionCancelled, self.manager.launch_popup, EPISODE, 'playlist')
+        self.assertEqual(self.closed, ['next_up', 'still_watching'])
+        self.assertEqual(self.cleared, ['service.upnext.dialog'])
+
+
+class TestPlayerSession(unittest.TestCase):
+
+    def setUp(self):
+        self.player = player.UpNextPlayer()
+        setattr(self.player.api, 'dequeue_items', self.timeout)
+
+    def tearDown(self):
+        del self.player.api.dequeue_items
+
+    @staticmethod
+    def timeout(count):
+        raise utils.JsonRpcTimeout('Playlist.Remove')
+
+    def test_stopped_after_timeout(self):
+        self.player.state.queue = [EPISODE]
+        token = self.player.state.session
+        # The playlist cleanup missed its deadline, the playback session still ends
+        self.assertRaises(utils.JsonRpcTimeout, self.player.onPlayBackStopped)
+        self.assertTrue(token.is_cancelled())
+        self.assertEqual(self.player.state.queue, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
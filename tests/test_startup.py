@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v2.0 (see COPYING or https://www.gnu.org/licenses/gpl-2.0.txt)
+
+# pylint: disable=missing-docstring
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+# Run in a fresh interpreter, modules imported by other tests would hide the imports and import cost of the service
+STARTUP = '''
+import json, sys, time
+start = time.time()
+from monitor import UpNextMonitor
+imported = time.time()
+monitor = UpNextMonitor()
+ticks = []
+monitor.waitForAbort = lambda timeout: ticks.append(time.time()) or True
+monitor.run()
+print(json.dumps(dict(import_time=imported - start, first_tick=ticks[0] - start, ticks=len(ticks), modules=sorted(sys.modules))))
+'''
+# Modules only needed once an episode nears its end
+DEFERRED_MODULES = ('codec', 'datetime', 'demo', 'platform', 'playbackmanager', 'playitem', 'stillwatching', 'texturecache', 'upnext')
+
+
+def run_service():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([os.path.join(root, 'resources', 'lib'), os.path.join(root, 'tests')]))
+    output = subprocess.check_output([sys.executable, '-c', STARTUP], cwd=root, env=env)
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+class TestStartup(unittest.TestCase):
+
+    def test_deferred_imports(self):
+        result = run_service()
+        # The service reached its loop without importing the popup modules
+        self.assertEqual(result.get('ticks'), 1)
+        self.assertEqual([module for module in DEFERRED_MODULES if module in result.get('modules')], [])
+
+
+@unittest.skipUnless(os.environ.get('UPNEXT_BENCHMARKS'), 'set UPNEXT_BENCHMARKS=1 to run benchmarks')
+class TestStartupBenchmark(unittest.TestCase):
+
+    def test_startup(self):
+        result = run_service()
+        print('\nService import time %.3fs, time to first tick %.3fs' % (result.get('import_time'), result.get('first_tick')))
+
+
+if __name__ == '__main__':
+    unittest.main()
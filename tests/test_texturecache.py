@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v2.0 (see COPYING or https://www.gnu.org/licenses/gpl-2.0.txt)
+
+# pylint: disable=missing-docstring
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+import os
+import threading
+import unittest
+from resources.lib import texturecache
+
+ART = {
+    'thumb': 'image://https%3a%2f%2fimage.example%2fthumb.jpg/',
+    'tvshow.clearlogo': 'https://image.example/clearlogo.png',
+    'tvshow.fanart': 'https://image.example/fanart.jpg',
+    'tvshow.landscape': 'https://image.example/landscape.jpg',
+    'tvshow.poster': 'https://image.example/poster.jpg',
+}
+
+
+class TestTextureCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cached = {'https://image.example/fanart.jpg'}
+        self.opened = []
+        self.saved = texturecache.addon_path, texturecache.jsonrpc
+        texturecache.addon_path = os.getcwd
+        texturecache.jsonrpc = self.fake_jsonrpc
+        texturecache.TextureCache._shared_state.clear()  # pylint: disable=protected-access
+        texturecache.Metrics().reset()
+        self.cache = texturecache.TextureCache()
+
+    def tearDown(self):
+        texturecache.addon_path, texturecache.jsonrpc = self.saved
+        texturecache.TextureCache._shared_state.clear()  # pylint: disable=protected-access
+
+    def fake_jsonrpc(self, **kwargs):
+        url = kwargs.get('params').get('filter').get('value')
+        textures = [{'cachedurl': 'a/b.jpg', 'textureid': 1}] if url in self.cached else []
+        return {'id': 0, 'jsonrpc': '2.0', 'result': {'limits': {}, 'textures': textures}}
+
+    def fake_cache(self, url):
+        self.opened.append(texturecache.wrap_image_url(url))
+
+    def test_image_urls(self):
+        self.assertEqual(texturecache.wrap_image_url('https://image.example/a b.jpg'), 'image://https%3A%2F%2Fimage.example%2Fa%20b.jpg/')
+        self.assertEqual(texturecache.unwrap_image_url('image://https%3a%2f%2fimage.example%2fthumb.jpg/'), 'https://image.example/thumb.jpg')
+        self.assertEqual(texturecache.unwrap_image_url('image://video@%2fshows%2fs01e01.mkv/'), 'image://video@%2fshows%2fs01e01.mkv/')
+        self.assertEqual(texturecache.unwrap_image_url('/local/fanart.jpg'), '/local/fanart.jpg')
+
+    def test_skin_art(self):
+        # Only artwork the popup windows actually show is cached
+        self.assertEqual(self.cache.get_skin_art('script-upnext-upnext-simple.xml'), [])
+        self.assertEqual(self.cache.get_skin_art('script-upnext-upnext.xml'), ['tvshow.fanart', 'tvshow.landscape', 'thumb'])
+
+    def test_skin_file(self):
+        checked = []
+        saved = texturecache.exists, texturecache.getSkinDir
+        texturecache.exists = lambda path: checked.append(path) or False
+        try:
+            # The paths are resolved once per skin
+            path = self.cache.skin_file('script-upnext-upnext.xml')
+            self.assertEqual(self.cache.skin_file('script-upnext-upnext.xml'), path)
+            self.assertEqual(len(checked), len(texturecache.TextureCache.SKIN_FOLDERS))
+            texturecache.getSkinDir = lambda: 'skin.other'
+            self.cache.skin_file('script-upnext-upnext.xml')
+            self.assertEqual(len(checked), 2 * len(texturecache.TextureCache.SKIN_FOLDERS))
+        finally:
+            texturecache.exists, texturecache.getSkinDir = saved
+
+    def test_prewarm(self):
+        setattr(self.cache, 'cache', self.fake_cache)
+        urls = self.cache.prewarm(ART, ('script-upnext-upnext.xml', 'script-upnext-stillwatching.xml'))
+        self.assertEqual(urls, ['https://image.example/fanart.jpg', 'https://image.example/landscape.jpg',
+                                'image://https%3a%2f%2fimage.example%2fthumb.jpg/'])
+        for thread in threading.enumerate():
+            if thread.name == 'UpNextTextureCache':
+                thread.join(2)
+        self.assertEqual(self.opened, ['image://https%3A%2F%2Fimage.example%2Flandscape.jpg/',
+                                       'image://https%3a%2f%2fimage.example%2fthumb.jpg/'])
+        counters = texturecache.Metrics().snapshot().get('counters')
+        self.assertEqual(counters.get('texturecache.hits'), 1)
+        self.assertEqual(counters.get('texturecache.misses'), 2)
+
+        # Artwork is only checked once
+        self.assertEqual(self.cache.prewarm(ART, ('script-upnext-upnext.xml',)), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
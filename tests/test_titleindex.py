@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v2.0 (see COPYING or https://www.gnu.org/licenses/gpl-2.0.txt)
+
+# pylint: disable=missing-docstring
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+import json
+import unittest
+from resources.lib import titleindex
+
+TVSHOWS = [
+    {'tvshowid': 1, 'label': 'Doctor Who (1963)', 'title': 'Doctor Who (1963)'},
+    {'tvshowid': 2, 'label': 'Doctor Who (2005)', 'title': 'Doctor Who (2005)'},
+    {'tvshowid': 3, 'label': 'The Office (US)', 'title': 'The Office (US)'},
+    {'tvshowid': 4, 'label': 'Pokémon', 'title': 'Pokémon'},
+    {'tvshowid': 5, 'label': 'Fargo (2014)', 'title': 'Fargo (2014)'},
+]
+
+
+class TestTitleIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.scans = 0
+        self.details = {}
+        self.jsonrpc_paged = titleindex.jsonrpc_paged
+        self.jsonrpc = titleindex.jsonrpc
+        titleindex.jsonrpc_paged = self.fake_jsonrpc_paged
+        titleindex.jsonrpc = self.fake_jsonrpc
+        titleindex.TitleIndex._shared_state.clear()  # pylint: disable=protected-access
+        self.index = titleindex.TitleIndex()
+
+    def tearDown(self):
+        titleindex.jsonrpc_paged = self.jsonrpc_paged
+        titleindex.jsonrpc = self.jsonrpc
+        titleindex.TitleIndex._shared_state.clear()  # pylint: disable=protected-access
+
+    def fake_jsonrpc_paged(self, key, abort=None, **kwargs):  # pylint: disable=unused-argument
+        self.scans += 1
+        return iter(TVSHOWS)
+
+    def fake_jsonrpc(self, **kwargs):
+        tvshowid = kwargs.get('params').get('tvshowid')
+        return {'result': {'tvshowdetails': self.details.get(tvshowid)}}
+
+    def test_normalize_title(self):
+        self.assertEqual(titleindex.normalize_title('  The  Office (US) '), 'the office (us)')
+        self.assertEqual(titleindex.normalize_title('Pokémon'), titleindex.normalize_title('Poke\u0301mon'))
+        self.assertEqual(titleindex.normalize_title(b'Pok\xc3\xa9mon'), 'pokémon')
+
+    def test_lookup(self):
+        self.assertEqual(self.index.get_tvshowid('Doctor Who (2005)'), 2)
+        self.assertEqual(self.index.get_tvshowid('DOCTOR WHO (1963)'), 1)
+        self.assertEqual(self.index.get_tvshowid('the office (us)'), 3)
+        self.assertEqual(self.index.get_tvshowid('Pokémon'), 4)
+        self.assertEqual(self.index.get_tvshowid('Unknown'), None)
+        self.assertEqual(self.scans, 1)
+
+    def test_year_variants(self):
+        # Add-ons often send titles without the year suffix used in the library, or vice versa
+        self.assertEqual(self.index.get_tvshowid('Fargo'), 5)
+        self.assertEqual(self.index.get_tvshowid('Pokémon (1997)'), 4)
+        # Ambiguous variants do not match
+        self.assertEqual(self.index.get_tvshowid('Doctor Who'), None)
+
+    def test_ambiguous_variant_removed(self):
+        self.assertEqual(self.index.get_tvshowid('Doctor Who'), None)
+        # Once one of the remakes is removed, the variant matches the other one
+        self.index.handle_notification('VideoLibrary.OnRemove', json.dumps({'id': 1, 'type': 'tvshow'}))
+        self.assertEqual(self.index.get_tvshowid('Doctor Who'), 2)
+        self.index.handle_notification('VideoLibrary.OnRemove', json.dumps({'id': 2, 'type': 'tvshow'}))
+        self.assertEqual(self.index.get_tvshowid('Doctor Who'), None)
+        self.assertEqual(self.index.variants.get('doctor who'), None)
+
+    def test_notifications(self):
+        self.index.get_tvshowid('Fargo')
+        self.details[5] = {'label': 'Fargo (1996)', 'title': 'Fargo (1996)'}
+        self.index.handle_notification('VideoLibrary.OnUpdate', json.dumps({'item': {'id': 5, 'type': 'tvshow'}}))
+        self.assertEqual(self.index.get_tvshowid('Fargo (2014)'), None)
+        self.assertEqual(self.index.get_tvshowid('Fargo (1996)'), 5)
+
+        self.details[6] = {'label': 'Severance', 'title': 'Severance'}
+        self.index.handle_notification('VideoLibrary.OnUpdate', json.dumps({'id': 6, 'type': 'tvshow'}))
+        self.assertEqual(self.index.get_tvshowid('severance'), 6)
+
+        self.index.handle_notification('VideoLibrary.OnRemove', json.dumps({'id': 4, 'type': 'tvshow'}))
+        self.assertEqual(self.index.get_tvshowid('Pokémon'), None)
+        self.assertEqual(self.index.get_tvshowid('Pokémon (1997)'), None)
+
+        # Episode updates are ignored
+        self.index.handle_notification('VideoLibrary.OnRemove', json.dumps({'id': 3, 'type': 'episode'}))
+        self.assertEqual(self.index.get_tvshowid('The Office (US)'), 3)
+        self.assertEqual(self.scans, 1)
+
+    def test_deferred_update(self):
+        self.index.get_tvshowid('Fargo')
+        self.details[5] = {'label': 'Fargo (1996)', 'title': 'Fargo (1996)'}
+        setattr(self.index, 'update', self.fail_update)
+        # Notifications are handled on Kodi's notification thread, they must not call JSON-RPC
+        self.index.handle_notification('VideoLibrary.OnUpdate', json.dumps({'item': {'id': 5, 'type': 'tvshow'}}))
+        self.assertEqual(self.index.changed, {5: True})
+        del self.index.update
+        self.assertEqual(self.index.get_tvshowid('Fargo'), 5)
+        self.assertEqual(self.index.get_tvshowid('Fargo (2014)'), None)
+        self.assertEqual(self.index.changed, {})
+
+    def test_update_timeout(self):
+        self.index.get_tvshowid('Fargo')
+        self.details[5] = {'label': 'Fargo (1996)', 'title': 'Fargo (1996)'}
+        titleindex.jsonrpc = self.timeout_jsonrpc
+        self.index.handle_notification('VideoLibrary.OnUpdate', json.dumps({'item': {'id': 5, 'type': 'tvshow'}}))
+        # The busy library keeps the old entry, and the update is tried again on the next lookup
+        self.assertEqual(self.index.get_tvshowid('Fargo (2014)'), 5)
+        self.assertEqual(self.index.changed, {5: True})
+        titleindex.jsonrpc = self.fake_jsonrpc
+        self.assertEqual(self.index.get_tvshowid('Fargo (1996)'), 5)
+
+    @staticmethod
+    def timeout_jsonrpc(**kwargs):
+        raise titleindex.JsonRpcTimeout(kwargs.get('method'))
+
+    def test_remove_all_keys(self):
+        self.index.get_tvshowid('Fargo')
+        # Keys from an earlier title are left behind when a show is renamed outside of our notifications
+        getattr(self.index, '_add')(5, 'Fargo (2015)')
+        self.index.handle_notification('VideoLibrary.OnRemove', json.dumps({'id': 5, 'type': 'tvshow'}))
+        self.assertEqual(self.index.get_tvshowid('Fargo'), None)
+        self.assertEqual(self.index.get_tvshowid('Fargo (2014)'), None)
+        self.assertEqual(self.index.get_tvshowid('Fargo (2015)'), None)
+
+    def fail_update(self, tvshowid):
+        self.fail('Update of TV show %s on the notification thread' % tvshowid)
+
+    def test_aborted_build(self):
+        self.assertEqual(self.index.get_tvshowid('Fargo', abort=lambda: True), 5)
+        self.assertFalse(self.index.built)
+        self.index.get_tvshowid('Fargo')
+        self.assertEqual(self.scans, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
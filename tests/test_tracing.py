@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v2.0 (see COPYING or https://www.gnu.org/licenses/gpl-2.0.txt)
+
+# pylint: disable=missing-docstring
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from resources.lib import tracing
+
+
+class TestTracer(unittest.TestCase):
+
+    def setUp(self):
+        tracing.Tracer._shared_state.clear()  # pylint: disable=protected-access
+        self.tracer = tracing.Tracer()
+
+    def tearDown(self):
+        tracing.Tracer._shared_state.clear()  # pylint: disable=protected-access
+
+    def test_transition(self):
+        self.tracer.new_session()
+        self.tracer.instant('notification', total_time=1800)
+        with self.tracer.span('popup'):
+            time.sleep(0.01)
+        self.tracer.start('transition')
+        self.tracer.start('transition')
+        self.assertIsNotNone(self.tracer.finish('transition'))
+        self.assertIsNone(self.tracer.finish('transition'))
+
+        events = list(self.tracer.events)
+        self.assertEqual([(event.get('name'), event.get('ph')) for event in events],
+                         [('notification', 'i'), ('popup', 'X'), ('transition', 'X')])
+        self.assertGreaterEqual(events[1].get('dur'), 10000)
+        self.assertEqual(events[0].get('args'), {'total_time': 1800, 'session': 1})
+
+    def test_abandoned(self):
+        self.tracer.pending['transition'] = time.time() - 2 * self.tracer.MAX_PENDING
+        self.assertIsNone(self.tracer.finish('transition'))
+        self.tracer.pending['transition'] = time.time() - 2 * self.tracer.MAX_PENDING
+        self.tracer.start('transition')
+        self.assertLess(self.tracer.finish('transition'), 1)
+
+    def test_export_request(self):
+        self.assertFalse(self.tracer.pending_export())
+        # Transitions end on Kodi's callback thread, the service loop writes the file
+        self.tracer.request_export()
+        self.assertTrue(self.tracer.pending_export())
+        self.assertFalse(self.tracer.pending_export())
+
+    def test_export(self):
+        with self.tracer.span('lookup'):
+            pass
+        profile = tempfile.mkdtemp()
+        try:
+            path = os.path.join(profile, 'trace.json')
+            self.assertTrue(self.tracer.export(path))
+            with io.open(path, encoding='utf-8') as fdesc:
+                trace = json.load(fdesc)
+        finally:
+            shutil.rmtree(profile)
+        self.assertEqual(trace.get('displayTimeUnit'), 'ms')
+        metadata, event = trace.get('traceEvents')
+        self.assertEqual(event.get('name'), 'lookup')
+        self.assertIsInstance(event.get('tid'), int)
+        self.assertEqual(metadata, {'name': 'thread_name', 'ph': 'M', 'pid': event.get('pid'), 'tid': event.get('tid'), 'args': {'name': 'MainThread'}})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -253,6 +253,11 @@ def getInfoLabel(key):
     return INFO_LABELS.get(key)
 
 
+def getSkinDir():
+    ''' A reimplementation of the xbmc getSkinDir() function '''
+    return 'skin.estuary'
+
+
 def getLocalizedString(msgctxt):
     ''' A reimplementation of the xbmc getLocalizedString() function '''
     for entry in PO:
@@ -203,7 +203,7 @@ class Window:
     def addControl(self, pControl):
         ''' A stub implementation for the xbmcgui Window class addControl() method '''
 
-    def clearProperty(self):
+    def clearProperty(self, key):
         ''' A stub implementation for the xbmcgui Window class clearProperty() method '''
 
     def close(self):
@@ -215,7 +215,7 @@ class Window:
         return ControlLabel(0, 0, 1920, 1080, 'StubLabel')
 
     @staticmethod
-    def getProperty():
+    def getProperty(key):  # pylint: disable=unused-argument
         ''' A stub implementation for the xbmcgui Window class getProperty() method '''
         return ''
 
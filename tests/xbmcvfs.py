@@ -18,7 +18,7 @@ class File:
         else:
             mode = 'rb'
 
-        self._file = io.open(path, mode=mode, encoding='utf-8')  # pylint: disable=consider-using-with
+        self._file = io.open(path, mode=mode)  # pylint: disable=consider-using-with
 
     def __enter__(self):
         return self